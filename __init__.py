@@ -2,26 +2,89 @@
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from model import db
+from model import db, migrate
+from database import configure_database
+from query_stats import query_stats
+from metrics import metrics
+from like_buffer import like_buffer
+from uploads import StreamedRequest
+from images import image_pipeline
+from filters import filter_engine
+from image_index import image_index
+from search_index import user_search
+from availability import availability
+from timeline import timelines
+from storage_backends import media_storage
+from cache import fragment_cache
+from user_cache import user_cache
+from hashing import password_hasher
+from sessions import session_manager
 from flask_restful import Api
 from endpoints import add_routes  # Import your API route handlers
+from api_v1 import add_api_routes
 from config import DevelopmentConfig
 
 
 def create_app(config_class=DevelopmentConfig):
     # Initialize the Flask app
     app = Flask ( __name__ )
+    app.request_class = StreamedRequest  # Stream multipart uploads to disk
 
     # Load configuration
     app.config.from_object ( config_class )
 
     # Initialize the database and migration object
+    configure_database ( app )  # Connection pool settings and the optional read replica
     db.init_app ( app )
+    migrate.init_app ( app, db )
+
+    # Count and time SQL per request (Server-Timing headers, query budgets)
+    query_stats.init_app ( app )
+
+    # Request latency / in-flight metrics, served at /metrics
+    metrics.init_app ( app )
+
+    # Initialize the write-behind like buffer (only active when LIKE_BUFFER_ENABLED is set)
+    like_buffer.init_app ( app )
+
+    # Initialize the upload storage backend (local disk or an S3-compatible object store)
+    media_storage.init_app ( app )
+
+    # Initialize the background thumbnail / responsive-variant pipeline
+    image_pipeline.init_app ( app )
+
+    # Initialize the server-side image filter engine used by add_post
+    filter_engine.init_app ( app )
+
+    # Initialize the perceptual-hash index for near-duplicate post images
+    image_index.init_app ( app )
+
+    # Initialize the in-memory username / nickname search index
+    user_search.init_app ( app )
+
+    # Initialize the Bloom filters in front of the username / email / number checks
+    availability.init_app ( app )
+
+    # Initialize the materialized home timelines and their fan-out worker
+    timelines.init_app ( app )
+
+    # Initialize the rendered-fragment cache for feed tiles
+    fragment_cache.init_app ( app )
+
+    # Initialize the user / profile record cache
+    user_cache.init_app ( app )
+
+    # Initialize the password hashing worker pool
+    password_hasher.init_app ( app )
+
+    # Keep sessions server-side; the cookie only carries a session ID
+    session_manager.init_app ( app )
 
     # Initialize the API
     api = Api ( app )
 
     # Register your routes (assumes `add_routes` is a function in endpoints.py that sets up API routes)
     add_routes ( api )
+    add_api_routes ( api )  # Versioned JSON API under /api/v1
 
     return app
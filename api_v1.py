@@ -0,0 +1,347 @@
+import gzip
+import hashlib
+import json
+
+from flask import current_app, make_response, request, session
+from flask_restful import Resource
+from sqlalchemy.orm import joinedload
+
+from database import replica_reads
+from feed import get_home_page, get_posts_page, get_latest_comments, get_comments_page, get_liked_post_ids, parse_cursor
+from image_index import image_index, to_unsigned
+from images import image_src
+from like_buffer import like_buffer
+from model import Post, User
+from user_cache import user_cache
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+# Every route of this API lives under this prefix
+API_PREFIX = '/api/v1'
+
+
+def add_api_routes(api):
+    api.add_resource ( FeedApi, f'{API_PREFIX}/feed' )  # Home feed
+    api.add_resource ( UserPostsApi, f'{API_PREFIX}/users/<int:user_id>/posts' )  # A user's posts
+    api.add_resource ( CommentsApi, f'{API_PREFIX}/posts/<int:post_id>/comments' )  # A post's comments
+    api.add_resource ( UserApi, f'{API_PREFIX}/users/<int:user_id>' )  # A user and their profile
+    api.add_resource ( SimilarPostsApi, f'{API_PREFIX}/posts/<int:post_id>/similar' )  # Near-duplicate images
+
+
+def parse_fields(value):
+    """
+    Parses a `fields=` argument such as "id,title,author.username" into a
+    tree {'id': {}, 'title': {}, 'author': {'username': {}}}.
+    Returns None when the argument is missing, meaning every field.
+    """
+    if not value:
+        return None
+    tree = {}
+    for path in value.split ( ',' ):
+        node = tree
+        for part in path.strip ().split ( '.' ):
+            if part:
+                node = node.setdefault ( part, {} )
+    return tree or None
+
+
+def wants(fields, name):
+    """
+    Returns True if the field `name` was requested (every field is when `fields` is None).
+    """
+    return fields is None or name in fields
+
+
+def select_fields(item, fields):
+    """
+    Trims a serialized dict (and nested dicts / lists of dicts) to the requested fields.
+    """
+    if fields is None:
+        return item
+    if isinstance ( item, list ):
+        return [select_fields ( value, fields ) for value in item]
+    if not isinstance ( item, dict ):
+        return item
+    return {
+        name: select_fields ( item[name], subfields or None )
+        for name, subfields in fields.items () if name in item
+    }
+
+
+def page_size():
+    """
+    Returns the `limit` argument, clamped to API_MAX_PAGE_SIZE, or None for the configured default.
+    """
+    try:
+        limit = int ( request.args.get ( 'limit' ) )
+    except (TypeError, ValueError):
+        return None
+    return max ( 1, min ( limit, current_app.config.get ( 'API_MAX_PAGE_SIZE', 100 ) ) )
+
+
+def json_response(payload, status=200):
+    """
+    Serializes `payload` to compact JSON with a weak ETag and compresses it
+    with brotli or gzip when the client accepts it.
+
+    The ETag is taken over the uncompressed body, so it is the same for every
+    encoding, and a matching If-None-Match is answered with 304 Not Modified.
+    """
+    body = json.dumps ( payload, separators=(',', ':'), default=str ).encode ( 'utf-8' )
+    etag = hashlib.sha1 ( body ).hexdigest ()
+
+    if status == 200 and request.if_none_match.contains_weak ( etag ):
+        response = make_response ( '', 304 )
+    else:
+        response = make_response ( body, status )
+        response.content_type = 'application/json'
+        if len ( body ) >= current_app.config.get ( 'API_COMPRESS_MIN_SIZE', 500 ):
+            encoding = choose_encoding ()
+            if encoding == 'br':
+                response.set_data ( brotli.compress ( body, quality=current_app.config.get ( 'API_BROTLI_QUALITY', 5 ) ) )
+            elif encoding == 'gzip':
+                response.set_data ( gzip.compress ( body, compresslevel=current_app.config.get ( 'API_GZIP_LEVEL', 6 ) ) )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+    response.set_etag ( etag, weak=True )
+    response.headers['Vary'] = 'Accept-Encoding, Cookie'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def choose_encoding():
+    """
+    Picks the best response encoding the client accepts: brotli if available, then gzip.
+    """
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def error_response(message, status):
+    return json_response ( {"success": False, "message": message}, status )
+
+
+def serialize_author(user):
+    profile = user.profile
+    return {
+        "id": user.id,
+        "username": user.username,
+        "nickname": profile.nickname if profile else None,
+        "avatar_url": image_src ( profile, 'thumb' ) if profile and profile.image_path else None,
+    }
+
+
+def serialize_comment(comment):
+    return {
+        "id": comment.id,
+        "text": comment.text,
+        "timestamp": comment.timestamp.strftime ( '%Y-%m-%d %H:%M:%S' ) if comment.timestamp else None,
+        "author": serialize_author ( comment.user ),
+    }
+
+
+def serialize_posts(posts, fields, current_user_id):
+    """
+    Serializes a page of posts. Latest comments and the viewer's like state
+    are only queried when those fields are requested.
+    """
+    post_ids = [post.id for post in posts]
+    comments = get_latest_comments ( post_ids ) if wants ( fields, 'comments' ) else {}
+    liked = get_liked_post_ids ( current_user_id, post_ids ) if wants ( fields, 'liked' ) else set ()
+
+    items = []
+    for post in posts:
+        item = {
+            "id": post.id,
+            "title": post.title,
+            "content": post.content,
+            "image_url": image_src ( post, 'feed' ),
+            "image_variants": {
+                name: {"url": image_src ( post, name ), "width": variant['width']}
+                for name, variant in (post.image_variants or {}).items ()
+            },
+            "likes_count": like_buffer.merge_count ( post.id, post.likes_count ),
+            "liked": post.id in liked,
+        }
+        if wants ( fields, 'author' ):
+            item["author"] = serialize_author ( post.author )
+        if wants ( fields, 'comments' ):
+            item["comments"] = [serialize_comment ( comment ) for comment in comments.get ( post.id, [] )]
+        items.append ( item )
+    return items
+
+
+class ApiResource ( Resource ):
+    """
+    Base class of the JSON API resources: session authentication and read-replica reads.
+    """
+
+    method_decorators = {'get': [replica_reads]}  # Read-only: may be served by the read replica
+
+    def get_current_user_id(self):
+        return session.get ( 'User_id' )
+
+
+class FeedApi ( ApiResource ):
+    """
+    The home feed (own posts and followed accounts' posts) as JSON, newest first.
+    """
+
+    def get(self):
+        """
+        Returns one page of posts older than the `before` cursor.
+
+        Query arguments: `before` (cursor from the previous page's `next_cursor`),
+        `limit` (page size) and `fields` (comma-separated, dotted for nested
+        fields, e.g. `fields=id,image_url,author.username`).
+        """
+        current_user_id = self.get_current_user_id ()
+        if not current_user_id:
+            return error_response ( "User not logged in", 401 )
+
+        fields = parse_fields ( request.args.get ( 'fields' ) )
+        posts, next_cursor = get_home_page ( current_user_id, before=parse_cursor ( request.args.get ( 'before' ) ),
+                                             page_size=page_size () )
+        return json_response ( {
+            "data": select_fields ( serialize_posts ( posts, fields, current_user_id ), fields ),
+            "next_cursor": next_cursor,
+        } )
+
+
+class UserPostsApi ( ApiResource ):
+    """
+    A user's posts as JSON, newest first.
+    """
+
+    def get(self, user_id):
+        """
+        Returns one page of the user's posts; takes the same arguments as the feed.
+        """
+        current_user_id = self.get_current_user_id ()
+        if not current_user_id:
+            return error_response ( "User not logged in", 401 )
+        if user_cache.get_user ( user_id ) is None:
+            return error_response ( "User not found", 404 )
+
+        fields = parse_fields ( request.args.get ( 'fields' ) )
+        posts, next_cursor = get_posts_page ( before=parse_cursor ( request.args.get ( 'before' ) ),
+                                              user_id=user_id, page_size=page_size () )
+        return json_response ( {
+            "data": select_fields ( serialize_posts ( posts, fields, current_user_id ), fields ),
+            "next_cursor": next_cursor,
+        } )
+
+
+class CommentsApi ( ApiResource ):
+    """
+    A post's comments as JSON, newest first.
+    """
+
+    def get(self, post_id):
+        """
+        Returns one page of comments older than the `before` cursor.
+        """
+        if not self.get_current_user_id ():
+            return error_response ( "User not logged in", 401 )
+
+        fields = parse_fields ( request.args.get ( 'fields' ) )
+        comments, next_cursor = get_comments_page ( post_id, before=parse_cursor ( request.args.get ( 'before' ) ),
+                                                    page_size=page_size () )
+        return json_response ( {
+            "data": select_fields ( [serialize_comment ( comment ) for comment in comments], fields ),
+            "next_cursor": next_cursor,
+        } )
+
+
+class UserApi ( ApiResource ):
+    """
+    A user and their profile as JSON.
+    """
+
+    def get(self, user_id):
+        """
+        Returns the user's public details from the user cache.
+        """
+        if not self.get_current_user_id ():
+            return error_response ( "User not logged in", 401 )
+
+        user = user_cache.get_user ( user_id )
+        if user is None:
+            return error_response ( "User not found", 404 )
+
+        profile = user.profile
+        fields = parse_fields ( request.args.get ( 'fields' ) )
+        return json_response ( {
+            "data": select_fields ( {
+                "id": user.id,
+                "username": user.username,
+                "post_count": user.post_count,
+                "profile": {
+                    "nickname": profile.nickname,
+                    "bio": profile.bio,
+                    "avatar_url": image_src ( profile, 'thumb' ) if profile.image_path else None,
+                } if profile else None,
+            }, fields ),
+        } )
+
+
+class SimilarPostsApi ( ApiResource ):
+    """
+    Posts whose image is a near-duplicate of a post's image, by perceptual hash.
+    """
+
+    # Largest accepted `distance`; the number of index probes grows quickly beyond it
+    MAX_DISTANCE = 16
+
+    def get(self, post_id):
+        """
+        Returns the posts within `distance` bits (default DEDUP_MAX_DISTANCE) of
+        the post's image hash, closest first, each with its `distance`.
+        Takes `limit` and `fields` like the feed.
+        """
+        current_user_id = self.get_current_user_id ()
+        if not current_user_id:
+            return error_response ( "User not logged in", 401 )
+
+        # The database, not this process's index, decides whether the post still exists
+        post = Post.query.with_entities ( Post.image_dhash ).filter ( Post.id == post_id ).first ()
+        if post is None:
+            return error_response ( "Post not found", 404 )
+        if post.image_dhash is None:
+            return error_response ( "The post's image has not been hashed", 404 )
+        image_hash = to_unsigned ( post.image_dhash )
+
+        try:
+            distance = min ( int ( request.args.get ( 'distance', image_index.max_distance ) ), self.MAX_DISTANCE )
+        except ValueError:
+            return error_response ( "distance must be an integer", 400 )
+
+        matches = image_index.query ( image_hash, max_distance=distance, exclude=post_id )
+        distances = dict ( matches )
+        limit = page_size () or current_app.config.get ( 'POSTS_PER_PAGE', 20 )
+
+        # Posts deleted by another worker may still be in this process's index,
+        # so matches are looked up a page at a time until the page is full
+        posts = []
+        for start in range ( 0, len ( matches ), limit ):
+            candidates = [match_id for match_id, _ in matches[start:start + limit]]
+            posts += Post.query.options ( joinedload ( Post.author ).selectinload ( User.profiles ) ) \
+                .filter ( Post.id.in_ ( candidates ) ).all ()
+            if len ( posts ) >= limit:
+                break
+        posts.sort ( key=lambda post: (distances[post.id], -post.id) )
+        posts = posts[:limit]
+
+        fields = parse_fields ( request.args.get ( 'fields' ) )
+        items = serialize_posts ( posts, fields, current_user_id )
+        for item in items:
+            item["distance"] = distances[item["id"]]
+        return json_response ( {"data": select_fields ( items, fields )} )
@@ -1,12 +1,12 @@
 from __init__ import create_app
-from model import db
+import flask_migrate
 
 # Create the Flask app using the factory function
 app = create_app()
 
 if __name__ == "__main__":
     with app.app_context ():
-        # db.drop_all()
-        db.create_all ()
+        # The schema comes from the migrations (see migrations/README)
+        flask_migrate.upgrade ()
     app.run ( debug=False )
 
@@ -0,0 +1,290 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import select
+
+import metrics
+from model import db, User
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; filters are then built one value at a time
+    np = None
+
+# Columns of `user` that must be unique at registration
+COLUMNS = ('username', 'email', 'number')
+# Smallest filter built, so a new site does not rebuild on every few sign-ups
+MIN_CAPACITY = 10000
+# Values hashed per NumPy step while building
+BUILD_CHUNK = 100000
+
+MASK64 = (1 << 64) - 1
+
+
+def collation_key(value):
+    """
+    Folds a value the way the database's case-insensitive collations compare
+    it: case, accents and trailing spaces are ignored. With MySQL's default
+    collations "Alice", "alice " and "alicé" all collide with "alice" on a
+    unique column, so the filters must treat them as the same value. Folding
+    more than a collation does only adds "maybe" answers, which the database
+    then settles.
+    """
+    decomposed = unicodedata.normalize ( 'NFKD', value.rstrip ( ' ' ).casefold () )
+    return ''.join ( char for char in decomposed if not unicodedata.combining ( char ) )
+
+
+def value_hashes(value):
+    """
+    Returns two independent 64-bit hashes of a value; a filter derives all its
+    bit positions from them (double hashing).
+    """
+    digest = hashlib.blake2b ( value.encode ( 'utf-8' ), digest_size=16 ).digest ()
+    return int.from_bytes ( digest[:8], 'little' ), int.from_bytes ( digest[8:], 'little' ) | 1
+
+
+class BloomFilter:
+    """
+    A Bloom filter over strings: `value in filter` is never False for an added
+    value, and True for other values with probability about `error_rate`
+    while no more than `capacity` values have been added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max ( 1, capacity )
+        self.error_rate = error_rate
+        self.size = max ( 64, math.ceil ( -self.capacity * math.log ( error_rate ) / math.log ( 2 ) ** 2 ) )
+        self.hash_count = max ( 1, round ( self.size / self.capacity * math.log ( 2 ) ) )
+        self.bits = bytearray ( (self.size + 7) // 8 )
+        self.count = 0
+
+    @classmethod
+    def from_values(cls, values, capacity, error_rate):
+        """
+        Builds a filter holding `values`; with NumPy the bits are set a chunk of values at a time.
+        """
+        bloom = cls ( capacity, error_rate )
+        if np is None:
+            for value in values:
+                bloom.add ( value )
+            return bloom
+
+        marks = np.zeros ( bloom.size, dtype=bool )
+        steps = np.arange ( bloom.hash_count, dtype=np.uint64 )
+        for start in range ( 0, len ( values ), BUILD_CHUNK ):
+            hashes = np.array ( [value_hashes ( value ) for value in values[start:start + BUILD_CHUNK]], dtype=np.uint64 )
+            # uint64 arithmetic wraps like the & MASK64 in positions()
+            positions = (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64 ( bloom.size )
+            marks[positions.ravel ()] = True
+        bloom.bits = bytearray ( np.packbits ( marks, bitorder='little' ).tobytes () )
+        bloom.count = len ( values )
+        return bloom
+
+    def positions(self, value):
+        first, second = value_hashes ( value )
+        return [((first + step * second) & MASK64) % self.size for step in range ( self.hash_count )]
+
+    def add(self, value):
+        for position in self.positions ( value ):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all ( bits[position >> 3] & (1 << (position & 7)) for position in self.positions ( value ) )
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+
+class AvailabilityFilter:
+    """
+    Per-column Bloom filters over the unique `user` columns (username, email,
+    number), answering "is this value taken?" without a query when the answer
+    is "definitely not". Values are stored and looked up by `collation_key`,
+    so a filter never rules out a value the database would consider equal.
+
+    A filter miss means no user had the value when this process last saw the
+    table; a hit ("maybe") is confirmed with an indexed lookup. Filters are
+    sized for AVAILABILITY_HEADROOM times the current user count at
+    AVAILABILITY_ERROR_RATE false positives, built in a background thread,
+    updated when this process registers a user, extended with users
+    registered by other workers every AVAILABILITY_REFRESH_INTERVAL seconds
+    and rebuilt every AVAILABILITY_REBUILD_INTERVAL seconds or once full.
+
+    Until the first build finishes every value is a "maybe", so callers fall
+    back to the database. Because a worker can briefly miss another worker's
+    new user, the unique constraints stay the final check at insert.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.error_rate = 0.01
+        self.headroom = 2.0
+        self.refresh_interval = 30
+        self.rebuild_interval = 3600
+        self._filters = None
+        self._max_user_id = 0
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._rebuilding = False
+        self._replay = []
+        self._lock = threading.RLock ()
+        self._build_lock = threading.Lock ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get ( 'AVAILABILITY_ENABLED', True )
+        self.error_rate = app.config.get ( 'AVAILABILITY_ERROR_RATE', 0.01 )
+        self.headroom = app.config.get ( 'AVAILABILITY_HEADROOM', 2.0 )
+        self.refresh_interval = app.config.get ( 'AVAILABILITY_REFRESH_INTERVAL', 30 )
+        self.rebuild_interval = app.config.get ( 'AVAILABILITY_REBUILD_INTERVAL', 3600 )
+        app.extensions['availability'] = self
+
+        if self.enabled and app.config.get ( 'AVAILABILITY_BUILD_ON_STARTUP', True ):
+            self._start_rebuild ()
+
+    def might_exist(self, column, value):
+        """
+        Returns False if no user has `value` in `column` (no query needed), True if one may.
+        """
+        if value is None:
+            return False  # NULLs never collide on a unique column
+        filters = self._current ()
+        if filters is None:
+            return True
+        with self._lock:
+            return collation_key ( value ) in filters[column]
+
+    def is_taken(self, column, value):
+        """
+        Returns True if a user has `value` in `column`, querying only when the filter cannot rule it out.
+        """
+        built = self._filters is not None
+        if not self.might_exist ( column, value ):
+            metrics.availability_checks.inc ( column, 'filtered' )
+            return False
+        taken = db.session.execute (
+            select ( User.id ).where ( getattr ( User, column ) == value ).limit ( 1 )
+        ).first () is not None
+        metrics.availability_checks.inc ( column, 'taken' if taken else 'false_positive' if built else 'unfiltered' )
+        return taken
+
+    def add_user(self, user_id, username, email, number):
+        """
+        Records a newly registered user's values.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._rebuilding:
+                self._replay.append ( (user_id, username, email, number) )
+            if self._filters is not None:
+                self._add ( self._filters, (user_id, username, email, number) )
+
+    def rebuild(self):
+        """
+        Builds fresh filters from the database and swaps them in. Checks keep
+        using the previous filters meanwhile; users added during the build are replayed.
+        """
+        if not self._build_lock.acquire ( blocking=False ):
+            return
+        try:
+            with self._lock:
+                self._rebuilding = True
+                self._replay = []
+            started = time.monotonic ()
+            values = {column: [] for column in COLUMNS}
+            users = max_user_id = 0
+            with self.app.app_context ():
+                try:
+                    for user_id, *row in self._scan ():
+                        for column, value in zip ( COLUMNS, row ):
+                            if value is not None:
+                                values[column].append ( collation_key ( value ) )
+                        users += 1
+                        max_user_id = user_id
+                finally:
+                    db.session.remove ()
+
+            capacity = max ( MIN_CAPACITY, int ( users * self.headroom ) )
+            filters = {column: BloomFilter.from_values ( values.pop ( column ), capacity, self.error_rate )
+                       for column in COLUMNS}
+
+            with self._lock:
+                self._filters = filters
+                self._max_user_id = max_user_id
+                for row in self._replay:
+                    self._add ( filters, row )
+                self._built_at = self._refreshed_at = time.monotonic ()
+            logging.info ( "Availability filters built: %d users, %d KB per column in %.1f s", users,
+                           len ( filters['username'].bits ) // 1024, time.monotonic () - started )
+        except Exception:
+            logging.exception ( "Building the availability filters failed" )
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._replay = []
+            self._build_lock.release ()
+
+    def _current(self):
+        """
+        Returns the current filters (None until built), scheduling a rebuild or a refresh when due.
+        """
+        if not self.enabled:
+            return None
+        filters = self._filters
+        now = time.monotonic ()
+        if filters is None or now - self._built_at >= self.rebuild_interval or filters['username'].saturated:
+            self._start_rebuild ()
+        elif now - self._refreshed_at >= self.refresh_interval:
+            self._refresh ( filters )
+        return filters
+
+    def _start_rebuild(self):
+        if not self._build_lock.locked ():
+            threading.Thread ( target=self.rebuild, name='availability-build', daemon=True ).start ()
+
+    def _refresh(self, filters):
+        """
+        Adds users registered by other processes since the last refresh.
+        """
+        with self._lock:
+            self._refreshed_at = time.monotonic ()
+            after = self._max_user_id
+        rows = list ( self._scan ( after=after ) )
+        with self._lock:
+            for row in rows:
+                self._add ( filters, row )
+            if rows:
+                # Only scans move the mark; a local insert may have a higher ID than another worker's
+                self._max_user_id = max ( self._max_user_id, rows[-1][0] )
+
+    def _add(self, filters, row):
+        for column, value in zip ( COLUMNS, row[1:] ):
+            if value is not None:
+                filters[column].add ( collation_key ( value ) )
+
+    def _scan(self, after=0, batch_size=10000):
+        """
+        Streams (user_id, username, email, number) for users with an ID above `after`.
+        """
+        statement = (
+            select ( User.id, User.username, User.email, User.number )
+            .where ( User.id > after )
+            .order_by ( User.id )
+            .execution_options ( yield_per=batch_size )
+        )
+        return db.session.execute ( statement )
+
+
+availability = AvailabilityFilter ()
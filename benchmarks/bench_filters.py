@@ -0,0 +1,114 @@
+"""
+Compares the add_post filter paths: the browser rendering the filter on a
+canvas and uploading a PNG, against uploading the original JPEG and applying
+the filter on the server with the NumPy filter engine.
+
+For each filter it reports the bytes uploaded and stored, and the server
+CPU time per upload (hashing and writing the upload; for the server path
+also decoding, filtering and re-encoding).
+
+Usage:
+    python benchmarks/bench_filters.py
+    python benchmarks/bench_filters.py --width 4032 --height 3024 --quality 85 --repeat 5
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+
+import numpy as np
+from PIL import Image
+
+from filters import FILTERS, apply_filter, filter_image
+
+
+def make_photo(width, height, seed=1):
+    """
+    Returns a photo-like RGB array: smooth gradients and shapes with mild sensor noise.
+    """
+    rng = np.random.default_rng ( seed )
+    y, x = np.mgrid[0:height, 0:width].astype ( np.float32 )
+    red = 128 + 100 * np.sin ( x / width * 3.1 ) * np.cos ( y / height * 2.3 )
+    green = 110 + 90 * np.cos ( (x + y) / (width + height) * 5.0 )
+    blue = 140 + 80 * np.sin ( y / height * 4.2 + 1.0 )
+    pixels = np.dstack ( (red, green, blue) ) + rng.normal ( 0, 6, (height, width, 3) )
+    return np.clip ( pixels, 0, 255 ).astype ( np.uint8 )
+
+
+def store_cost(data, directory):
+    """
+    Returns the CPU seconds the server spends hashing and writing an upload of `data`.
+    """
+    started = time.process_time ()
+    hashlib.sha256 ( data ).hexdigest ()
+    with open ( os.path.join ( directory, 'stored' ), 'wb' ) as handle:
+        handle.write ( data )
+    return time.process_time () - started
+
+
+def main():
+    parser = argparse.ArgumentParser ( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument ( '--width', type=int, default=3024 )
+    parser.add_argument ( '--height', type=int, default=2268 )
+    parser.add_argument ( '--source-quality', type=int, default=90, help="JPEG quality of the photo the user picks" )
+    parser.add_argument ( '--quality', type=int, default=85, help="FILTER_QUALITY of the server output" )
+    parser.add_argument ( '--format', default='JPEG', help="FILTER_OUTPUT_FORMAT of the server output" )
+    parser.add_argument ( '--repeat', type=int, default=3 )
+    args = parser.parse_args ()
+
+    photo = make_photo ( args.width, args.height )
+    buffer = io.BytesIO ()
+    Image.fromarray ( photo ).save ( buffer, 'JPEG', quality=args.source_quality )
+    original = buffer.getvalue ()
+
+    work_dir = tempfile.mkdtemp ()
+    source_path = os.path.join ( work_dir, 'source.jpg' )
+    output_path = os.path.join ( work_dir, 'output' )
+    with open ( source_path, 'wb' ) as handle:
+        handle.write ( original )
+
+    print ( f"{args.width}x{args.height} photo, original JPEG {len ( original ) / 1024:.0f} KB\n" )
+    print ( f"{'filter':<10} {'canvas PNG KB':>14} {'server KB':>10} {'upload saved':>13} "
+            f"{'canvas CPU ms':>14} {'server CPU ms':>14} {'filter ms':>10}" )
+
+    for name in FILTERS:
+        # Today's path: the browser filters on a canvas and uploads a PNG
+        filtered = apply_filter ( photo, name ) if FILTERS[name] else photo
+        buffer = io.BytesIO ()
+        Image.fromarray ( filtered ).save ( buffer, 'PNG' )
+        canvas_png = buffer.getvalue ()
+        canvas_cpu = min ( store_cost ( canvas_png, work_dir ) for _ in range ( args.repeat ) )
+
+        # Server path: the original is uploaded, then filtered and re-encoded here
+        server_cpu = []
+        filter_cpu = []
+        for _ in range ( args.repeat ):
+            started = time.process_time ()
+            if FILTERS[name]:
+                filter_image ( source_path, output_path, name, args.format.upper (), args.quality )
+                with open ( output_path, 'rb' ) as handle:
+                    stored = handle.read ()
+            else:
+                stored = original
+            store_cost ( stored, work_dir )
+            server_cpu.append ( time.process_time () - started )
+
+            started = time.process_time ()
+            if FILTERS[name]:
+                apply_filter ( photo, name )
+            filter_cpu.append ( time.process_time () - started )
+
+        print ( f"{name:<10} {len ( canvas_png ) / 1024:>14.0f} {len ( stored ) / 1024:>10.0f} "
+                f"{len ( canvas_png ) / len ( original ):>12.1f}x "
+                f"{canvas_cpu * 1000:>14.1f} {min ( server_cpu ) * 1000:>14.1f} {min ( filter_cpu ) * 1000:>10.1f}" )
+
+    print ( "\nupload saved: canvas PNG size / original JPEG size (the server path uploads the original)." )
+
+
+if __name__ == '__main__':
+    main ()
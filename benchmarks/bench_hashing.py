@@ -0,0 +1,96 @@
+"""
+Measures password hashing throughput: logins (hash verifications) per second,
+per core, for each hashing method, inline and through the worker pool.
+
+Usage:
+    python benchmarks/bench_hashing.py
+    python benchmarks/bench_hashing.py --methods scrypt:32768:8:1 pbkdf2:sha256:600000 --seconds 10 --clients 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+
+from flask import Flask
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from hashing import PasswordHasher, HashingBusy
+
+DEFAULT_METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:1000000', 'pbkdf2:sha256:600000']
+
+
+def bench_inline(method, seconds):
+    """
+    Verifies one hash repeatedly on this thread and returns verifications per second.
+    """
+    stored = generate_password_hash ( 'correct horse battery staple', method )
+    count = 0
+    started = time.perf_counter ()
+    while time.perf_counter () - started < seconds:
+        check_password_hash ( stored, 'correct horse battery staple' )
+        count += 1
+    return count / (time.perf_counter () - started)
+
+
+def bench_pool(method, seconds, workers, clients, max_pending):
+    """
+    Verifies from `clients` threads through a PasswordHasher and returns
+    (verifications per second, number of requests rejected with 503).
+    """
+    app = Flask ( __name__ )
+    app.config.update (
+        PASSWORD_HASH_METHOD=method,
+        PASSWORD_HASH_WORKERS=workers,
+        PASSWORD_HASH_MAX_PENDING=max_pending,
+    )
+    hasher = PasswordHasher ( app )
+    stored = hasher.hash ( 'correct horse battery staple' )
+
+    counts = {'ok': 0, 'busy': 0}
+    lock = threading.Lock ()
+    deadline = time.perf_counter () + seconds
+
+    def client():
+        while time.perf_counter () < deadline:
+            try:
+                hasher.verify ( stored, 'correct horse battery staple' )
+                outcome = 'ok'
+            except HashingBusy:
+                outcome = 'busy'
+                time.sleep ( 0.01 )
+            with lock:
+                counts[outcome] += 1
+
+    started = time.perf_counter ()
+    threads = [threading.Thread ( target=client ) for _ in range ( clients )]
+    for thread in threads:
+        thread.start ()
+    for thread in threads:
+        thread.join ()
+    elapsed = time.perf_counter () - started
+    hasher.shutdown ()
+    return counts['ok'] / elapsed, counts['busy']
+
+
+def main():
+    parser = argparse.ArgumentParser ( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument ( '--methods', nargs='+', default=DEFAULT_METHODS )
+    parser.add_argument ( '--seconds', type=float, default=5.0, help="Duration of each measurement" )
+    parser.add_argument ( '--workers', type=int, default=os.cpu_count () or 1 )
+    parser.add_argument ( '--clients', type=int, default=16, help="Concurrent login threads for the pool run" )
+    parser.add_argument ( '--max-pending', type=int, default=None )
+    args = parser.parse_args ()
+
+    print ( f"{'method':<26} {'inline/s':>10} {'pool/s':>10} {'per core/s':>11} {'503s':>6} {'ms/login':>9}" )
+    for method in args.methods:
+        inline = bench_inline ( method, args.seconds )
+        pooled, busy = bench_pool ( method, args.seconds, args.workers, args.clients, args.max_pending )
+        per_core = pooled / min ( args.workers, os.cpu_count () or 1 )
+        print ( f"{method:<26} {inline:>10.1f} {pooled:>10.1f} {per_core:>11.1f} {busy:>6} {1000 / inline:>9.1f}" )
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,377 @@
+"""
+Load-tests the main request flows against a seeded scratch SQLite database.
+
+Builds the app with `create_app`, migrates a temporary database, fills it
+with synthetic users, profiles, follows, posts, comments and likes, and then drives
+/dashboard, /profile/<id>, /like/<id>, /comments and /add_post from
+concurrent clients (in-process test clients, one thread each). Reports
+p50 / p95 / p99 latency and throughput per flow, and the peak RSS of the
+process.
+
+With --baseline the results are compared to a stored run and the script
+exits with status 1 if a flow's p95 latency or throughput regressed by more
+than --tolerance. Baselines only make sense on the machine and at the scale
+they were recorded with; record one with --save-baseline.
+
+Usage:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --users 10000 --posts-per-user 50 --clients 16 --seconds 60
+    python benchmarks/load_test.py --save-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+os.chdir ( os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+
+import flask_migrate
+from sqlalchemy import func, insert, select, update
+from werkzeug.security import generate_password_hash
+
+from __init__ import create_app
+from model import db, User, Post, Profile, Comment, Like, Follow
+from timeline import timelines
+
+# Flow name -> relative weight in the request mix
+MIX = {
+    'dashboard': 40,
+    'profile': 20,
+    'like': 20,
+    'comments': 10,
+    'comment': 5,
+    'add_post': 5,
+}
+
+BATCH_SIZE = 10000
+
+
+def make_config(database_url, upload_folder):
+    class LoadTestConfig:
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+        SECRET_KEY = 'load-test'
+        UPLOAD_FOLDER = upload_folder
+        IMAGE_VARIANTS_ENABLED = False
+        PASSWORD_HASH_WORKERS = 0
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        SESSION_BACKEND = 'sql'
+        SESSION_PURGE_INTERVAL = 0
+        METRICS_MULTIPROC_DIR = None
+        # The database is migrated and seeded after the app is created
+        SEARCH_BUILD_ON_STARTUP = False
+        AVAILABILITY_BUILD_ON_STARTUP = False
+
+    return LoadTestConfig
+
+
+def insert_batches(model, rows):
+    """
+    Inserts an iterable of row dicts in executemany batches.
+    """
+    batch = []
+    for row in rows:
+        batch.append ( row )
+        if len ( batch ) >= BATCH_SIZE:
+            db.session.execute ( insert ( model ), batch )
+            batch = []
+    if batch:
+        db.session.execute ( insert ( model ), batch )
+
+
+def seed(users, posts_per_user, comments_per_post, likes_per_post, follows_per_user, rng):
+    """
+    Fills the database with synthetic data and returns the number of rows written.
+    """
+    password = generate_password_hash ( 'password', 'pbkdf2:sha256:1000' )
+    insert_batches ( User, (
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'password': password, 'post_count': posts_per_user}
+        for i in range ( 1, users + 1 )
+    ) )
+    insert_batches ( Profile, (
+        {'user_id': i, 'nickname': f'User {i}', 'bio': '', 'image_path': ''}
+        for i in range ( 1, users + 1 )
+    ) )
+
+    post_count = users * posts_per_user
+    likes_per_post = min ( likes_per_post, users )
+    # Posts are interleaved across users, like a real feed
+    insert_batches ( Post, (
+        {'user_id': 1 + n % users, 'title': 't', 'content': f'post {n}', 'image_path': 'uploads/seed.png',
+         'likes_count': likes_per_post}
+        for n in range ( post_count )
+    ) )
+    insert_batches ( Comment, (
+        {'post_id': post_id, 'user_id': rng.randint ( 1, users ), 'text': f'comment {k}'}
+        for post_id in range ( 1, post_count + 1 ) for k in range ( comments_per_post )
+    ) )
+    insert_batches ( Like, (
+        {'post_id': post_id, 'user_id': user_id}
+        for post_id in range ( 1, post_count + 1 ) for user_id in rng.sample ( range ( 1, users + 1 ), likes_per_post )
+    ) )
+    follows_per_user = min ( follows_per_user, users - 1 )
+    insert_batches ( Follow, (
+        {'follower_id': user_id, 'followed_id': followed_id}
+        for user_id in range ( 1, users + 1 )
+        for followed_id in rng.sample ( [other for other in range ( 1, users + 1 ) if other != user_id], follows_per_user )
+    ) )
+    db.session.execute ( update ( User ).values (
+        following_count=follows_per_user,
+        follower_count=select ( func.count () ).where ( Follow.followed_id == User.id ).scalar_subquery (),
+    ) )
+    db.session.flush ()
+    # Materialize the home timelines the seeded follow graph implies
+    for user_id in range ( 1, users + 1 ):
+        timelines.rebuild ( user_id )
+    db.session.commit ()
+    return users * (2 + follows_per_user) + post_count * (1 + comments_per_post + likes_per_post)
+
+
+def random_image(rng):
+    """
+    Returns a small JPEG with random pixels, so every upload is a new blob.
+    """
+    from PIL import Image
+
+    image = Image.frombytes ( 'RGB', (64, 64), rng.randbytes ( 64 * 64 * 3 ) )
+    buffer = io.BytesIO ()
+    image.save ( buffer, 'JPEG', quality=80 )
+    return buffer.getvalue ()
+
+
+def run_flow(client, flow, users, post_count, rng):
+    """
+    Sends one request of the given flow and returns True if it succeeded.
+    """
+    if flow == 'dashboard':
+        return client.get ( '/dashboard' ).status_code == 200
+    if flow == 'profile':
+        return client.get ( f'/profile/{rng.randint ( 1, users )}' ).status_code == 200
+    if flow == 'like':
+        response = client.post ( f'/like/{rng.randint ( 1, post_count )}' )
+        return response.status_code == 200 and response.get_json ()['success']
+    if flow == 'comments':
+        return client.get ( f'/comments/{rng.randint ( 1, post_count )}' ).status_code == 200
+    if flow == 'comment':
+        response = client.post ( '/comments', data={'post_id': str ( rng.randint ( 1, post_count ) ), 'comment_text': 'load test'} )
+        return response.status_code == 302
+    if flow == 'add_post':
+        response = client.post ( '/add_post', content_type='multipart/form-data', data={
+            'title': 'load test', 'content': 'load test',
+            'image': (io.BytesIO ( random_image ( rng ) ), 'upload.jpg', 'image/jpeg'),
+        } )
+        return response.status_code == 302 and response.headers['Location'].endswith ( '/dashboard' )
+    raise ValueError ( flow )
+
+
+def drive(app, clients, seconds, max_requests, users, post_count, seed_value):
+    """
+    Runs the request mix from `clients` threads until the time or request
+    limit is reached. Returns ({flow: [latencies]}, {flow: errors}, elapsed seconds).
+    """
+    flows = list ( MIX )
+    weights = [MIX[flow] for flow in flows]
+    latencies = {flow: [] for flow in flows}
+    errors = {flow: 0 for flow in flows}
+    lock = threading.Lock ()
+    remaining = [max_requests]
+    deadline = time.perf_counter () + seconds
+
+    def client_loop(number):
+        rng = random.Random ( seed_value + number )
+        client = app.test_client ()
+        with client.session_transaction () as session:
+            session['User_id'] = rng.randint ( 1, users )
+
+        while time.perf_counter () < deadline:
+            with lock:
+                if remaining[0] is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            flow = rng.choices ( flows, weights )[0]
+            started = time.perf_counter ()
+            try:
+                ok = run_flow ( client, flow, users, post_count, rng )
+            except Exception:
+                logging.exception ( "%s request failed", flow )
+                ok = False
+            elapsed = time.perf_counter () - started
+            with lock:
+                latencies[flow].append ( elapsed )
+                if not ok:
+                    errors[flow] += 1
+
+    started = time.perf_counter ()
+    threads = [threading.Thread ( target=client_loop, args=(number,) ) for number in range ( clients )]
+    for thread in threads:
+        thread.start ()
+    for thread in threads:
+        thread.join ()
+    return latencies, errors, time.perf_counter () - started
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = max ( 0, min ( len ( sorted_values ) - 1, int ( round ( fraction * len ( sorted_values ) + 0.5 ) ) - 1 ) )
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    results = {}
+    for flow, values in latencies.items ():
+        values.sort ()
+        results[flow] = {
+            'requests': len ( values ),
+            'errors': errors[flow],
+            'p50_ms': round ( percentile ( values, 0.50 ) * 1000, 2 ) if values else None,
+            'p95_ms': round ( percentile ( values, 0.95 ) * 1000, 2 ) if values else None,
+            'p99_ms': round ( percentile ( values, 0.99 ) * 1000, 2 ) if values else None,
+            'rps': round ( len ( values ) / elapsed, 2 ),
+        }
+    total = sum ( len ( values ) for values in latencies.values () )
+    results['total'] = {
+        'requests': total,
+        'errors': sum ( errors.values () ),
+        'rps': round ( total / elapsed, 2 ),
+    }
+    return results
+
+
+def peak_rss_mb():
+    """
+    Returns the process's peak resident set size in MB, or None where /proc is unavailable.
+    """
+    try:
+        with open ( '/proc/self/status' ) as status:
+            for line in status:
+                if line.startswith ( 'VmHWM:' ):
+                    return round ( int ( line.split ()[1] ) / 1024, 1 )
+    except OSError:
+        pass
+    return None
+
+
+def check_like_counts():
+    """
+    Returns the number of posts whose likes_count does not match their like rows.
+    """
+    counted = select ( Like.post_id, func.count ().label ( 'likes' ) ).group_by ( Like.post_id ).subquery ()
+    return db.session.execute (
+        select ( func.count () ).select_from ( Post )
+        .outerjoin ( counted, counted.c.post_id == Post.id )
+        .where ( Post.likes_count != func.coalesce ( counted.c.likes, 0 ) )
+    ).scalar ()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of regressions of `results` against `baseline`.
+    """
+    regressions = []
+    for flow, stats in baseline['results'].items ():
+        current = results.get ( flow )
+        if not current or not current['requests']:
+            continue
+        if stats.get ( 'p95_ms' ) and current['p95_ms'] > stats['p95_ms'] * (1 + tolerance):
+            regressions.append ( f"{flow}: p95 {current['p95_ms']} ms, baseline {stats['p95_ms']} ms" )
+        if stats.get ( 'rps' ) and current['rps'] < stats['rps'] * (1 - tolerance):
+            regressions.append ( f"{flow}: {current['rps']} req/s, baseline {stats['rps']} req/s" )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser ( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument ( '--users', type=int, default=1000 )
+    parser.add_argument ( '--posts-per-user', type=int, default=10 )
+    parser.add_argument ( '--comments-per-post', type=int, default=3 )
+    parser.add_argument ( '--likes-per-post', type=int, default=5 )
+    parser.add_argument ( '--follows-per-user', type=int, default=20 )
+    parser.add_argument ( '--clients', type=int, default=8, help="Concurrent client threads" )
+    parser.add_argument ( '--seconds', type=float, default=20.0, help="Duration of the run" )
+    parser.add_argument ( '--requests', type=int, default=None, help="Stop after this many requests instead" )
+    parser.add_argument ( '--seed', type=int, default=1 )
+    parser.add_argument ( '--baseline', default=None, help="Compare against this stored result" )
+    parser.add_argument ( '--save-baseline', default=None, help="Write the result to this file" )
+    parser.add_argument ( '--tolerance', type=float, default=0.25, help="Allowed regression, as a fraction" )
+    args = parser.parse_args ()
+
+    # Per-request logging would dominate the measurements
+    logging.getLogger ().setLevel ( logging.WARNING )
+
+    scratch = tempfile.mkdtemp ()
+    database_url = 'sqlite:///' + os.path.join ( scratch, 'load.sqlite' )
+    app = create_app ( make_config ( database_url, os.path.join ( scratch, 'uploads' ) ) )
+    rng = random.Random ( args.seed )
+
+    with app.app_context ():
+        flask_migrate.upgrade ()
+        started = time.perf_counter ()
+        rows = seed ( args.users, args.posts_per_user, args.comments_per_post, args.likes_per_post,
+                       args.follows_per_user, rng )
+        print ( f"Seeded {rows} rows in {time.perf_counter () - started:.1f} s." )
+
+    post_count = args.users * args.posts_per_user
+    latencies, errors, elapsed = drive ( app, args.clients, args.seconds, args.requests, args.users, post_count, args.seed )
+    results = summarize ( latencies, errors, elapsed )
+
+    with app.app_context ():
+        drifted = check_like_counts ()
+
+    print ( f"\n{'flow':<10} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}" )
+    for flow, stats in results.items ():
+        if flow == 'total':
+            continue
+        print ( f"{flow:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['p50_ms'] or 0:>8.2f} "
+                f"{stats['p95_ms'] or 0:>8.2f} {stats['p99_ms'] or 0:>8.2f} {stats['rps']:>8.2f}" )
+    total = results['total']
+    rss = peak_rss_mb ()
+    print ( f"\n{total['requests']} requests in {elapsed:.1f} s with {args.clients} clients: {total['rps']:.1f} req/s, "
+            f"{total['errors']} errors, peak RSS {rss if rss is not None else '?'} MB" )
+    print ( f"Posts whose likes_count drifted from the likes table: {drifted}" )
+
+    run = {
+        'scale': {
+            'users': args.users, 'posts_per_user': args.posts_per_user,
+            'comments_per_post': args.comments_per_post, 'likes_per_post': args.likes_per_post,
+            'follows_per_user': args.follows_per_user,
+            'clients': args.clients,
+        },
+        'results': results,
+        'peak_rss_mb': rss,
+    }
+    if args.save_baseline:
+        with open ( args.save_baseline, 'w' ) as handle:
+            json.dump ( run, handle, indent=2, sort_keys=True )
+        print ( f"Saved baseline to {args.save_baseline}." )
+
+    failed = bool ( drifted or total['errors'] )
+    if args.baseline:
+        with open ( args.baseline ) as handle:
+            baseline = json.load ( handle )
+        if baseline.get ( 'scale' ) != run['scale']:
+            print ( "Warning: the baseline was recorded at a different scale." )
+        regressions = compare ( results, baseline, args.tolerance )
+        for regression in regressions:
+            print ( f"REGRESSION {regression}" )
+        if not regressions:
+            print ( f"No regressions beyond {args.tolerance:.0%} of the baseline." )
+        failed = failed or bool ( regressions )
+
+    sys.exit ( 1 if failed else 0 )
+
+
+if __name__ == '__main__':
+    main ()
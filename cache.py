@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+try:
+    import redis
+except ImportError:  # redis is only needed for the shared cache backend
+    redis = None
+
+
+class MemoryCache:
+    """
+    In-process cache with least-recently-used eviction and a per-entry TTL.
+
+    Version counters (see `incr`) are kept apart from the cached values, in
+    their own LRU of at most `max_counters`. An evicted counter does not
+    restart at 0: counters that are not held read as the highest value ever
+    evicted, and bumping one continues from there. A version an entry was
+    stored under is therefore never handed out again after a bump, so an
+    old entry can not come back.
+    """
+
+    def __init__(self, max_entries=5000, default_ttl=300, max_counters=50000):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_counters = max_counters
+        self._entries = OrderedDict ()
+        self._counters = OrderedDict ()
+        self._counter_floor = 0
+        self._lock = threading.Lock ()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get ( key )
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic ():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end ( key )
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic () + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end ( key )
+            while len ( self._entries ) > self.max_entries:
+                self._entries.popitem ( last=False )
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop ( key, None )
+
+    def get_counters(self, keys):
+        """
+        Returns the current value of each version counter.
+        """
+        with self._lock:
+            values = []
+            for key in keys:
+                value = self._counters.get ( key )
+                if value is None:
+                    values.append ( self._counter_floor )
+                else:
+                    self._counters.move_to_end ( key )
+                    values.append ( value )
+            return values
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.pop ( key, self._counter_floor ) + 1
+            self._counters[key] = value
+            while len ( self._counters ) > self.max_counters:
+                _, evicted = self._counters.popitem ( last=False )
+                self._counter_floor = max ( self._counter_floor, evicted )
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear ()
+            self._counters.clear ()
+            self._counter_floor = 0
+
+
+class RedisCache:
+    """
+    Cache shared by every web worker, stored in Redis.
+    Eviction is left to the server's `maxmemory-policy`; entries also expire after their TTL.
+    """
+
+    def __init__(self, url, default_ttl=300, prefix='instaclone:'):
+        if redis is None:
+            raise RuntimeError ( "The redis cache backend requires the redis package to be installed." )
+        self.client = redis.Redis.from_url ( url )
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get ( self.prefix + key )
+        return value.decode ( 'utf-8' ) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self.client.set ( self.prefix + key, value, ex=ttl or None )
+
+    def delete(self, key):
+        self.client.delete ( self.prefix + key )
+
+    def get_counters(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget ( [self.prefix + key for key in keys] )
+        return [int ( value ) if value is not None else 0 for value in values]
+
+    def incr(self, key):
+        return self.client.incr ( self.prefix + key )
+
+    def clear(self):
+        for key in self.client.scan_iter ( self.prefix + '*' ):
+            self.client.delete ( key )
+
+
+def create_cache(backend, url=None, max_entries=5000, default_ttl=300, max_counters=50000):
+    """
+    Builds a cache backend by name: 'memory' or 'redis'.
+    """
+    if backend == 'memory':
+        return MemoryCache ( max_entries=max_entries, default_ttl=default_ttl, max_counters=max_counters )
+    if backend == 'redis':
+        return RedisCache ( url, default_ttl=default_ttl )
+    raise ValueError ( f"Unknown cache backend: {backend}" )
+
+
+class FragmentCache:
+    """
+    Caches rendered template fragments, such as the feed tile of a post.
+
+    A fragment is stored under its name plus the current version of every
+    post and user it was rendered from. Write paths call `invalidate_post` /
+    `invalidate_user`, which bump the version, so the next render misses and
+    the stale copy is never read again (it ages out through LRU / TTL).
+
+    Usage from a template:
+        {% call cached_fragment('post-header', post_ids=[post.id], user_ids=[post.user_id]) %}
+            ... markup that only depends on that post and user ...
+        {% endcall %}
+
+    Anything that differs per viewer (like state, "delete" buttons for the
+    owner, ...) must be rendered outside the call block.
+
+    With the in-memory backend every process has its own cache, and an
+    invalidation only reaches the process that handled the write; other
+    processes serve the old fragment until FRAGMENT_CACHE_TTL passes. Use the
+    'redis' backend to share fragments and versions between processes.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        self._lock = threading.Lock ()
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Creates the configured backend and registers the `cached_fragment` template helper.
+        """
+        self.enabled = app.config.get ( 'FRAGMENT_CACHE_ENABLED', True )
+        self.backend = create_cache (
+            app.config.get ( 'FRAGMENT_CACHE_BACKEND', 'memory' ),
+            url=app.config.get ( 'FRAGMENT_CACHE_URL' ),
+            max_entries=app.config.get ( 'FRAGMENT_CACHE_MAX_ENTRIES', 5000 ),
+            default_ttl=app.config.get ( 'FRAGMENT_CACHE_TTL', 300 ),
+            max_counters=app.config.get ( 'FRAGMENT_CACHE_MAX_VERSIONS', 50000 ),
+        )
+        app.extensions['fragment_cache'] = self
+        app.add_template_global ( self.cached_fragment, 'cached_fragment' )
+
+    def cached_fragment(self, name, post_ids=(), user_ids=(), caller=None):
+        """
+        Template helper used with `{% call %}`: returns the cached markup for
+        the fragment, rendering the call block only on a miss.
+        """
+        if not self.enabled:
+            return caller ()
+
+        try:
+            key = self.fragment_key ( name, post_ids, user_ids )
+            html = self.backend.get ( key )
+        except Exception:
+            logging.exception ( "Reading fragment %s from the cache failed", name )
+            return caller ()
+
+        if html is not None:
+            self._count ( 'hits' )
+            return Markup ( html )
+
+        self._count ( 'misses' )
+        html = caller ()
+        try:
+            self.backend.set ( key, str ( html ) )
+        except Exception:
+            logging.exception ( "Writing fragment %s to the cache failed", name )
+        return html
+
+    def fragment_key(self, name, post_ids=(), user_ids=()):
+        """
+        Builds the cache key of a fragment from its name and its dependencies' versions.
+        """
+        dependencies = [f"post:{post_id}" for post_id in sorted ( set ( post_ids ) )]
+        dependencies += [f"user:{user_id}" for user_id in sorted ( set ( user_ids ) )]
+        versions = self.backend.get_counters ( ['version:' + dependency for dependency in dependencies] )
+        return 'fragment:' + name + ':' + ','.join (
+            f"{dependency}@{version}" for dependency, version in zip ( dependencies, versions )
+        )
+
+    def invalidate_post(self, post_id):
+        """
+        Drops every cached fragment rendered from this post.
+        """
+        self._bump ( f"version:post:{post_id}" )
+
+    def invalidate_user(self, user_id):
+        """
+        Drops every cached fragment showing this user's name or avatar.
+        """
+        self._bump ( f"version:user:{user_id}" )
+
+    def _count(self, counter):
+        with self._lock:
+            setattr ( self, counter, getattr ( self, counter ) + 1 )
+
+    def _bump(self, key):
+        if self.backend is None:
+            return
+        try:
+            self.backend.incr ( key )
+        except Exception:
+            logging.exception ( "Invalidating %s in the fragment cache failed", key )
+
+
+fragment_cache = FragmentCache ()
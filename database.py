@@ -0,0 +1,124 @@
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+# Bind key of the optional read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+def engine_options(config, database_uri):
+    """
+    Builds SQLAlchemy engine options from the DB_POOL_* settings.
+
+    Pre-ping replaces connections the server has closed (MySQL's wait_timeout)
+    before they are handed out, and recycling retires them before that happens.
+    Pool sizing does not apply to SQLite, which uses its own pool classes.
+    """
+    options = {'pool_pre_ping': config.get ( 'DB_POOL_PRE_PING', True )}
+    if not database_uri.startswith ( 'sqlite' ):
+        options.update (
+            pool_size=config.get ( 'DB_POOL_SIZE', 10 ),
+            max_overflow=config.get ( 'DB_MAX_OVERFLOW', 20 ),
+            pool_timeout=config.get ( 'DB_POOL_TIMEOUT', 30 ),
+            pool_recycle=config.get ( 'DB_POOL_RECYCLE', 280 ),
+        )
+    return options
+
+
+def configure_database(app):
+    """
+    Fills in engine options and the read-replica bind from the app config.
+    Must run before `db.init_app`. Options already set in
+    SQLALCHEMY_ENGINE_OPTIONS take precedence.
+    """
+    config = app.config
+    primary_uri = config['SQLALCHEMY_DATABASE_URI']
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options ( config, primary_uri ),
+        **config.get ( 'SQLALCHEMY_ENGINE_OPTIONS', {} ),
+    }
+
+    replica_uri = config.get ( 'SQLALCHEMY_REPLICA_URI' )
+    if replica_uri:
+        binds = dict ( config.get ( 'SQLALCHEMY_BINDS' ) or {} )
+        binds[REPLICA_BIND] = {'url': replica_uri, **engine_options ( config, replica_uri )}
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def replica_reads(function):
+    """
+    Resource method decorator: lets the request's read-only SELECTs go to the
+    read replica. Use it through `method_decorators = {'get': [replica_reads]}`.
+    """
+
+    @wraps ( function )
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        return function ( *args, **kwargs )
+
+    return wrapper
+
+
+def reads_pinned_to_primary():
+    """
+    Returns True if this client wrote recently, so its reads must see its own
+    writes and may not go to a replica that could lag behind.
+    """
+    return g.get ( 'pinned_to_primary', False ) or session.get ( 'primary_until', 0 ) > time.time ()
+
+
+class RoutingSession ( Session ):
+    """
+    Session that sends SELECTs to the read replica for requests marked with
+    `replica_reads`, and everything else to the primary.
+
+    A request stays on the primary once its session has written anything, and
+    after a commit the client's reads are pinned to the primary for
+    DB_READ_YOUR_WRITES_SECONDS, longer than the expected replication lag.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica ( clause ):
+            replica = self._db.engines.get ( REPLICA_BIND )
+            if replica is not None:
+                return replica
+        return super ().get_bind ( mapper=mapper, clause=clause, bind=bind, **kwargs )
+
+    def _use_replica(self, clause):
+        if not isinstance ( clause, Select ) or not has_request_context () or not g.get ( 'replica_reads' ):
+            return False
+        if self._flushing or self.new or self.dirty or self.deleted or self.info.get ( 'wrote' ):
+            return False
+        return not reads_pinned_to_primary ()
+
+
+@event.listens_for ( RoutingSession, 'after_flush' )
+def _mark_written(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for ( RoutingSession, 'do_orm_execute' )
+def _mark_statement_written(orm_execute_state):
+    # INSERT / UPDATE / DELETE statements executed directly, without a flush
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for ( RoutingSession, 'after_commit' )
+def _pin_to_primary(db_session):
+    wrote = db_session.info.pop ( 'wrote', False )
+    if not wrote or not has_request_context ():
+        return
+    g.pinned_to_primary = True
+    window = current_app.config.get ( 'DB_READ_YOUR_WRITES_SECONDS', 5 )
+    if window and current_app.extensions['sqlalchemy'].engines.get ( REPLICA_BIND ) is not None:
+        session['primary_until'] = time.time () + window
+
+
+@event.listens_for ( RoutingSession, 'after_rollback' )
+def _forget_writes(db_session):
+    db_session.info.pop ( 'wrote', None )
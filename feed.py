@@ -0,0 +1,179 @@
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+from model import db, Post, User, Comment, Like
+from like_buffer import like_buffer
+from timeline import timelines
+
+
+def get_page_size():
+    """
+    Returns the configured number of posts per feed page.
+    """
+    return current_app.config.get ( 'POSTS_PER_PAGE', 20 )
+
+
+def parse_cursor(value):
+    """
+    Converts a `before` query argument into a post ID cursor.
+    Returns None for a missing or malformed cursor so the first page is served.
+    """
+    try:
+        cursor = int ( value )
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def get_posts_page(before=None, user_id=None, page_size=None):
+    """
+    Fetches one page of posts using keyset pagination on `Post.id`.
+
+    Only posts with an ID lower than `before` are returned, newest first, so the
+    cost of a page stays the same no matter how deep the user scrolls.
+    Each post comes with its author and the author's profiles already loaded,
+    so templates can use `post.author` and `post.author.avatar_path` without
+    issuing further queries.
+
+    Returns:
+        - posts: The posts on this page.
+        - next_cursor: The `before` value for the following page, or None on the last page.
+    """
+    page_size = page_size or get_page_size ()
+
+    query = Post.query.options (
+        joinedload ( Post.author ).selectinload ( User.profiles )
+    )
+    if user_id is not None:
+        query = query.filter ( Post.user_id == user_id )
+    if before is not None:
+        query = query.filter ( Post.id < before )
+
+    # Fetch one extra row to find out whether another page exists
+    posts = query.order_by ( Post.id.desc () ).limit ( page_size + 1 ).all ()
+
+    next_cursor = None
+    if len ( posts ) > page_size:
+        posts = posts[:page_size]
+        next_cursor = posts[-1].id
+
+    return posts, next_cursor
+
+
+def get_home_page(user_id, before=None, page_size=None):
+    """
+    Fetches one page of a user's home feed: their own posts and those of the
+    accounts they follow, newest first.
+
+    The post IDs come from the user's materialized timeline (a range read on
+    its primary key, see timeline.py) and the posts are then loaded by
+    primary key, with authors and profiles like `get_posts_page`. With
+    TIMELINE_ENABLED off every user sees every post.
+
+    Returns:
+        - posts: The posts on this page.
+        - next_cursor: The `before` value for the following page, or None on the last page.
+    """
+    if not timelines.enabled:
+        return get_posts_page ( before=before, page_size=page_size )
+
+    page_size = page_size or get_page_size ()
+    post_ids, next_cursor = timelines.page ( user_id, before=before, page_size=page_size )
+    if not post_ids:
+        return [], next_cursor
+
+    # A post deleted while its fan-out was running is simply missing here
+    posts = Post.query.options (
+        joinedload ( Post.author ).selectinload ( User.profiles )
+    ).filter ( Post.id.in_ ( post_ids ) ).all ()
+    posts.sort ( key=lambda post: post.id, reverse=True )
+    return posts, next_cursor
+
+
+def get_latest_comments(post_ids, per_post=None):
+    """
+    Fetches the latest comments for every post on a feed page in one batched query.
+
+    Comments are ranked per post with a window function over a single
+    `post_id IN (...)` filter, and their authors and profile images are
+    loaded with the same batching, so the cost does not grow with the
+    number of comments in the database.
+
+    Returns:
+        dict: Post ID -> list of that post's latest comments, oldest first.
+    """
+    per_post = per_post or current_app.config.get ( 'COMMENTS_PER_POST', 3 )
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    if not comments_by_post:
+        return comments_by_post
+
+    ranked = db.session.query (
+        Comment.id.label ( 'id' ),
+        func.row_number ().over (
+            partition_by=Comment.post_id, order_by=Comment.id.desc ()
+        ).label ( 'position' )
+    ).filter ( Comment.post_id.in_ ( list ( comments_by_post ) ) ).subquery ()
+
+    comments = Comment.query.join ( ranked, Comment.id == ranked.c.id ).filter (
+        ranked.c.position <= per_post
+    ).options (
+        selectinload ( Comment.user ).selectinload ( User.profiles )
+    ).order_by ( Comment.post_id, Comment.id ).all ()
+
+    for comment in comments:
+        comments_by_post[comment.post_id].append ( comment )
+    return comments_by_post
+
+
+def get_comments_page(post_id, before=None, page_size=None):
+    """
+    Fetches one page of a post's comments using keyset pagination on `Comment.id`.
+
+    Returns:
+        - comments: The comments on this page, newest first.
+        - next_cursor: The `before` value for the following page, or None on the last page.
+    """
+    page_size = page_size or current_app.config.get ( 'COMMENTS_PER_PAGE', 20 )
+
+    query = Comment.query.filter ( Comment.post_id == post_id ).options (
+        selectinload ( Comment.user ).selectinload ( User.profiles )
+    )
+    if before is not None:
+        query = query.filter ( Comment.id < before )
+
+    comments = query.order_by ( Comment.id.desc () ).limit ( page_size + 1 ).all ()
+
+    next_cursor = None
+    if len ( comments ) > page_size:
+        comments = comments[:page_size]
+        next_cursor = comments[-1].id
+
+    return comments, next_cursor
+
+
+def get_liked_post_ids(user_id, post_ids):
+    """
+    Returns the subset of `post_ids` that the user has liked, as a set.
+
+    Uses one `user_id = ? AND post_id IN (...)` query served by the unique
+    (user_id, post_id) index, then applies any likes still waiting in the
+    write-behind buffer.
+    """
+    post_ids = list ( post_ids )
+    if not user_id or not post_ids:
+        return set ()
+
+    liked = {
+        post_id for (post_id,) in db.session.query ( Like.post_id ).filter (
+            Like.user_id == user_id, Like.post_id.in_ ( post_ids )
+        )
+    }
+
+    if like_buffer.enabled:
+        for post_id in post_ids:
+            buffered = like_buffer.is_liked ( user_id, post_id )
+            if buffered is True:
+                liked.add ( post_id )
+            elif buffered is False:
+                liked.discard ( post_id )
+    return liked
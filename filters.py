@@ -0,0 +1,224 @@
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from uploads import save_stream
+
+try:
+    import numpy as np
+    from PIL import Image, ImageOps
+except ImportError:  # NumPy and Pillow are optional; without them the browser applies filters
+    np = None
+    Image = None
+
+# Filter name -> (3x3 color matrix, per-channel offset), the matrices the CSS
+# Filter Effects spec defines for the filter buttons in add_post.html
+FILTERS = {
+    'none': None,
+    # grayscale(100%)
+    'grayscale': (
+        [[0.2126, 0.7152, 0.0722],
+         [0.2126, 0.7152, 0.0722],
+         [0.2126, 0.7152, 0.0722]],
+        [0.0, 0.0, 0.0],
+    ),
+    # sepia(100%)
+    'sepia': (
+        [[0.393, 0.769, 0.189],
+         [0.349, 0.686, 0.168],
+         [0.272, 0.534, 0.131]],
+        [0.0, 0.0, 0.0],
+    ),
+    # contrast(200%): 2 * value - 0.5 * 255
+    'contrast': (
+        [[2.0, 0.0, 0.0],
+         [0.0, 2.0, 0.0],
+         [0.0, 0.0, 2.0]],
+        [-127.5, -127.5, -127.5],
+    ),
+    # saturate(200%)
+    'saturate': (
+        [[0.213 + 0.787 * 2, 0.715 - 0.715 * 2, 0.072 - 0.072 * 2],
+         [0.213 - 0.213 * 2, 0.715 + 0.285 * 2, 0.072 - 0.072 * 2],
+         [0.213 - 0.213 * 2, 0.715 - 0.715 * 2, 0.072 + 0.928 * 2]],
+        [0.0, 0.0, 0.0],
+    ),
+}
+
+# Pillow format name -> file extension of the filtered output
+OUTPUT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+# Rows converted per step, so the float working copy stays small for large photos
+ROWS_PER_BLOCK = 256
+
+
+def apply_filter(pixels, name):
+    """
+    Applies a named color filter to an (height, width, 3) uint8 RGB array and
+    returns a new uint8 array.
+
+    Every pixel goes through one matrix multiply plus offset, computed a
+    block of rows at a time in float32 and rounded back to 8 bits.
+    """
+    matrix, offset = FILTERS[name]
+    transform = np.asarray ( matrix, dtype=np.float32 ).T
+    offset = np.asarray ( offset, dtype=np.float32 )
+
+    output = np.empty_like ( pixels )
+    for start in range ( 0, pixels.shape[0], ROWS_PER_BLOCK ):
+        block = pixels[start:start + ROWS_PER_BLOCK].astype ( np.float32 )
+        result = block @ transform
+        result += offset + 0.5
+        np.clip ( result, 0, 255, out=result )
+        output[start:start + ROWS_PER_BLOCK] = result
+    return output
+
+
+def filter_image(source_path, output_path, name, image_format='JPEG', quality=85):
+    """
+    Decodes an image, applies the named filter and encodes the result to `output_path`.
+
+    Runs in a worker process. Transparency is kept for PNG / WEBP output and
+    flattened onto white for JPEG; animated images keep their first frame,
+    as the browser's canvas did.
+    """
+    with Image.open ( source_path ) as image:
+        image = ImageOps.exif_transpose ( image )
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert ( 'RGBA' if has_alpha else 'RGB' )
+
+    pixels = np.asarray ( image )
+    rgb = apply_filter ( np.ascontiguousarray ( pixels[..., :3] ), name )
+
+    if has_alpha and image_format != 'JPEG':
+        result = Image.fromarray ( np.dstack ( (rgb, pixels[..., 3]) ), 'RGBA' )
+    elif has_alpha:
+        result = Image.new ( 'RGB', image.size, (255, 255, 255) )
+        result.paste ( Image.fromarray ( rgb, 'RGB' ), mask=Image.fromarray ( pixels[..., 3], 'L' ) )
+    else:
+        result = Image.fromarray ( rgb, 'RGB' )
+
+    save_options = {'quality': quality} if image_format in ('JPEG', 'WEBP') else {}
+    if image_format == 'JPEG':
+        save_options['optimize'] = True
+    result.save ( output_path, format=image_format, **save_options )
+
+
+class FilterUnavailable ( Exception ):
+    """
+    Raised when a filter cannot be applied (unknown name, disabled engine or a busy pool).
+    """
+
+
+class FilterEngine:
+    """
+    Applies the add_post filters on the server, in a process pool.
+
+    The browser uploads the original file plus a filter name instead of a
+    canvas-rendered PNG, and the filter is applied here with NumPy in one
+    pass over the pixels, then encoded as FILTER_OUTPUT_FORMAT at
+    FILTER_QUALITY. The 'none' filter stores the upload unchanged.
+
+    With FILTER_WORKERS = 0 filtering runs inline on the request thread.
+    Without NumPy or Pillow the engine is disabled and add_post.html falls
+    back to filtering on a canvas.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.workers = 0
+        self.timeout = 30
+        self.image_format = 'JPEG'
+        self.quality = 85
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Reads the filter settings and exposes `server_filters` to templates.
+        """
+        self.app = app
+        self.enabled = app.config.get ( 'FILTERS_ENABLED', True ) and np is not None
+        if app.config.get ( 'FILTERS_ENABLED', True ) and np is None:
+            logging.warning ( "NumPy or Pillow is not installed; image filters are applied in the browser." )
+        self.workers = app.config.get ( 'FILTER_WORKERS', 2 )
+        self.timeout = app.config.get ( 'FILTER_TIMEOUT', 30 )
+        self.image_format = app.config.get ( 'FILTER_OUTPUT_FORMAT', 'JPEG' ).upper ()
+        self.quality = app.config.get ( 'FILTER_QUALITY', 85 )
+
+        app.extensions['filter_engine'] = self
+        app.add_template_global ( self.enabled, 'server_filters' )
+        atexit.register ( self.shutdown )
+
+    def needs_filtering(self, name):
+        """
+        Returns True if `name` is a filter that changes the image; raises
+        FilterUnavailable for unknown names or when the engine is disabled.
+        """
+        if not name or name == 'none':
+            return False
+        if name not in FILTERS:
+            raise FilterUnavailable ( f"Unknown filter '{name}'." )
+        if not self.enabled:
+            raise FilterUnavailable ( "Image filters are not available." )
+        return True
+
+    @contextmanager
+    def filtered(self, source, name):
+        """
+        Applies the named filter to an uploaded file-like object.
+
+        Yields:
+            (file object, str): The filtered image, open for reading, and its file extension.
+        """
+        work_dir = tempfile.mkdtemp ( prefix='filter-' )
+        try:
+            source_path = os.path.join ( work_dir, 'source' )
+            output_path = os.path.join ( work_dir, 'output' )
+            save_stream ( source, source_path )
+            self._run ( source_path, output_path, name )
+            with open ( output_path, 'rb' ) as output:
+                yield output, OUTPUT_EXTENSIONS[self.image_format]
+        finally:
+            shutil.rmtree ( work_dir, ignore_errors=True )
+
+    def _run(self, source_path, output_path, name):
+        args = (source_path, output_path, name, self.image_format, self.quality)
+        if not self.workers:
+            return filter_image ( *args )
+        try:
+            return self._get_executor ().submit ( filter_image, *args ).result ( timeout=self.timeout )
+        except FutureTimeoutError:
+            raise FilterUnavailable ( "Applying the filter took too long, please try again." )
+
+    def _get_executor(self):
+        """
+        Returns this process's worker pool, creating it on first use so forked
+        web workers never share a pool with their parent.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid ():
+                self._pid = os.getpid ()
+                self._executor = ProcessPoolExecutor ( max_workers=self.workers )
+            return self._executor
+
+    def shutdown(self):
+        """
+        Stops the worker pool.
+        """
+        if self._executor is not None and self._pid == os.getpid ():
+            self._executor.shutdown ( wait=False, cancel_futures=True )
+            self._executor = None
+
+
+filter_engine = FilterEngine ()
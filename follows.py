@@ -0,0 +1,80 @@
+from sqlalchemy import delete, insert, select, update
+from model import db, User, Follow
+
+
+def insert_follow_ignore(follower_id, followed_id):
+    """
+    Inserts a follow row unless the pair already exists (the primary key makes
+    concurrent requests safe).
+
+    Returns:
+        int: 1 if a row was inserted, 0 if the user already followed the account.
+    """
+    statement = insert ( Follow ).values ( follower_id=follower_id, followed_id=followed_id ) \
+        .prefix_with ( 'OR IGNORE', dialect='sqlite' ) \
+        .prefix_with ( 'IGNORE', dialect='mysql' )
+    return db.session.execute ( statement ).rowcount
+
+
+def delete_follow(follower_id, followed_id):
+    """
+    Deletes the follow row for the pair if there is one.
+
+    Returns:
+        int: The number of rows deleted (0 or 1).
+    """
+    statement = delete ( Follow ).where ( Follow.follower_id == follower_id, Follow.followed_id == followed_id )
+    return db.session.execute ( statement ).rowcount
+
+
+def adjust_follow_counts(follower_id, followed_id, delta):
+    """
+    Adds `delta` to the follower's following_count and the followed account's
+    follower_count with SQL-side updates, so concurrent writers never lose updates.
+    """
+    if delta:
+        db.session.execute (
+            update ( User ).where ( User.id == follower_id )
+            .values ( following_count=User.following_count + delta )
+            .execution_options ( synchronize_session=False )
+        )
+        db.session.execute (
+            update ( User ).where ( User.id == followed_id )
+            .values ( follower_count=User.follower_count + delta )
+            .execution_options ( synchronize_session=False )
+        )
+
+
+def follow(follower_id, followed_id):
+    """
+    Makes `follower_id` follow `followed_id` within the current transaction.
+    The counters only change if a row was actually inserted. The caller commits.
+
+    Returns:
+        bool: True if this created the follow, False if it already existed.
+    """
+    inserted = insert_follow_ignore ( follower_id, followed_id )
+    adjust_follow_counts ( follower_id, followed_id, inserted )
+    return bool ( inserted )
+
+
+def unfollow(follower_id, followed_id):
+    """
+    Removes the follow within the current transaction. The caller commits.
+
+    Returns:
+        bool: True if a follow was removed.
+    """
+    removed = delete_follow ( follower_id, followed_id )
+    adjust_follow_counts ( follower_id, followed_id, -removed )
+    return bool ( removed )
+
+
+def is_following(follower_id, followed_id):
+    """
+    Checks whether `follower_id` follows `followed_id` (a primary-key lookup).
+    """
+    return db.session.execute (
+        select ( Follow.follower_id )
+        .where ( Follow.follower_id == follower_id, Follow.followed_id == followed_id ).limit ( 1 )
+    ).first () is not None
@@ -0,0 +1,141 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug method string used when the config does not set PASSWORD_HASH_METHOD
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class HashingBusy ( ServiceUnavailable ):
+    """
+    Raised when every password hashing slot is taken. Answered with
+    503 Service Unavailable and a Retry-After header.
+    """
+
+    description = "The server is busy, please try again in a moment."
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a bounded process pool.
+
+    Key derivation is deliberately CPU-heavy. Running it in PASSWORD_HASH_WORKERS
+    worker processes keeps a burst of logins from oversubscribing the CPU and
+    from holding the GIL of the web process, and at most
+    PASSWORD_HASH_MAX_PENDING hashes may be queued or running at once: further
+    requests fail fast with HashingBusy (503) instead of piling up.
+
+    The algorithm and cost come from PASSWORD_HASH_METHOD, in werkzeug's
+    format ('scrypt:N:r:p' or 'pbkdf2:sha256:iterations'). Hashes made with
+    other parameters still verify, and `needs_rehash` tells the login flow to
+    upgrade them.
+
+    With PASSWORD_HASH_WORKERS = 0 hashing runs inline on the request thread.
+    """
+
+    def __init__(self, app=None):
+        self.method = DEFAULT_METHOD
+        self.workers = 0
+        self.timeout = 10
+        self.retry_after = 1
+        self._slots = None
+        self._method_prefix = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Reads the hashing settings and registers the exit hook that stops the pool.
+        """
+        self.method = app.config.get ( 'PASSWORD_HASH_METHOD', DEFAULT_METHOD )
+        self.workers = app.config.get ( 'PASSWORD_HASH_WORKERS', os.cpu_count () or 1 )
+        self.timeout = app.config.get ( 'PASSWORD_HASH_TIMEOUT', 10 )
+        self.retry_after = app.config.get ( 'PASSWORD_HASH_RETRY_AFTER', 1 )
+        max_pending = app.config.get ( 'PASSWORD_HASH_MAX_PENDING' ) or max ( 1, self.workers ) * 4
+        self._slots = threading.BoundedSemaphore ( max_pending )
+        self._method_prefix = None
+
+        app.extensions['password_hasher'] = self
+        atexit.register ( self.shutdown )
+
+    def hash(self, password):
+        """
+        Returns a salted hash of `password` using the configured method.
+        """
+        return self._run ( generate_password_hash, password, self.method )
+
+    def verify(self, stored_hash, password):
+        """
+        Returns True if `password` matches `stored_hash`, whatever method it was made with.
+        """
+        if not stored_hash:
+            return False
+        return self._run ( check_password_hash, stored_hash, password )
+
+    def needs_rehash(self, stored_hash):
+        """
+        Returns True if `stored_hash` was made with a different method or cost than the configured one.
+        """
+        return stored_hash.split ( '$', 1 )[0] != self.method_prefix
+
+    @property
+    def method_prefix(self):
+        """
+        The parameter prefix werkzeug writes for the configured method, e.g. 'scrypt:32768:8:1'.
+        Defaults such as plain 'scrypt' are expanded by hashing once with them.
+        """
+        if self._method_prefix is None:
+            self._method_prefix = generate_password_hash ( '', self.method ).split ( '$', 1 )[0]
+        return self._method_prefix
+
+    def _run(self, function, *args):
+        """
+        Runs a hashing function in the pool, or raises HashingBusy if no slot is free.
+        """
+        if not self.workers:
+            return function ( *args )
+
+        if not self._slots.acquire ( blocking=False ):
+            raise HashingBusy ( retry_after=self.retry_after )
+        try:
+            job = self._get_executor ().submit ( function, *args )
+        except Exception:
+            self._slots.release ()
+            raise
+        # The slot is held until the worker is done, even if this request gave up waiting
+        job.add_done_callback ( lambda finished: self._slots.release () )
+
+        try:
+            return job.result ( timeout=self.timeout )
+        except FutureTimeoutError:
+            raise HashingBusy ( retry_after=self.retry_after )
+
+    def _get_executor(self):
+        """
+        Returns this process's worker pool, creating it on first use so forked
+        web workers never share a pool with their parent.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid ():
+                self._pid = os.getpid ()
+                self._executor = ProcessPoolExecutor ( max_workers=self.workers )
+            return self._executor
+
+    def shutdown(self):
+        """
+        Stops the worker pool.
+        """
+        if self._executor is not None and self._pid == os.getpid ():
+            self._executor.shutdown ( wait=False, cancel_futures=True )
+            self._executor = None
+
+
+password_hasher = PasswordHasher ()
@@ -0,0 +1,259 @@
+import logging
+import os
+import threading
+import time
+from itertools import combinations
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update
+
+from model import db, Post
+from storage_backends import media_storage
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # NumPy and Pillow are optional; without them posts are not hashed
+    np = None
+    Image = None
+
+HASH_BITS = 64
+
+
+def dhash_pixels(gray):
+    """
+    Computes the 64-bit difference hash of an (8, 9) grayscale array: one bit
+    per pair of horizontally adjacent pixels, set where brightness increases.
+    """
+    bits = gray[:, 1:] > gray[:, :-1]
+    return int.from_bytes ( np.packbits ( bits.ravel () ).tobytes (), 'big' )
+
+
+def dhash_file(path):
+    """
+    Returns the difference hash of an image file, or None if it cannot be read.
+
+    JPEGs are decoded at reduced scale (draft mode), which makes hashing a
+    large photo take a few milliseconds.
+    """
+    try:
+        with Image.open ( path ) as image:
+            image.draft ( 'L', (64, 64) )
+            gray = image.convert ( 'L' ).resize ( (9, 8), Image.BILINEAR )
+            return dhash_pixels ( np.asarray ( gray, dtype=np.int16 ) )
+    except Exception:
+        logging.exception ( "Hashing image %s failed", path )
+        return None
+
+
+def to_signed(value):
+    """
+    Stores an unsigned 64-bit hash in a signed BIGINT column.
+    """
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class ImageHashIndex:
+    """
+    In-memory multi-index hash table over the `Post.image_dhash` perceptual
+    hashes, for finding near-duplicate images.
+
+    Each 64-bit hash is split into DEDUP_INDEX_BLOCKS blocks with a table per
+    block. Two hashes within Hamming distance r agree to within r // blocks
+    bits on at least one block, so a query only probes the blocks' near
+    neighbours and checks the full distance of the few candidates found.
+    With 4 blocks of 16 bits and r = 6, a query makes 68 lookups, and buckets
+    hold about n / 65536 posts each, well under a millisecond at millions of
+    posts.
+
+    The index is built lazily from a streaming scan of `post`, updated as
+    posts are added and deleted in this process, and picks up posts written
+    by other worker processes every DEDUP_REFRESH_INTERVAL seconds (a range
+    scan on the primary key).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.blocks = 4
+        self.max_distance = 6
+        self.refresh_interval = 30
+        self._lock = threading.RLock ()
+        self._reset ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get ( 'DEDUP_ENABLED', True ) and np is not None
+        self.blocks = app.config.get ( 'DEDUP_INDEX_BLOCKS', 4 )
+        self.max_distance = app.config.get ( 'DEDUP_MAX_DISTANCE', 6 )
+        self.refresh_interval = app.config.get ( 'DEDUP_REFRESH_INTERVAL', 30 )
+        self._reset ()
+
+        app.extensions['image_index'] = self
+        app.cli.add_command ( dedup_cli )
+
+    def _reset(self):
+        widths = [HASH_BITS // self.blocks + (1 if i < HASH_BITS % self.blocks else 0) for i in range ( self.blocks )]
+        self._shifts = []
+        offset = HASH_BITS
+        for width in widths:
+            offset -= width
+            self._shifts.append ( (offset, width, (1 << width) - 1) )
+        self._tables = [{} for _ in range ( self.blocks )]
+        self._hashes = {}
+        self._loaded = False
+        self._max_post_id = 0
+        self._last_refresh = 0.0
+
+    def hash_upload(self, path):
+        """
+        Returns the perceptual hash of a freshly uploaded image file, or None when disabled.
+        """
+        if not self.enabled or path is None:
+            return None
+        return dhash_file ( path )
+
+    def add(self, post_id, image_hash):
+        """
+        Adds or replaces a post's hash in the index.
+        """
+        if image_hash is None:
+            return
+        with self._lock:
+            self.remove ( post_id )
+            self._hashes[post_id] = image_hash
+            for table, (shift, width, mask) in zip ( self._tables, self._shifts ):
+                table.setdefault ( (image_hash >> shift) & mask, [] ).append ( post_id )
+
+    def remove(self, post_id):
+        """
+        Drops a post from the index.
+        """
+        with self._lock:
+            image_hash = self._hashes.pop ( post_id, None )
+            if image_hash is None:
+                return
+            for table, (shift, width, mask) in zip ( self._tables, self._shifts ):
+                key = (image_hash >> shift) & mask
+                bucket = table.get ( key )
+                if bucket is not None:
+                    bucket.remove ( post_id )
+                    if not bucket:
+                        del table[key]
+
+    def query(self, image_hash, max_distance=None, exclude=None):
+        """
+        Returns [(post_id, distance)] for every indexed post within
+        `max_distance` bits of `image_hash`, closest first.
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        self._ensure_loaded ()
+
+        per_block = max_distance // self.blocks
+        matches = {}
+        with self._lock:
+            for table, (shift, width, mask) in zip ( self._tables, self._shifts ):
+                block = (image_hash >> shift) & mask
+                for key in _neighbours ( block, width, per_block ):
+                    for post_id in table.get ( key, () ):
+                        if post_id in matches or post_id == exclude:
+                            continue
+                        distance = (self._hashes[post_id] ^ image_hash).bit_count ()
+                        if distance <= max_distance:
+                            matches[post_id] = distance
+        return sorted ( matches.items (), key=lambda match: (match[1], -match[0]) )
+
+    def hash_of(self, post_id):
+        self._ensure_loaded ()
+        with self._lock:
+            return self._hashes.get ( post_id )
+
+    def __len__(self):
+        return len ( self._hashes )
+
+    def _ensure_loaded(self):
+        """
+        Loads the index on first use, then pulls in posts other processes
+        have added since the last refresh.
+        """
+        if self._loaded and time.monotonic () - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            if self._loaded and time.monotonic () - self._last_refresh < self.refresh_interval:
+                return
+            self._load ( after=self._max_post_id )
+            self._loaded = True
+            self._last_refresh = time.monotonic ()
+
+    def _load(self, after=0, batch_size=10000):
+        """
+        Streams (id, image_dhash) of posts with an ID above `after` into the index.
+        """
+        with self.app.app_context ():
+            statement = (
+                select ( Post.id, Post.image_dhash )
+                .where ( Post.id > after, Post.image_dhash.is_not ( None ) )
+                .order_by ( Post.id )
+                .execution_options ( yield_per=batch_size )
+            )
+            for post_id, image_hash in db.session.execute ( statement ):
+                self.add ( post_id, to_unsigned ( image_hash ) )
+                self._max_post_id = post_id
+            db.session.remove ()
+
+
+def _neighbours(value, width, distance):
+    """
+    Yields every `width`-bit value within `distance` bit flips of `value`.
+    """
+    yield value
+    for flips in range ( 1, distance + 1 ):
+        for positions in combinations ( range ( width ), flips ):
+            flipped = value
+            for position in positions:
+                flipped ^= 1 << position
+            yield flipped
+
+
+# An AppGroup runs its commands inside an application context
+dedup_cli = AppGroup ( 'dedup', help="Perceptual-hash index commands." )
+
+
+@dedup_cli.command ( 'backfill' )
+@click.option ( '--batch-size', default=500, show_default=True )
+def backfill_command(batch_size):
+    """Computes image_dhash for posts that have none."""
+    hashed = 0
+    last_id = 0
+    while True:
+        posts = db.session.execute (
+            select ( Post.id, Post.image_path )
+            .where ( Post.id > last_id, Post.image_dhash.is_ ( None ) )
+            .order_by ( Post.id ).limit ( batch_size )
+        ).all ()
+        if not posts:
+            break
+        for post_id, image_path in posts:
+            last_id = post_id
+            path, owned = media_storage.claim_local_copy ( image_path )
+            try:
+                image_hash = dhash_file ( path ) if os.path.exists ( path ) else None
+            finally:
+                if owned and os.path.exists ( path ):
+                    os.remove ( path )
+            if image_hash is not None:
+                db.session.execute ( update ( Post ).where ( Post.id == post_id ).values ( image_dhash=to_signed ( image_hash ) ) )
+                hashed += 1
+        db.session.commit ()
+    click.echo ( f"Hashed {hashed} post image(s)." )
+
+
+image_index = ImageHashIndex ()
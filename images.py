@@ -0,0 +1,281 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update
+
+from model import db, Blob
+from storage import blob_hash, discard_upload
+from storage_backends import media_storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only the original image is served
+    Image = None
+
+# Variant name -> maximum width in pixels, used when the config does not set IMAGE_VARIANTS
+DEFAULT_VARIANTS = {'thumb': 320, 'feed': 640, 'full': 1080}
+
+# Pillow format name -> file extension for re-encoded variants
+FORMAT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+
+
+def generate_variants(source_path, output_dir, stem, sizes, image_format=None, quality=80):
+    """
+    Writes resized copies of an image as `<stem>_<variant>.<ext>` and returns where they were written.
+
+    Runs in a worker process. Each variant is scaled down to at most its
+    configured width (never up) and optionally re-encoded as WEBP or JPEG.
+
+    Returns:
+        dict: Variant name -> {"file": file name inside `output_dir`, "width": pixel width}.
+    """
+    os.makedirs ( output_dir, exist_ok=True )
+    original_extension = os.path.splitext ( source_path )[1]
+    image_format = (image_format or '').upper () or None
+
+    variants = {}
+    with Image.open ( source_path ) as original:
+        original = ImageOps.exif_transpose ( original )
+        if image_format == 'JPEG' and original.mode not in ('RGB', 'L'):
+            original = original.convert ( 'RGB' )
+        elif original.mode == 'P':
+            original = original.convert ( 'RGBA' )
+
+        for name, max_width in sorted ( sizes.items (), key=lambda item: item[1] ):
+            variant = original.copy ()
+            if variant.width > max_width:
+                height = max ( 1, round ( variant.height * max_width / variant.width ) )
+                variant = variant.resize ( (max_width, height), Image.LANCZOS )
+
+            extension = FORMAT_EXTENSIONS.get ( image_format, original_extension.lstrip ( '.' ) )
+            file_name = f"{stem}_{name}.{extension}"
+            save_options = {'quality': quality} if image_format in ('WEBP', 'JPEG') else {}
+            if image_format == 'JPEG':
+                save_options['optimize'] = True
+            variant.save ( os.path.join ( output_dir, file_name ), format=image_format, **save_options )
+
+            variants[name] = {'file': file_name, 'width': variant.width}
+
+    return variants
+
+
+def variant_paths(variants):
+    """
+    Converts a `generate_variants` result to the `image_variants` stored on rows:
+    variant name -> {"path": path relative to `static`, "width": pixel width}.
+    """
+    return {
+        name: {'path': 'uploads/variants/' + variant['file'], 'width': variant['width']}
+        for name, variant in variants.items ()
+    }
+
+
+class ImagePipeline:
+    """
+    Generates thumbnail, feed and full-size variants of uploaded images in a
+    process pool, off the request thread, and records them on the owning row.
+
+    Usage from a resource:
+        job = image_pipeline.submit ( 'uploads/ab/cd/<hash>.png' )
+        ... commit the row that owns the image ...
+        image_pipeline.record_variants ( job, Post, post.id )
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Reads the pipeline settings and registers the `image_src` / `image_srcset` template helpers.
+        """
+        self.app = app
+        self.enabled = app.config.get ( 'IMAGE_VARIANTS_ENABLED', True ) and Image is not None
+        if app.config.get ( 'IMAGE_VARIANTS_ENABLED', True ) and Image is None:
+            logging.warning ( "Pillow is not installed; image variants are disabled." )
+
+        app.extensions['image_pipeline'] = self
+        app.add_template_global ( image_src, 'image_src' )
+        app.add_template_global ( image_srcset, 'image_srcset' )
+        atexit.register ( self.shutdown )
+
+    def submit(self, image_path):
+        """
+        Starts generating variants for an uploaded image.
+
+        Variants are written straight into the upload folder with local storage;
+        with an object store they are generated in a temporary folder and
+        uploaded to the store when the job finishes.
+
+        Args:
+            image_path (str): The path relative to `static`, e.g. 'uploads/ab/cd/<hash>.png'.
+
+        Returns:
+            Future or None: The pending job, or None if variants are disabled.
+        """
+        if not self.enabled or not image_path:
+            return None
+
+        config = self.app.config
+        source_path, owns_source = media_storage.claim_local_copy ( image_path )
+        output_dir = media_storage.output_dir ( 'uploads/variants' )
+        job = self._get_executor ().submit (
+            generate_variants,
+            source_path,
+            output_dir,
+            os.path.splitext ( os.path.basename ( image_path ) )[0],
+            config.get ( 'IMAGE_VARIANTS', DEFAULT_VARIANTS ),
+            config.get ( 'IMAGE_VARIANT_FORMAT', 'WEBP' ),
+            config.get ( 'IMAGE_VARIANT_QUALITY', 80 ),
+        )
+        if not media_storage.is_local:
+            job.add_done_callback ( lambda finished: self._publish ( finished, source_path, owns_source, output_dir ) )
+        job.add_done_callback ( lambda finished: self._store_on_blob ( finished, image_path ) )
+        return job
+
+    def record_variants(self, job, model, row_id, on_stored=None):
+        """
+        Stores the variant paths on `model.image_variants` for the row once the job finishes,
+        then calls `on_stored()` if given (e.g. to invalidate cached markup showing the image).
+        """
+        if job is not None:
+            job.add_done_callback ( lambda finished: self._store ( finished, model, row_id, on_stored ) )
+
+    def discard(self, job, image_path):
+        """
+        Drops an upload whose owning row was rolled back: deletes the stored
+        image unless another row references it, and does the same for the
+        variants once `job` has written them.
+        """
+        discard_upload ( image_path )
+        if job is not None and not job.cancel ():
+            job.add_done_callback ( lambda finished: self._discard_variants ( image_path ) )
+
+    def _publish(self, job, source_path, owns_source, output_dir):
+        """
+        Completion callback for object storage: uploads the generated variants
+        and removes the local working files.
+        """
+        try:
+            if job.exception () is None:
+                for variant in job.result ().values ():
+                    media_storage.backend.save (
+                        'uploads/variants/' + variant['file'], os.path.join ( output_dir, variant['file'] )
+                    )
+        except Exception:
+            logging.exception ( "Uploading image variants from %s failed", source_path )
+        finally:
+            shutil.rmtree ( output_dir, ignore_errors=True )
+            if owns_source and os.path.exists ( source_path ):
+                os.remove ( source_path )
+
+    def _store(self, job, model, row_id, on_stored=None):
+        """
+        Completion callback: writes the generated variant paths to the owning row.
+        """
+        try:
+            variants = variant_paths ( job.result () )
+            with self.app.app_context ():
+                try:
+                    db.session.execute (
+                        update ( model ).where ( model.id == row_id ).values ( image_variants=variants )
+                    )
+                    db.session.commit ()
+                finally:
+                    db.session.remove ()
+            if on_stored is not None:
+                on_stored ()
+        except Exception:
+            logging.exception ( "Generating image variants for %s %s failed", model.__name__, row_id )
+
+    def _store_on_blob(self, job, image_path):
+        """
+        Completion callback: records the variants on the image's blob, so later
+        uploads of the same content reuse them instead of generating them again.
+        """
+        digest = blob_hash ( image_path )
+        if digest is None or job.exception () is not None:
+            return
+        try:
+            with self.app.app_context ():
+                try:
+                    db.session.execute (
+                        update ( Blob ).where ( Blob.hash == digest ).values ( variants=variant_paths ( job.result () ) )
+                    )
+                    db.session.commit ()
+                finally:
+                    db.session.remove ()
+        except Exception:
+            logging.exception ( "Recording image variants for blob %s failed", digest )
+
+    def _discard_variants(self, image_path):
+        """
+        Completion callback for a discarded upload: removes the variants the job wrote.
+        """
+        try:
+            with self.app.app_context ():
+                try:
+                    discard_upload ( image_path )
+                finally:
+                    db.session.remove ()
+        except Exception:
+            logging.exception ( "Discarding the variants of %s failed", image_path )
+
+    def _get_executor(self):
+        """
+        Returns this process's worker pool, creating it on first use so forked
+        web workers never share a pool with their parent.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid ():
+                self._pid = os.getpid ()
+                self._executor = ProcessPoolExecutor (
+                    max_workers=self.app.config.get ( 'IMAGE_WORKERS', 2 )
+                )
+            return self._executor
+
+    def shutdown(self):
+        """
+        Waits for running jobs and stops the worker pool.
+        """
+        if self._executor is not None and self._pid == os.getpid ():
+            self._executor.shutdown ( wait=True )
+            self._executor = None
+
+
+def image_src(item, variant='feed'):
+    """
+    Template helper: URL of an image variant for a Post or Profile,
+    falling back to the original upload until the variant exists.
+    """
+    if item is None:
+        return ''
+    variants = getattr ( item, 'image_variants', None ) or {}
+    if variant in variants:
+        return media_storage.url ( variants[variant]['path'] )
+    return media_storage.url ( item.image_path )
+
+
+def image_srcset(item):
+    """
+    Template helper: `srcset` attribute value listing every variant of a Post or Profile image.
+    """
+    variants = getattr ( item, 'image_variants', None ) or {}
+    # Small originals produce several variants of the same width; list each width once
+    by_width = {variant['width']: variant['path'] for variant in variants.values ()}
+    return ', '.join (
+        f"{media_storage.url ( path )} {width}w" for width, path in sorted ( by_width.items () )
+    )
+
+
+image_pipeline = ImagePipeline ()
@@ -0,0 +1,246 @@
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from model import db
+import likes
+
+
+class LikeBuffer:
+    """
+    Write-behind buffer for like / unlike events on hot posts.
+
+    Toggles are recorded in memory and answered immediately with an optimistic
+    count. A background thread flushes the net result per (user, post) pair to
+    the `likes` table and `post.likes_count` in batched transactions, either
+    every LIKE_BUFFER_FLUSH_INTERVAL seconds or as soon as
+    LIKE_BUFFER_MAX_PENDING pairs are waiting. Pending events are flushed when
+    the process exits cleanly.
+
+    Flushing applies the *target* state of each pair with the same
+    insert-or-ignore / delete helpers as the unbuffered path and adjusts the
+    counter by the rows actually written, so the database stays exact even if
+    the buffer's view of the starting state was stale.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.flush_interval = 1.0
+        self.max_pending = 1000
+        self.batch_size = 500
+
+        self._lock = threading.Lock ()
+        self._flush_lock = threading.Lock ()
+        self._wakeup = threading.Event ()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+        # (user_id, post_id) -> [liked in database, liked after buffered toggles]
+        self._pending = {}
+        # Entries taken by a flush that has not committed yet
+        self._inflight = {}
+        # post_id -> net like delta of pending and in-flight entries
+        self._deltas = defaultdict ( int )
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Reads the buffer settings from the app config and registers the
+        exit hook that flushes pending likes.
+        """
+        self.app = app
+        self.enabled = app.config.get ( 'LIKE_BUFFER_ENABLED', False )
+        self.flush_interval = app.config.get ( 'LIKE_BUFFER_FLUSH_INTERVAL', 1.0 )
+        self.max_pending = app.config.get ( 'LIKE_BUFFER_MAX_PENDING', 1000 )
+        self.batch_size = app.config.get ( 'LIKE_BUFFER_BATCH_SIZE', 500 )
+        app.extensions['like_buffer'] = self
+        app.add_template_global ( self.like_count, 'like_count' )
+
+        if self.enabled:
+            atexit.register ( self.shutdown )
+
+    def toggle(self, user_id, post_id):
+        """
+        Records a like / unlike for the user and returns whether the post is now liked.
+        """
+        key = (user_id, post_id)
+
+        with self._lock:
+            known = key in self._pending or key in self._inflight
+        # Only ask the database when the buffer has no opinion about this pair yet
+        liked_in_db = None if known else likes.like_exists ( user_id, post_id )
+
+        with self._lock:
+            entry = self._pending.get ( key )
+            if entry is None:
+                inflight = self._inflight.get ( key )
+                baseline = inflight[1] if inflight is not None else liked_in_db
+                if baseline is None:
+                    baseline = False
+                entry = self._pending[key] = [baseline, baseline]
+
+            entry[1] = not entry[1]
+            self._deltas[post_id] += 1 if entry[1] else -1
+
+            # Two toggles cancel out; nothing to write for this pair
+            if entry[0] == entry[1]:
+                del self._pending[key]
+
+            liked = entry[1]
+            pending = len ( self._pending )
+
+        self._ensure_worker ()
+        if pending >= self.max_pending:
+            self._wakeup.set ()
+        return liked
+
+    def is_liked(self, user_id, post_id):
+        """
+        Returns the buffered like state for the pair, or None if nothing is buffered.
+        """
+        key = (user_id, post_id)
+        with self._lock:
+            entry = self._pending.get ( key ) or self._inflight.get ( key )
+            return entry[1] if entry is not None else None
+
+    def pending_delta(self, post_id):
+        """
+        Returns the net number of likes buffered for a post but not yet committed.
+        """
+        with self._lock:
+            return self._deltas.get ( post_id, 0 )
+
+    def merge_count(self, post_id, stored_count):
+        """
+        Returns the like count to show for a post: the stored counter plus pending deltas.
+        """
+        return max ( 0, stored_count + self.pending_delta ( post_id ) )
+
+    def like_count(self, post):
+        """
+        Template helper: the like count to display for a post.
+        """
+        return self.merge_count ( post.id, post.likes_count )
+
+    def flush(self):
+        """
+        Writes all pending likes to the database in batched transactions.
+
+        Returns:
+            int: The number of (user, post) pairs written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight = self._pending
+                self._pending = {}
+                entries = list ( self._inflight.items () )
+
+            written = 0
+            try:
+                with self.app.app_context ():
+                    for start in range ( 0, len ( entries ), self.batch_size ):
+                        batch = entries[start:start + self.batch_size]
+                        self._write_batch ( batch )
+                        self._release ( batch )
+                        written += len ( batch )
+            except Exception:
+                logging.exception ( "Flushing buffered likes failed; %d pairs re-queued", len ( entries ) - written )
+                self._requeue ( entries[written:] )
+                raise
+            return written
+
+    def _write_batch(self, batch):
+        """
+        Applies one batch of buffered likes in a single transaction.
+        """
+        counter_deltas = defaultdict ( int )
+        try:
+            for (user_id, post_id), (_, liked) in batch:
+                if liked:
+                    counter_deltas[post_id] += likes.insert_like_ignore ( user_id, post_id )
+                else:
+                    counter_deltas[post_id] -= likes.delete_like ( user_id, post_id )
+
+            # One counter update per post instead of one per click
+            for post_id, delta in counter_deltas.items ():
+                likes.adjust_like_count ( post_id, delta )
+            db.session.commit ()
+        except Exception:
+            db.session.rollback ()
+            raise
+        finally:
+            db.session.remove ()
+
+    def _release(self, batch):
+        """
+        Drops committed entries from the in-flight set and their optimistic deltas.
+        """
+        with self._lock:
+            for key, (was_liked, liked) in batch:
+                self._inflight.pop ( key, None )
+                self._deltas[key[1]] -= int ( liked ) - int ( was_liked )
+                if not self._deltas[key[1]]:
+                    del self._deltas[key[1]]
+
+    def _requeue(self, entries):
+        """
+        Puts entries from a failed flush back into the pending set.
+        """
+        with self._lock:
+            for key, entry in entries:
+                self._inflight.pop ( key, None )
+                newer = self._pending.get ( key )
+                if newer is None:
+                    self._pending[key] = entry
+                else:
+                    # Toggled again while flushing: keep the original baseline
+                    newer[0] = entry[0]
+
+    def _ensure_worker(self):
+        """
+        Starts the flush thread in this process if it is not running yet.
+        Started lazily so every forked worker gets its own thread.
+        """
+        if self._thread is not None and self._pid == os.getpid ():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid ():
+                return
+            self._pid = os.getpid ()
+            self._thread = threading.Thread ( target=self._run, name='like-buffer-flush', daemon=True )
+            self._thread.start ()
+
+    def _run(self):
+        """
+        Flushes pending likes on a timer or when the size threshold is reached.
+        """
+        while not self._stopped:
+            self._wakeup.wait ( self.flush_interval )
+            self._wakeup.clear ()
+            try:
+                self.flush ()
+            except Exception:
+                # Already logged; the entries are retried on the next tick
+                pass
+
+    def shutdown(self):
+        """
+        Stops the flush thread and writes out everything still pending.
+        """
+        self._stopped = True
+        self._wakeup.set ()
+        if self._thread is not None and self._thread.is_alive ():
+            self._thread.join ( timeout=self.flush_interval + 5 )
+        if self.app is not None:
+            self.flush ()
+
+
+like_buffer = LikeBuffer ()
@@ -0,0 +1,82 @@
+from sqlalchemy import delete, insert, select, update
+from model import db, Post, Like
+
+
+def insert_like_ignore(user_id, post_id):
+    """
+    Inserts a like row unless the (user_id, post_id) pair already exists.
+
+    Relies on the unique constraint on `likes(user_id, post_id)`, so two
+    concurrent requests can never create duplicate rows.
+
+    Returns:
+        int: 1 if a row was inserted, 0 if the like already existed.
+    """
+    statement = insert ( Like ).values ( user_id=user_id, post_id=post_id ) \
+        .prefix_with ( 'OR IGNORE', dialect='sqlite' ) \
+        .prefix_with ( 'IGNORE', dialect='mysql' )
+    return db.session.execute ( statement ).rowcount
+
+
+def delete_like(user_id, post_id):
+    """
+    Deletes the like row for the (user_id, post_id) pair if there is one.
+
+    Returns:
+        int: The number of rows deleted (0 or 1).
+    """
+    statement = delete ( Like ).where ( Like.user_id == user_id, Like.post_id == post_id )
+    return db.session.execute ( statement ).rowcount
+
+
+def adjust_like_count(post_id, delta):
+    """
+    Adds `delta` to a post's like counter with a single SQL-side update
+    (`likes_count = likes_count + delta`), so concurrent writers never lose updates.
+    """
+    if delta:
+        db.session.execute (
+            update ( Post )
+            .where ( Post.id == post_id )
+            .values ( likes_count=Post.likes_count + delta )
+            .execution_options ( synchronize_session=False )
+        )
+
+
+def toggle_like(user_id, post_id):
+    """
+    Atomically likes or unlikes a post for a user within the current transaction.
+
+    The like is inserted with insert-or-ignore semantics first; if the row
+    already existed it is deleted instead. The counter is only changed by the
+    number of rows actually inserted or deleted, so it always matches the
+    `likes` table. The caller is responsible for committing.
+
+    Returns:
+        bool: True if the post is now liked, False if it is now unliked.
+    """
+    if insert_like_ignore ( user_id, post_id ):
+        adjust_like_count ( post_id, 1 )
+        return True
+
+    removed = delete_like ( user_id, post_id )
+    adjust_like_count ( post_id, -removed )
+    return False
+
+
+def like_exists(user_id, post_id):
+    """
+    Checks whether the user currently likes the post.
+    """
+    return db.session.execute (
+        select ( Like.id ).where ( Like.user_id == user_id, Like.post_id == post_id ).limit ( 1 )
+    ).first () is not None
+
+
+def get_like_count(post_id):
+    """
+    Reads a post's current like counter straight from the database.
+    """
+    return db.session.execute (
+        select ( Post.likes_count ).where ( Post.id == post_id )
+    ).scalar ()
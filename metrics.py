@@ -0,0 +1,361 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, request
+
+# Latency buckets in seconds, from cache hits to slow page renders
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upload size buckets in bytes, 16 KB to 16 MB
+SIZE_BUCKETS = tuple ( 2 ** exponent for exponent in range ( 14, 25 ) )
+
+
+class Metric:
+    """
+    Base class of the collectors: a named family of values keyed by label values.
+
+    Updates take one short lock per metric and do no I/O, so collectors can be
+    used from any thread. Each process keeps its own values; see
+    `MetricsRegistry` for how gunicorn workers are combined.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple ( labelnames )
+        self._values = {}
+        self._lock = threading.Lock ()
+
+    def _key(self, labels):
+        if len ( labels ) != len ( self.labelnames ):
+            raise ValueError ( f"{self.name} expects labels {self.labelnames}, got {labels}" )
+        return tuple ( str ( value ) for value in labels )
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable copy of the current values.
+        """
+        with self._lock:
+            return [[list ( key ), self._copy ( value )] for key, value in self._values.items ()]
+
+    def _copy(self, value):
+        return value
+
+
+class Counter ( Metric ):
+    """
+    A value that only goes up, e.g. requests served.
+    """
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key ( labels )
+        with self._lock:
+            self._values[key] = self._values.get ( key, 0 ) + amount
+
+
+class Gauge ( Metric ):
+    """
+    A value that goes up and down, e.g. requests in flight.
+    """
+
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        key = self._key ( labels )
+        with self._lock:
+            self._values[key] = self._values.get ( key, 0 ) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc ( *labels, amount=-amount )
+
+    def set(self, *labels, value):
+        key = self._key ( labels )
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram ( Metric ):
+    """
+    Counts observations into cumulative buckets and keeps their sum.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super ().__init__ ( name, documentation, labelnames )
+        self.buckets = tuple ( sorted ( buckets ) )
+
+    def observe(self, *labels, value):
+        key = self._key ( labels )
+        index = bisect.bisect_left ( self.buckets, value )
+        with self._lock:
+            state = self._values.get ( key )
+            if state is None:
+                # One count per bucket plus +Inf, then the sum
+                state = self._values[key] = [0] * (len ( self.buckets ) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _copy(self, value):
+        return list ( value )
+
+
+class MetricsRegistry:
+    """
+    Holds the app's metrics and renders them in the Prometheus text format.
+
+    Under gunicorn every worker process counts on its own. When
+    METRICS_MULTIPROC_DIR is set, each process writes a snapshot of its
+    values to that directory at most every METRICS_SYNC_INTERVAL seconds
+    (after a request) and when it exits, and a scrape served by any worker
+    adds up the snapshots of all of them. Gauges are only taken from
+    processes that are still running. Point the directory at an empty
+    location on each deploy.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.multiproc_dir = None
+        self.sync_interval = 5.0
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock ()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, function):
+        """
+        Registers a function called before each scrape and snapshot, to set
+        gauges that are read from elsewhere (like connection pool usage).
+        """
+        self.collectors.append ( function )
+        return function
+
+    def collect(self):
+        for function in self.collectors:
+            try:
+                function ()
+            except Exception:
+                logging.exception ( "Metrics collector %s failed", function.__name__ )
+        return {name: metric.snapshot () for name, metric in self.metrics.items ()}
+
+    def maybe_sync(self):
+        """
+        Writes this process's snapshot if the last one is older than the sync interval.
+        """
+        if self.multiproc_dir and time.monotonic () - self._last_sync >= self.sync_interval:
+            self.sync ()
+
+    def sync(self):
+        """
+        Writes this process's snapshot to the multi-process directory.
+        """
+        if not self.multiproc_dir or not self._sync_lock.acquire ( blocking=False ):
+            return
+        try:
+            self._last_sync = time.monotonic ()
+            path = self._snapshot_path ( os.getpid () )
+            temp_path = f"{path}.tmp"
+            with open ( temp_path, 'w' ) as handle:
+                json.dump ( self.collect (), handle )
+            os.replace ( temp_path, path )
+        except OSError:
+            logging.exception ( "Writing the metrics snapshot failed" )
+        finally:
+            self._sync_lock.release ()
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        snapshots = [(self.collect (), True)]
+        if self.multiproc_dir:
+            snapshots.extend ( self._other_snapshots () )
+
+        lines = []
+        for name, metric in self.metrics.items ():
+            merged = {}
+            for snapshot, alive in snapshots:
+                if metric.kind == 'gauge' and not alive:
+                    continue
+                for key, value in snapshot.get ( name, () ):
+                    key = tuple ( key )
+                    if key not in merged:
+                        merged[key] = value
+                    elif metric.kind == 'histogram':
+                        merged[key] = [mine + theirs for mine, theirs in zip ( merged[key], value )]
+                    else:
+                        merged[key] += value
+
+            lines.append ( f"# HELP {name} {metric.documentation}" )
+            lines.append ( f"# TYPE {name} {metric.kind}" )
+            for key, value in sorted ( merged.items () ):
+                labels = list ( zip ( metric.labelnames, key ) )
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip ( metric.buckets + (float ( 'inf' ),), value[:-1] ):
+                        cumulative += count
+                        le = '+Inf' if bound == float ( 'inf' ) else repr ( float ( bound ) )
+                        lines.append ( f"{name}_bucket{_format_labels ( labels + [('le', le)] )} {cumulative}" )
+                    lines.append ( f"{name}_sum{_format_labels ( labels )} {value[-1]}" )
+                    lines.append ( f"{name}_count{_format_labels ( labels )} {cumulative}" )
+                else:
+                    lines.append ( f"{name}{_format_labels ( labels )} {value}" )
+        return '\n'.join ( lines ) + '\n'
+
+    def _snapshot_path(self, pid):
+        return os.path.join ( self.multiproc_dir, f"metrics-{pid}.json" )
+
+    def _other_snapshots(self):
+        """
+        Yields (snapshot, process is alive) for every other process's snapshot file.
+        """
+        pid = os.getpid ()
+        try:
+            names = os.listdir ( self.multiproc_dir )
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith ( 'metrics-' ) and name.endswith ( '.json' )):
+                continue
+            other = int ( name[len ( 'metrics-' ):-len ( '.json' )] )
+            if other == pid:
+                continue
+            try:
+                with open ( os.path.join ( self.multiproc_dir, name ) ) as handle:
+                    yield json.load ( handle ), _process_alive ( other )
+            except (OSError, ValueError):
+                continue
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join ( f'{name}="{_escape ( value )}"' for name, value in labels ) + '}'
+
+
+def _escape(value):
+    return str ( value ).replace ( '\\', '\\\\' ).replace ( '"', '\\"' ).replace ( '\n', '\\n' )
+
+
+def _process_alive(pid):
+    try:
+        os.kill ( pid, 0 )
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = MetricsRegistry ()
+
+request_duration = registry.register ( Histogram (
+    'http_request_duration_seconds', 'Request latency by resource and method.', ('resource', 'method') ) )
+requests_total = registry.register ( Counter (
+    'http_requests_total', 'Requests served by resource, method and status.', ('resource', 'method', 'status') ) )
+requests_in_flight = registry.register ( Gauge (
+    'http_requests_in_flight', 'Requests currently being handled by resource.', ('resource',) ) )
+upload_bytes = registry.register ( Histogram (
+    'image_upload_bytes', 'Size of stored image uploads.', ('kind',), buckets=SIZE_BUCKETS ) )
+upload_duration = registry.register ( Histogram (
+    'image_upload_duration_seconds', 'Time to hash and store an image upload.', ('kind',) ) )
+like_toggles = registry.register ( Counter (
+    'like_toggles_total', 'Like and unlike actions.', ('action', 'mode') ) )
+availability_checks = registry.register ( Counter (
+    'availability_checks_total', 'Availability checks by column and outcome (filtered, taken, false_positive, unfiltered).',
+    ('column', 'result') ) )
+db_pool_checked_out = registry.register ( Gauge (
+    'db_pool_checked_out', 'Database connections in use.', ('bind',) ) )
+db_pool_size = registry.register ( Gauge (
+    'db_pool_size', 'Database connections the pool keeps open (not counting overflow).', ('bind',) ) )
+db_pool_overflow = registry.register ( Gauge (
+    'db_pool_overflow', 'Connections open beyond the pool size; negative while the pool is not full.', ('bind',) ) )
+
+
+class Metrics:
+    """
+    Records request latency and in-flight requests per flask_restful resource,
+    and serves everything in `registry` from the /metrics resource.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get ( 'METRICS_ENABLED', True )
+        registry.multiproc_dir = app.config.get ( 'METRICS_MULTIPROC_DIR' )
+        registry.sync_interval = app.config.get ( 'METRICS_SYNC_INTERVAL', 5.0 )
+        if registry.multiproc_dir:
+            os.makedirs ( registry.multiproc_dir, exist_ok=True )
+            atexit.register ( registry.sync )
+
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        app.before_request ( self._start )
+        app.after_request ( self._finish )
+        app.teardown_request ( self._teardown )
+        registry.add_collector ( self._collect_pool_usage )
+
+    def _start(self):
+        g.metrics_resource = resource_name ()
+        g.metrics_started = time.perf_counter ()
+        requests_in_flight.inc ( g.metrics_resource )
+
+    def _finish(self, response):
+        started = g.get ( 'metrics_started' )
+        if started is not None:
+            resource = g.metrics_resource
+            request_duration.observe ( resource, request.method, value=time.perf_counter () - started )
+            requests_total.inc ( resource, request.method, response.status_code )
+        registry.maybe_sync ()
+        return response
+
+    def _teardown(self, error=None):
+        # Teardown also runs for requests that failed with an exception
+        resource = g.pop ( 'metrics_resource', None )
+        if resource is not None:
+            requests_in_flight.dec ( resource )
+
+    def _collect_pool_usage(self):
+        with self.app.app_context ():
+            engines = current_app.extensions['sqlalchemy'].engines
+            for bind, engine in engines.items ():
+                bind = bind or 'default'
+                pool = engine.pool
+                db_pool_checked_out.set ( bind, value=pool.checkedout () if hasattr ( pool, 'checkedout' ) else 0 )
+                if hasattr ( pool, 'size' ) and hasattr ( pool, 'overflow' ):
+                    db_pool_size.set ( bind, value=pool.size () )
+                    db_pool_overflow.set ( bind, value=pool.overflow () )
+
+
+def resource_name():
+    """
+    Returns the flask_restful Resource class handling this request (or the
+    endpoint name for plain views and 'unmatched' for 404s).
+    """
+    if request.endpoint is None:
+        return 'unmatched'
+    view = current_app.view_functions.get ( request.endpoint )
+    view_class = getattr ( view, 'view_class', None )
+    return view_class.__name__ if view_class is not None else request.endpoint
+
+
+metrics = Metrics ()
@@ -1,11 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from database import RoutingSession
 from flask_login import UserMixin
 from datetime import datetime
 
-db = SQLAlchemy()
+db = SQLAlchemy ( session_options={'class_': RoutingSession} )
+migrate = Migrate()  # Schema migrations live in migrations/; run `flask db upgrade`
 
 
 class User ( UserMixin, db.Model ):
+    # Accounts merged into home timelines at read time: WHERE follower_count >= ?
+    __table_args__ = ( db.Index ( 'ix_user_follower_count', 'follower_count' ), )
     id = db.Column ( db.Integer, primary_key=True )
     username = db.Column ( db.String ( 80 ), unique=True, nullable=False )
     email = db.Column ( db.String ( 120 ), unique=True, nullable=True )
@@ -14,16 +19,37 @@ class User ( UserMixin, db.Model ):
     posts = db.relationship ( 'Post', backref='author', lazy=True )
     profiles = db.relationship ( 'Profile', backref='author', lazy=True )
     post_count = db.Column ( db.Integer, default=0 )
+    follower_count = db.Column ( db.Integer, default=0, server_default='0', nullable=False )
+    following_count = db.Column ( db.Integer, default=0, server_default='0', nullable=False )
 
     # Updated the backref here to avoid conflict with the 'user' in Like
     likes = db.relationship ( 'Like', back_populates='user', lazy=True )
 
+    @property
+    def profile(self):
+        """
+        Returns the user's profile, or None if they have not created one.
+        """
+        return self.profiles[0] if self.profiles else None
+
+    @property
+    def avatar_path(self):
+        """
+        Returns the image path of the user's profile picture, or None if there is none.
+        """
+        profile = self.profile
+        return profile.image_path if profile else None
+
 class Post(db.Model):
     __tablename__ = 'post'
+    # Profile grid: WHERE user_id = ? AND id < ? ORDER BY id DESC
+    __table_args__ = ( db.Index ( 'ix_post_user_id_id', 'user_id', 'id' ), )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
     image_path = db.Column(db.String(200), nullable=False)
+    image_variants = db.Column(db.JSON, nullable=True)  # Resized copies, filled in by the image pipeline
+    image_dhash = db.Column(db.BigInteger, nullable=True)  # 64-bit perceptual hash of the image, see image_index.py
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Correct ForeignKey
     likes_count = db.Column(db.Integer, default=0, nullable=False)
 
@@ -33,12 +59,14 @@ class Post(db.Model):
 
 
 class Profile(db.Model):
+    __table_args__ = ( db.Index ( 'ix_profile_user_id', 'user_id' ), )
     id = db.Column ( db.Integer, primary_key=True )
     user_id = db.Column ( db.Integer, db.ForeignKey ( 'user.id' ), nullable=False )
     username = db.Column ( db.String ( 100 ))
     nickname = db.Column ( db.String ( 100 ), nullable=True )
     bio = db.Column ( db.Text, nullable=True )
     image_path = db.Column ( db.String ( 200 ), nullable=True )
+    image_variants = db.Column ( db.JSON, nullable=True )  # Resized copies, filled in by the image pipeline
 
     def __init__(self, nickname, bio, image_path, user_id):
 
@@ -49,6 +77,8 @@ class Profile(db.Model):
 
 
 class Comment ( db.Model ):
+    # Latest comments per post and older-comment pages: WHERE post_id ... ORDER BY id DESC
+    __table_args__ = ( db.Index ( 'ix_comment_post_id_id', 'post_id', 'id' ), )
     id = db.Column ( db.Integer, primary_key=True )
     text = db.Column ( db.String ( 500 ), nullable=False )
     timestamp = db.Column ( db.DateTime, default=datetime.utcnow )
@@ -63,8 +93,40 @@ class Comment ( db.Model ):
 
 
 
+class Blob ( db.Model ):
+    """
+    A stored upload, addressed by the SHA-256 of its content and shared by every
+    Post / Profile whose image_path points at it.
+    """
+    id = db.Column ( db.Integer, primary_key=True )
+    hash = db.Column ( db.String ( 64 ), unique=True, nullable=False )
+    path = db.Column ( db.String ( 200 ), nullable=False )
+    size = db.Column ( db.Integer, nullable=False )
+    ref_count = db.Column ( db.Integer, default=0, nullable=False )
+    variants = db.Column ( db.JSON, nullable=True )  # Resized copies, reused by later uploads of the same content
+
+
+class UserSession ( db.Model ):
+    """
+    A server-side login session, used when SESSION_BACKEND = 'sql'.
+    The browser cookie only carries `sid`.
+    """
+    __tablename__ = 'user_sessions'
+    sid = db.Column ( db.String ( 64 ), primary_key=True )
+    user_id = db.Column ( db.Integer, index=True, nullable=True )
+    data = db.Column ( db.Text, nullable=False )  # Compact JSON of the session contents
+    last_seen = db.Column ( db.Float, nullable=False )  # Unix timestamps
+    expires_at = db.Column ( db.Float, index=True, nullable=False )
+
+
 class Like(db.Model):
     __tablename__ = 'likes'
+    # One like per user per post; toggling relies on this for insert-or-ignore
+    # (user_id, post_id) also serves "which of these posts did I like"; post_id alone serves per-post lookups
+    __table_args__ = (
+        db.UniqueConstraint ( 'user_id', 'post_id', name='uq_likes_user_post' ),
+        db.Index ( 'ix_likes_post_id', 'post_id' ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Reference 'user.id'
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))  # Reference 'post.id'
@@ -72,3 +134,29 @@ class Like(db.Model):
     # Updated the back_populates to match the new backref in the User model
     user = db.relationship('User', back_populates='likes')
     post = db.relationship('Post', back_populates='likes')
+
+
+class Follow ( db.Model ):
+    """
+    `follower_id` follows `followed_id`. The primary key serves "whom do I
+    follow"; the reverse index serves fan-out to an account's followers.
+    """
+    __tablename__ = 'follow'
+    __table_args__ = ( db.Index ( 'ix_follow_followed_id_follower_id', 'followed_id', 'follower_id' ), )
+    follower_id = db.Column ( db.Integer, db.ForeignKey ( 'user.id' ), primary_key=True )
+    followed_id = db.Column ( db.Integer, db.ForeignKey ( 'user.id' ), primary_key=True )
+    created_at = db.Column ( db.DateTime, default=datetime.utcnow )
+
+
+class TimelineEntry ( db.Model ):
+    """
+    One post in a user's materialized home timeline, written by the fan-out
+    worker (see timeline.py). Derived data: `flask timeline rebuild` recreates it.
+    """
+    __tablename__ = 'timeline'
+    # Home page: WHERE user_id = ? AND post_id < ? ORDER BY post_id DESC is a range on the primary key
+    # Unfollow: WHERE user_id = ? AND author_id = ?
+    __table_args__ = ( db.Index ( 'ix_timeline_user_id_author_id', 'user_id', 'author_id' ), )
+    user_id = db.Column ( db.Integer, primary_key=True, autoincrement=False )
+    post_id = db.Column ( db.Integer, primary_key=True, autoincrement=False )
+    author_id = db.Column ( db.Integer, nullable=False )
@@ -0,0 +1,135 @@
+import json
+import logging
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger ( 'instaclone.queries' )
+
+
+class QueryBudgetExceeded ( AssertionError ):
+    """
+    Raised when a request issues more queries than its endpoint's budget
+    while QUERY_BUDGET_STRICT or TESTING is on.
+    """
+
+
+class RequestQueryStats:
+    """
+    SQL statistics for one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter ()
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+
+class QueryStats:
+    """
+    Counts and times the SQL statements each request runs, using engine events.
+
+    Every response gets a `Server-Timing` header with the database time and
+    query count (visible in the browser's network panel), and a JSON log line
+    on the `instaclone.queries` logger with the slowest statement.
+
+    QUERY_BUDGETS maps endpoint names to the most queries a request may run,
+    e.g. {'dashboard': 8}. Going over logs a warning, or raises
+    QueryBudgetExceeded when QUERY_BUDGET_STRICT is set, so an N+1 query
+    introduced in a resource or template fails the test that renders it.
+    """
+
+    _listening = False
+
+    def __init__(self, app=None):
+        self.budgets = {}
+        self.default_budget = None
+        self.strict = False
+        self.slow_query_ms = 100
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.budgets = dict ( app.config.get ( 'QUERY_BUDGETS', {} ) )
+        self.default_budget = app.config.get ( 'QUERY_BUDGET_DEFAULT' )
+        self.strict = app.config.get ( 'QUERY_BUDGET_STRICT', False ) or app.testing
+        self.slow_query_ms = app.config.get ( 'QUERY_SLOW_MS', 100 )
+
+        app.extensions['query_stats'] = self
+        app.before_request ( self._start )
+        app.after_request ( self._finish )
+
+        # Engine events are registered once for every engine in the process
+        if not QueryStats._listening:
+            event.listen ( Engine, 'before_cursor_execute', _before_cursor_execute )
+            event.listen ( Engine, 'after_cursor_execute', _after_cursor_execute )
+            QueryStats._listening = True
+
+    def budget_for(self, endpoint):
+        return self.budgets.get ( endpoint, self.default_budget )
+
+    def _start(self):
+        g.query_stats = RequestQueryStats ()
+
+    def _finish(self, response):
+        stats = g.pop ( 'query_stats', None )
+        if stats is None:
+            return response
+
+        elapsed = time.perf_counter () - stats.started
+        response.headers.add (
+            'Server-Timing', f'db;dur={stats.total * 1000:.1f};desc="{stats.count} queries"'
+        )
+        response.headers.add ( 'Server-Timing', f'app;dur={elapsed * 1000:.1f}' )
+
+        record = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round ( stats.total * 1000, 2 ),
+            'request_ms': round ( elapsed * 1000, 2 ),
+            'slowest_ms': round ( stats.slowest * 1000, 2 ),
+            'slowest_statement': ' '.join ( stats.slowest_statement.split () )[:300] if stats.slowest_statement else None,
+        }
+        if stats.slowest * 1000 >= self.slow_query_ms:
+            logger.warning ( json.dumps ( record ) )
+        else:
+            logger.info ( json.dumps ( record ) )
+
+        budget = self.budget_for ( request.endpoint )
+        if budget is not None and stats.count > budget:
+            message = f"{request.method} {request.path} ({request.endpoint}) ran {stats.count} queries, budget is {budget}"
+            if self.strict:
+                raise QueryBudgetExceeded ( message )
+            logger.warning ( message )
+        return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault ( 'query_started', [] ).append ( time.perf_counter () )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop ()
+    # Queries from background threads (like buffer, image pipeline) have no request
+    if has_request_context ():
+        stats = g.get ( 'query_stats' )
+        if stats is not None:
+            stats.record ( statement, time.perf_counter () - started )
+
+
+query_stats = QueryStats ()
@@ -8,12 +8,34 @@ logging.basicConfig ( level=logging.INFO )  # You can set it to DEBUG for more d
 from flask import Flask, render_template, make_response, redirect, url_for, flash, session, request, jsonify, app
 from model import db, User, Post, Profile, Like, Comment
 from config import config
+from feed import get_home_page, get_posts_page, get_latest_comments, get_comments_page, get_liked_post_ids, parse_cursor
+import likes
+import follows
+from like_buffer import like_buffer
 import flask_restful
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import password_hasher, HashingBusy
+from sessions import session_manager
+from database import replica_reads
 import os
+import io
 import time
 import base64
 from flask import current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy import delete, or_
+from sqlalchemy.exc import IntegrityError
+from uploads import ALLOWED_IMAGE_EXTENSIONS, UploadTooLarge, get_image_extension
+from images import image_pipeline, image_src
+from filters import filter_engine, FilterUnavailable
+import storage
+from storage_backends import media_storage
+from image_index import image_index, to_signed
+from search_index import user_search
+from availability import availability
+from timeline import timelines
+from cache import fragment_cache
+from user_cache import user_cache
+import metrics
 
 
 class Home ( Resource ):
@@ -31,7 +53,7 @@ class Register ( Resource ):
         # Validate form data
         if not self.is_valid_form_data ( data ):
             flash ( "Missing required fields", "danger" )
-            return redirect ( url_for ( 'register' ) ), 400
+            return redirect ( url_for ( 'register' ) )
 
         username = data["username"]
         email = data["email"]
@@ -41,17 +63,25 @@ class Register ( Resource ):
         # Check if the user already exists
         if self.user_exists ( username, email, number ):
             flash ( "User already exists", "danger" )
-            return redirect ( url_for ( 'register' ) ), 409
+            return redirect ( url_for ( 'register' ) )
 
         # Create and save the new user
         try:
             self.create_new_user ( email, username, password, number )
             flash ( 'Registration successful! Please log in.', 'success' )
             return redirect ( url_for ( 'login' ) )
+        except HashingBusy:
+            db.session.rollback ()
+            raise  # Answered with 503 so the client retries later
+        except IntegrityError:
+            # Registered meanwhile, possibly by another worker the availability filters had not caught up with
+            db.session.rollback ()
+            flash ( "User already exists", "danger" )
+            return redirect ( url_for ( 'register' ) )
         except Exception as e:
             db.session.rollback ()
             flash ( f"An error occurred: {str ( e )}", 'danger' )
-            return redirect ( url_for ( 'register' ) ), 500
+            return redirect ( url_for ( 'register' ) )
 
     def is_valid_form_data(self, data):
         """Helper function to check if required form fields are present"""
@@ -59,17 +89,26 @@ class Register ( Resource ):
         return all ( key in data for key in required_fields )
 
     def user_exists(self, username, email, number):
-        """Helper function to check if a user already exists"""
-        return User.query.filter (
-            (User.email == email) | (User.username == username) | (User.number == number)
-        ).first ()
+        """Helper function to check if a user already exists.
+        Only the columns the availability filters cannot rule out are queried, and none when all are ruled out."""
+        conditions = [
+            getattr ( User, column ) == value
+            for column, value in (('email', email), ('username', username), ('number', number))
+            if availability.might_exist ( column, value )
+        ]
+        if not conditions:
+            return None
+        return User.query.filter ( or_ ( *conditions ) ).first ()
 
     def create_new_user(self, email, username, password, number):
         """Helper function to create and commit a new user to the database"""
-        hashed_password = generate_password_hash ( password )
+        hashed_password = password_hasher.hash ( password )
         new_user = User ( email=email, username=username, password=hashed_password, number=number )
         db.session.add ( new_user )
         db.session.commit ()
+        user_cache.invalidate ( new_user.id )
+        user_search.add_user ( new_user.id, username )
+        availability.add_user ( new_user.id, username, email, number )
 
 
 class Login ( Resource ):
@@ -92,7 +131,7 @@ class Login ( Resource ):
         # Validate form data
         if not self.is_valid_form_data ( data ):
             flash ( "Missing required fields", "danger" )
-            return redirect ( url_for ( "login" ) ), 400
+            return redirect ( url_for ( "login" ) )
 
         email = data["email"]
         password = data["password"]
@@ -101,13 +140,14 @@ class Login ( Resource ):
         user = self.get_user_by_email ( email )
         if not user:
             flash ( "User not found", "danger" )
-            return redirect ( url_for ( "login" ) ), 404
+            return redirect ( url_for ( "login" ) )
 
         if not self.verify_password ( user.password, password ):
             flash ( "Invalid credentials", "danger" )
-            return redirect ( url_for ( "login" ) ), 401
+            return redirect ( url_for ( "login" ) )
 
         # Successful login
+        self.upgrade_password_hash ( user, password )
         self.create_user_session ( user )
         flash ( "Login successful!", "success" )
         return redirect ( url_for ( "dashboard" ) )
@@ -128,12 +168,31 @@ class Login ( Resource ):
         """
         Verifies if the provided password matches the stored password.
         """
-        return check_password_hash ( stored_password, provided_password )
+        return password_hasher.verify ( stored_password, provided_password )
+
+    def upgrade_password_hash(self, user, password):
+        """
+        Re-hashes the password with the configured method and cost if the stored
+        hash was made with older parameters. A failure only postpones the
+        upgrade to the next login.
+        """
+        if not password_hasher.needs_rehash ( user.password ):
+            return
+        try:
+            user.password = password_hasher.hash ( password )
+            db.session.commit ()
+        except HashingBusy:
+            db.session.rollback ()
+        except Exception:
+            db.session.rollback ()
+            logging.exception ( "Upgrading the password hash of user %s failed", user.id )
 
     def create_user_session(self, user):
         """
         Sets the user session after successful login.
+        The session gets a new ID so an ID planted before login can not be reused.
         """
+        session_manager.rotate ( session )
         session['User_id'] = user.id
         # ForgotPassword  Resource
 
@@ -212,8 +271,10 @@ class ResetPassword ( Resource ):
         """
         user = self.get_user_by_email ( email )
         if user:
-            user.password = generate_password_hash ( new_password )
+            user.password = password_hasher.hash ( new_password )
             db.session.commit ()
+            user_cache.invalidate ( user.id )
+            session_manager.revoke_user ( user.id )  # Sign out sessions opened with the old password
             return True
         return False
 
@@ -226,9 +287,11 @@ class ResetPassword ( Resource ):
 
 class Dashboard ( Resource ):
     """
-    Displays the dashboard, including user posts, profiles, and user details.
+    Displays the dashboard: the user's home feed of their own and followed accounts' posts, and user details.
     """
 
+    method_decorators = {'get': [replica_reads]}  # Read-only: may be served by the read replica
+
     def get(self):
         """
         Retrieves and displays the dashboard, including posts, profiles, and the current user's information.
@@ -241,15 +304,15 @@ class Dashboard ( Resource ):
             return self.redirect_to_login ()
 
         # Fetch the necessary data for the dashboard
-        users = self.get_all_users ()
-        posts = self.get_recent_posts ()
-        profiles = self.get_all_profiles ()
+        before = parse_cursor ( request.args.get ( 'before' ) )
+        posts, next_cursor = self.get_recent_posts ( current_user_id, before )
         user = self.get_user_by_id ( current_user_id )
         profile = self.get_profile_by_user_id ( current_user_id )
-        comments = self.get_all_comments()
+        comments = self.get_comments_for_posts ( posts )
+        liked_post_ids = get_liked_post_ids ( current_user_id, [post.id for post in posts] )
 
         # Render the dashboard page
-        return self.render_dashboard ( posts, profile, profiles, current_user_id, user, users,comments )
+        return self.render_dashboard ( posts, profile, current_user_id, user, comments, next_cursor, liked_post_ids )
 
     def get_current_user_id(self):
         """
@@ -263,43 +326,34 @@ class Dashboard ( Resource ):
         """
         return redirect ( url_for ( 'login' ) )
 
-    def get_all_users(self):
+    def get_recent_posts(self, user_id, before=None):
         """
-        Fetches all users from the database.
+        Fetches one page of the user's home timeline, ordered by post ID in descending order.
+        Only posts older than the `before` cursor are returned, with their authors and
+        profile images already loaded.
         """
-        return User.query.all ()
+        return get_home_page ( user_id, before=before )
 
-    def get_recent_posts(self):
+    def get_comments_for_posts(self, posts):
         """
-        Fetches the most recent posts, ordered by post ID in descending order.
+        Fetches the latest comments for each post on the page in a single batched query.
         """
-        return Post.query.order_by ( Post.id.desc () ).all ()
-
-    def get_all_profiles(self,user_id=None):
-        """
-        Fetches all profiles from the database.
-        """
-        return Profile.query.filter_by(user_id=user_id).first()
-
-    def get_all_comments(self,post_id=None):
-        """
-        Fetches all comments from the database.
-        """
-        return  Comment.query.filter_by(post_id=post_id).all()
+        return get_latest_comments ( [post.id for post in posts] )
 
     def get_user_by_id(self, user_id):
         """
-        Fetches a user from the database by their ID.
+        Fetches a user record by their ID, from the user cache when possible.
         """
-        return User.query.get ( user_id )
+        return user_cache.get_user ( user_id )
 
     def get_profile_by_user_id(self,user_id=None):
         """
-        Fetches the profile associated with a specific user by user ID.
+        Fetches the profile associated with a specific user by user ID, from the user cache when possible.
         """
-        return Profile.query.filter_by (user_id=user_id).all ()
+        user = user_cache.get_user ( user_id )
+        return user.profiles if user is not None else []
 
-    def render_dashboard(self, posts, profile, profiles, current_user_id, user, users,comments):
+    def render_dashboard(self, posts, profile, current_user_id, user, comments, next_cursor=None, liked_post_ids=None):
         """
         Renders the dashboard page with the provided data.
         """
@@ -307,14 +361,56 @@ class Dashboard ( Resource ):
             'dashboard.html',
             posts=posts,
             profile=profile,
-            profiles=profiles,
             current_user_id=current_user_id,
             user=user,
-            users=users,
-            comments=comments
+            comments=comments,
+            comments_per_post=current_app.config.get ( 'COMMENTS_PER_POST', 3 ),
+            liked_post_ids=liked_post_ids or set (),
+            next_cursor=next_cursor
         ) )
 
 
+class FeedPage ( Resource ):
+    """
+    Serves the "load more" HTML fragment for the dashboard feed and the profile grid.
+    """
+
+    method_decorators = {'get': [replica_reads]}  # Read-only: may be served by the read replica
+
+    def get(self, User_id=None):
+        """
+        Renders the next page of posts older than the `before` cursor.
+
+        If `User_id` is provided, renders that user's profile grid tiles instead of feed posts.
+        The cursor for the following page is returned in the `X-Next-Cursor` header.
+        """
+        current_user_id = session.get ( 'User_id' )
+        if current_user_id is None:
+            return redirect ( url_for ( 'login' ) )
+
+        before = parse_cursor ( request.args.get ( 'before' ) )
+        if User_id is None:
+            posts, next_cursor = get_home_page ( current_user_id, before=before )
+        else:
+            posts, next_cursor = get_posts_page ( before=before, user_id=User_id )
+
+        if User_id is None:
+            post_ids = [post.id for post in posts]
+            comments = get_latest_comments ( post_ids )
+            liked_post_ids = get_liked_post_ids ( current_user_id, post_ids )
+            html = render_template ( '_feed_posts.html', posts=posts, comments=comments,
+                                     comments_per_post=current_app.config.get ( 'COMMENTS_PER_POST', 3 ),
+                                     liked_post_ids=liked_post_ids,
+                                     current_user_id=current_user_id )
+        else:
+            html = render_template ( '_profile_grid.html', posts=posts, current_user_id=User_id )
+
+        response = make_response ( html )
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = str ( next_cursor )
+        return response
+
+
 class Add_Post ( Resource ):
     """
     Handles the logic for adding, editing, and deleting posts.
@@ -342,14 +438,28 @@ class Add_Post ( Resource ):
         post = Post.query.get_or_404 ( post_id )
         return make_response ( render_template ( 'add_post.html', post=post ) )
 
-    def post(self):
+    def post(self, Post_id=None):
         """
         Handles form submission for adding or editing a post.
+        HTML forms cannot send DELETE, so a POST to the delete URL with
+        `_method=DELETE` is treated as a deletion.
         """
-        title = request.form.get ( 'title' )
-        content = request.form.get ( 'content' )
+        if Post_id is not None and request.form.get ( '_method' ) == 'DELETE':
+            return self.delete ( Post_id )
+
         user_id = session.get ( 'User_id' )
-        filtered_image_data = request.form.get ( 'filtered_image' )
+
+        # Parsing the form streams the image part to a temporary file and
+        # aborts as soon as it exceeds MAX_UPLOAD_SIZE
+        try:
+            title = request.form.get ( 'title' )
+            content = request.form.get ( 'content' )
+            image_file = request.files.get ( 'image' )
+            filtered_image_data = request.form.get ( 'filtered_image' )
+            filter_name = request.form.get ( 'filter' )
+        except RequestEntityTooLarge:
+            flash ( "Image is too large.", 'danger' )
+            return redirect ( url_for ( 'add_post' ) )
 
         # Ensure the user is logged in
         if not user_id:
@@ -357,7 +467,7 @@ class Add_Post ( Resource ):
             return redirect ( url_for ( 'add_post' ) )
 
         # Handle image processing
-        image_path = self.handle_image_upload ( filtered_image_data )
+        image_path = self.handle_image_upload ( filtered_image_data, image_file, filter_name )
 
         if not image_path:
             return redirect ( url_for ( 'add_post' ) )
@@ -365,56 +475,87 @@ class Add_Post ( Resource ):
         # Create and save the new post
         return self.create_post ( title, content, user_id, image_path )
 
-    # Assuming you're passing 'filtered_image_data' containing base64-encoded image data
-    def handle_image_upload(self, filtered_image_data):
-        app = current_app  # Access current app instance
-        logging.debug ( f"Flask Config: {app.config}" )  # Log the entire config dictionary
+    def handle_image_upload(self, filtered_image_data, image_file=None, filter_name=None):
+        """
+        Saves the post image to the content-addressed upload store and returns its path relative to `static`.
 
-        if filtered_image_data:
-            try:
+        Prefers the binary `image` file part, which has already been streamed to a
+        temporary file, and copies it in fixed-size chunks. Older clients that still
+        send a base64 data URL in `filtered_image` are decoded as before.
+
+        Current clients upload the original file and name the filter in `filter`;
+        the filter is then applied by the server-side filter engine.
+        """
+        if not image_file and not filtered_image_data:
+            flash ( "No image data provided.", 'danger' )
+            return None
+
+        image_path = None
+        try:
+            if image_file:
+                source = image_file.stream
+                file_extension = get_image_extension ( image_file )
+            else:
                 # Split the header and the base64-encoded image data
                 header, encoded = filtered_image_data.split ( ',', 1 )
+                source = None
 
                 # Extract the file extension from the MIME type (e.g., image/jpeg, image/png)
                 file_extension = header.split ( ';' )[0].split ( '/' )[1]
 
-                # Check for allowed image formats
-                if file_extension not in ['jpg', 'jpeg', 'png', 'gif']:
-                    flash ( "Unsupported image format. Please upload jpg, jpeg, png, or gif.", 'danger' )
-                    return None
-
-                # Generate a filename for the uploaded image
-                image_filename = f"{session.get ( 'User_id' )}_post_image_{int ( time.time () )}.{file_extension}"
-                image_path = os.path.join ( app.config['UPLOAD_FOLDER'], secure_filename ( image_filename ) )
-
-                # Ensure the upload directory exists
-                if not os.path.exists ( app.config['UPLOAD_FOLDER'] ):
-                    os.makedirs ( app.config['UPLOAD_FOLDER'] )  # Create the directory if it doesn't exist
-
-                # Decode the base64 image and save it to the disk
-                with open ( image_path, "wb" ) as f:
-                    f.write ( base64.b64decode ( encoded.strip () ) )  # Strip any unwanted whitespace
-
-                # Return the relative path to save in the DB
-                return 'uploads/' + image_filename
-            except Exception as e:
-                flash ( f"Image processing failed: {str ( e )}", 'danger' )
+            # Check for allowed image formats
+            if file_extension not in ALLOWED_IMAGE_EXTENSIONS:
+                flash ( "Unsupported image format. Please upload jpg, jpeg, png, or gif.", 'danger' )
                 return None
-        else:
-            flash ( "No image data provided.", 'danger' )
+
+            if source is None:
+                # Decode the base64 image (b64decode skips any whitespace)
+                source = io.BytesIO ( base64.b64decode ( encoded ) )
+
+            # Store the image under its content hash (chunked, enforcing MAX_UPLOAD_SIZE);
+            # identical images are only written to disk once
+            if filter_engine.needs_filtering ( filter_name ):
+                with filter_engine.filtered ( source, filter_name ) as (filtered, filtered_extension):
+                    image_path = storage.store_upload ( filtered, filtered_extension, kind='post' )
+            else:
+                image_path = storage.store_upload ( source, file_extension, kind='post' )
+
+            # Perceptual hash for near-duplicate detection, taken before the pipeline claims the file
+            self.image_dhash = image_index.hash_upload ( media_storage.staged_path ( image_path ) )
+
+            # Start generating the resized variants in the background, unless an
+            # earlier upload of the same image already has them
+            self.image_variants = storage.stored_variants ( image_path )
+            if self.image_variants is None:
+                self.variant_job = image_pipeline.submit ( image_path )
+
+            # Return the relative path to save in the DB
+            return image_path
+        except (UploadTooLarge, FilterUnavailable) as e:
+            flash ( str ( e ), 'danger' )
+            return None
+        except Exception as e:
+            if image_path is not None:
+                # Stored, but no post will reference it
+                db.session.rollback ()
+                image_pipeline.discard ( getattr ( self, 'variant_job', None ), image_path )
+            flash ( f"Image processing failed: {str ( e )}", 'danger' )
             return None
 
     def create_post(self, title, content, user_id, image_path):
         """
         Creates a new post in the database and commits it.
         """
+        image_dhash = getattr ( self, 'image_dhash', None )
         try:
             new_post = Post (
                 image_path=image_path,
                 title=title,
                 content=content,
                 user_id=user_id,
-                likes_count=0
+                likes_count=0,
+                image_variants=getattr ( self, 'image_variants', None ),
+                image_dhash=to_signed ( image_dhash ) if image_dhash is not None else None
             )
             db.session.add ( new_post )
 
@@ -424,20 +565,76 @@ class Add_Post ( Resource ):
                 user.post_count += 1
 
             db.session.commit ()
-            flash ( 'Post added successfully!', 'success' )
-            return redirect ( url_for ( 'dashboard' ) )
         except Exception as e:
             db.session.rollback ()
+            # The image's blob reference was rolled back with the post
+            image_pipeline.discard ( getattr ( self, 'variant_job', None ), image_path )
             flash ( f"An error occurred: {str ( e )}", 'danger' )
             return redirect ( url_for ( 'add_post' ) )
 
-    def delete(self, post_id):
+        self.finish_post ( new_post.id, user_id, image_dhash )
+        flash ( 'Post added successfully!', 'success' )
+        return redirect ( url_for ( 'dashboard' ) )
+
+    def finish_post(self, post_id, user_id, image_dhash):
         """
-        Handles the deletion of a post.
+        Runs the follow-up work for a committed post. The post exists whatever
+        happens here, so failures are logged rather than reported: an error
+        page would make the user post it again.
         """
-        post = Post.query.get_or_404 ( post_id )
+        try:
+            # A reused post ID must not pick up a cached tile of a deleted post
+            fragment_cache.invalidate_post ( post_id )
+            user_cache.invalidate ( user_id )  # post_count changed
+        except Exception:
+            logging.exception ( "Invalidating cached markup for new post %s failed", post_id )
+
+        try:
+            if image_dhash is not None:
+                if image_index.query ( image_dhash, exclude=post_id ):
+                    flash ( 'This image looks like one that has already been posted.', 'info' )
+                image_index.add ( post_id, image_dhash )
+        except Exception:
+            logging.exception ( "Indexing the image of post %s failed", post_id )
+
+        try:
+            # Record the variant paths on the post once they have been generated
+            image_pipeline.record_variants (
+                getattr ( self, 'variant_job', None ), Post, post_id,
+                on_stored=lambda: fragment_cache.invalidate_post ( post_id )
+            )
+        except Exception:
+            logging.exception ( "Scheduling the image variants of post %s failed", post_id )
 
         try:
+            # Into the author's timeline now, into their followers' in the background
+            timelines.post_created ( post_id, user_id )
+        except Exception:
+            db.session.rollback ()
+            logging.exception ( "Adding post %s to timelines failed", post_id )
+
+    def delete(self, Post_id):
+        """
+        Handles the deletion of a post by its author.
+        The post's comments, likes and timeline entries are deleted with it, and its image is
+        removed from storage once no other post or profile uses it.
+        """
+        # Check ownership before touching storage or the database
+        user_id = session.get ( 'User_id' )
+        if not user_id:
+            flash ( "Please log in to delete posts.", 'danger' )
+            return redirect ( url_for ( 'login' ) )
+
+        post = Post.query.get_or_404 ( Post_id )
+        if post.user_id != user_id:
+            return make_response ( "You can only delete your own posts.", 403 )
+        image_path = post.image_path
+
+        try:
+            # Rows referencing the post go first (comment.post_id is NOT NULL)
+            db.session.execute ( delete ( Comment ).where ( Comment.post_id == Post_id ) )
+            db.session.execute ( delete ( Like ).where ( Like.post_id == Post_id ) )
+            timelines.post_deleted ( Post_id, post.user_id )
             db.session.delete ( post )
 
             # Update the user's post count
@@ -445,7 +642,14 @@ class Add_Post ( Resource ):
             if user:
                 user.post_count -= 1
 
+            # Drop this post's reference to the stored image
+            storage.release ( image_path )
+
             db.session.commit ()
+            fragment_cache.invalidate_post ( Post_id )
+            user_cache.invalidate ( post.user_id )  # post_count changed
+            image_index.remove ( Post_id )
+            storage.collect_garbage ( image_path )
             flash ( 'Post deleted successfully!', 'success' )
             return redirect ( url_for ( 'dashboard' ) )
         except Exception as e:
@@ -479,8 +683,12 @@ class UpdateProfile ( Resource ):
         Renders the form for editing an existing profile.
         """
         profile = Profile.query.get_or_404 ( profile_id )
-        users = User.query.all ()
-        return make_response ( render_template ( 'update_profile.html', profile=profile, users=users ) )
+        # The template only shows the current user, so there is no need to load every user
+        current_user_id = session.get ( 'User_id' )
+        current_user = user_cache.get_user ( current_user_id )
+        users = [current_user] if current_user is not None else []
+        return make_response ( render_template ( 'update_profile.html', profile=profile, users=users,
+                                                 current_user_id=current_user_id ) )
 
     def post(self):
         """
@@ -488,7 +696,6 @@ class UpdateProfile ( Resource ):
         including bio, nickname, and image upload.
         """
         user_id = session.get ( 'User_id' )
-        print ( f"User ID from session: {user_id}" )  # Debugging step
 
         # Ensure the user is logged in
         if not user_id:
@@ -516,6 +723,7 @@ class UpdateProfile ( Resource ):
         new_profile = Profile ( user_id=user_id, bio='', nickname='', image_path='' )
         db.session.add ( new_profile )
         db.session.commit ()  # Commit to generate an ID for the profile
+        user_cache.invalidate ( user_id )
         return new_profile
 
     def update_profile(self, profile, user):
@@ -529,10 +737,18 @@ class UpdateProfile ( Resource ):
 
             # Handle image upload
             image_path = self.handle_image_upload ( image, profile )
+            old_image_path = profile.image_path
 
             # Update Profile fields
             profile.nickname = nickname
             profile.bio = bio
+            if image:
+                # The upload took a reference, so drop the old image's, even
+                # when the same image was uploaded again
+                storage.release ( old_image_path )
+            if image_path != old_image_path:
+                # Variants reused from the blob, or None to serve the new original until they are ready
+                profile.image_variants = getattr ( self, 'image_variants', None )
             profile.image_path = image_path  # Update image path
 
             # Update the username in the profile (optional if needed)
@@ -540,23 +756,60 @@ class UpdateProfile ( Resource ):
 
             # Commit changes to the database
             db.session.commit ()
+            if image_path != old_image_path:
+                storage.collect_garbage ( old_image_path )
+
+            # The avatar is shown on every cached post and comment of this user
+            user_id = user.id
+            fragment_cache.invalidate_user ( user_id )
+            user_cache.invalidate ( user_id )
+            user_search.update_nickname ( user_id, user.username, nickname )
+
+            # Record the variant paths on the profile once they have been generated
+            image_pipeline.record_variants (
+                getattr ( self, 'variant_job', None ), Profile, profile.id,
+                on_stored=lambda: self.invalidate_cached_user ( user_id )
+            )
+
             flash ( 'Profile updated successfully!', 'success' )
             return redirect ( url_for ( 'dashboard' ) )
 
         except Exception as e:
             db.session.rollback ()
+            # A new avatar's blob reference was rolled back with the profile
+            uploaded_image_path = getattr ( self, 'uploaded_image_path', None )
+            if uploaded_image_path:
+                image_pipeline.discard ( getattr ( self, 'variant_job', None ), uploaded_image_path )
             flash ( f"An error occurred: {e}", 'danger' )
             return redirect ( url_for ( 'updateprofile' ) )
 
+    def invalidate_cached_user(self, user_id):
+        """
+        Drops cached copies of the user's record and of the markup showing their avatar.
+        """
+        fragment_cache.invalidate_user ( user_id )
+        user_cache.invalidate ( user_id )
+
     def handle_image_upload(self, image, profile):
         """
         Handles the image upload logic and returns the path of the uploaded image.
         If no image is uploaded, it retains the existing image path.
         """
         if image:
-            image_path = os.path.join ( app.config['UPLOAD_FOLDER'], image.filename )
-            image.save ( image_path )
-            return 'uploads/' + image.filename
+            file_extension = get_image_extension ( image )
+            if file_extension not in ALLOWED_IMAGE_EXTENSIONS:
+                raise ValueError ( "Unsupported image format. Please upload jpg, jpeg, png, or gif." )
+
+            # Store the image under its content hash rather than the client-supplied filename
+            image_path = storage.store_upload ( image.stream, file_extension, kind='profile' )
+            self.uploaded_image_path = image_path
+
+            # Start generating the resized variants in the background, unless an
+            # earlier upload of the same image already has them
+            self.image_variants = storage.stored_variants ( image_path )
+            if self.image_variants is None:
+                self.variant_job = image_pipeline.submit ( image_path )
+            return image_path
         else:
             return profile.image_path  # Keep the existing image path if no new image is uploaded
 class profile ( Resource ):
@@ -564,6 +817,8 @@ class profile ( Resource ):
     Handles the logic for displaying a user's profile page.
     """
 
+    method_decorators = {'get': [replica_reads]}  # Read-only: may be served by the read replica
+
     def get(self, User_id=None):
         """
         Renders the profile page for the current user or a specified user.
@@ -577,10 +832,17 @@ class profile ( Resource ):
             return redirect ( url_for ( 'login' ) )
 
         # Fetch the necessary data
-        user, profile, posts, profiles = self.fetch_user_data ( current_user_id )
+        before = parse_cursor ( request.args.get ( 'before' ) )
+        user, profile, posts, profiles, next_cursor = self.fetch_user_data ( current_user_id, before )
+
+        # Whether the visitor follows this user, for the Follow / Unfollow button
+        viewer_id = session.get ( 'User_id' )
+        following = viewer_id is not None and viewer_id != current_user_id \
+            and follows.is_following ( viewer_id, current_user_id )
 
         # Render the profile page
-        return self.render_profile_page ( user, profile, posts, profiles, current_user_id )
+        return self.render_profile_page ( user, profile, posts, profiles, current_user_id, next_cursor,
+                                          viewer_id=viewer_id, following=following )
 
     def get_user_id(self, User_id):
         """
@@ -591,29 +853,31 @@ class profile ( Resource ):
             return session.get ( 'User_id' )  # Get user ID from session if available
         return User_id  # Use provided User_id if available
 
-    def fetch_user_data(self, current_user_id):
+    def fetch_user_data(self, current_user_id, before=None):
         """
         Fetches the necessary data for the user, profile, posts, and profiles.
 
         Returns:
-            - user: The User object for the given user ID.
-            - profile: The Profile object for the given user ID.
-            - posts: List of posts ordered by the most recent first.
-            - profiles: List of all profiles (can be modified based on requirements).
+            - user: The cached user record for the given user ID.
+            - profile: The user's profile records.
+            - posts: One page of the user's posts ordered by the most recent first.
+            - profiles: The profiles shown on the page (the user's own; no template lists every profile).
+            - next_cursor: The `before` cursor for the next page of posts, or None.
         """
-        user = User.query.get ( current_user_id )
+        user = user_cache.get_user ( current_user_id )
         if not user:
             flash ( "User not found.", 'danger' )
             return redirect ( url_for ( 'login' ) )
 
         # Fetch user profile, posts, and other related data
-        profile = Profile.query.filter_by ( user_id=current_user_id ).all ()
-        posts = Post.query.order_by ( Post.id.desc () ).all ()
-        profiles = Profile.query.all ()
+        profile = user.profiles
+        posts, next_cursor = get_posts_page ( before=before, user_id=current_user_id )
+        profiles = profile  # Loading every profile here was a full table scan on each profile view
 
-        return user, profile, posts, profiles
+        return user, profile, posts, profiles, next_cursor
 
-    def render_profile_page(self, user, profile, posts, profiles, current_user_id):
+    def render_profile_page(self, user, profile, posts, profiles, current_user_id, next_cursor=None,
+                            viewer_id=None, following=False):
         """
         Renders the profile page using the fetched data.
 
@@ -623,17 +887,23 @@ class profile ( Resource ):
             posts: List of posts by the user.
             profiles: List of all profiles (optional, could be used for other functionality).
             current_user_id: The current user's ID.
+            next_cursor: The `before` cursor for the next page of posts, or None.
+            viewer_id: The logged-in visitor's user ID.
+            following: Whether the visitor follows this user.
 
         Returns:
             A rendered template with the provided data.
         """
         return make_response ( render_template (
-            'Profile.html',
+            'profile.html',
             posts=posts,
             profile=profile,
             current_user_id=current_user_id,
             user=user,
-            profiles=profiles
+            profiles=profiles,
+            next_cursor=next_cursor,
+            viewer_id=viewer_id,
+            following=following
         ) )
 
 
@@ -663,13 +933,26 @@ class LikePost ( Resource ):
         if not post:
             return self.create_error_response ( "Post not found", 404 )
 
-        success, message = self.toggle_like ( user_id, post )
-        if not success:
-            return self.create_error_response ( message, 400 )
+        # Like state and counts are rendered outside the cached feed tile, so
+        # liking never has to invalidate it
+        if like_buffer.enabled:
+            return self.buffer_like ( user_id, post )
 
-        db.session.commit ()  # Commit the changes to the database
+        try:
+            success, message = self.toggle_like ( user_id, post )
+            if not success:
+                db.session.rollback ()
+                return self.create_error_response ( message, 400 )
+
+            new_like_count = likes.get_like_count ( post.id )
+            db.session.commit ()  # Commit the changes to the database
+            metrics.like_toggles.inc ( 'like' if message == "Post liked" else 'unlike', 'direct' )
+        except Exception as e:
+            db.session.rollback ()
+            logging.exception ( "Like toggle failed for post %s", post_id )
+            return self.create_error_response ( f"An error occurred: {str ( e )}", 500 )
 
-        return jsonify ( {"success": True, "new_like_count": post.likes_count} )
+        return jsonify ( {"success": True, "liked": message == "Post liked", "new_like_count": new_like_count} )
 
     def get_user_id(self):
         """
@@ -697,7 +980,9 @@ class LikePost ( Resource ):
         Toggles the like status for the given post.
 
         If the user has already liked the post, it unlikes it.
-        Otherwise, it likes the post.
+        Otherwise, it likes the post. The like row is inserted or deleted and
+        `likes_count` is adjusted in SQL within the same transaction, so
+        concurrent clicks can neither duplicate likes nor drift the counter.
 
         Args:
             user_id (int): The ID of the user.
@@ -706,22 +991,25 @@ class LikePost ( Resource ):
         Returns:
             (bool, str): Success status and a message if applicable.
         """
-        # Check if the user has already liked the post
-        like = Like.query.filter_by ( user_id=user_id, post_id=post.id ).first ()
-
-        if like:
-            # User has already liked the post, so "unlike" it
-            db.session.delete ( like )
-            # Ensure likes_count does not go below 0
-            if post.likes_count > 0:
-                post.likes_count -= 1  # Decrease like count
-            return True, "Post unliked"
-        else:
-            # User hasn't liked the post, so "like" it
-            new_like = Like ( user_id=user_id, post_id=post.id )
-            db.session.add ( new_like )
-            post.likes_count += 1  # Increase like count
+        if likes.toggle_like ( user_id, post.id ):
             return True, "Post liked"
+        return True, "Post unliked"
+
+    def buffer_like(self, user_id, post):
+        """
+        Records the like / unlike in the write-behind buffer instead of the database.
+
+        Args:
+            user_id (int): The ID of the user.
+            post (Post): The post object to like/unlike.
+
+        Returns:
+            JSON response with the new like state and the optimistic like count.
+        """
+        liked = like_buffer.toggle ( user_id, post.id )
+        new_like_count = like_buffer.merge_count ( post.id, post.likes_count )
+        metrics.like_toggles.inc ( 'like' if liked else 'unlike', 'buffered' )
+        return jsonify ( {"success": True, "liked": liked, "new_like_count": new_like_count} )
 
     def create_error_response(self, message, status_code):
         """
@@ -734,7 +1022,55 @@ class LikePost ( Resource ):
         Returns:
             JSON response with error message and status code.
         """
-        return jsonify ( {"success": False, "message": message} ), status_code
+        return make_response ( jsonify ( {"success": False, "message": message} ), status_code )
+
+
+class LikeState ( Resource ):
+    """
+    Returns the current user's like state for a batch of posts.
+    """
+
+    # Upper bound on the number of post IDs accepted in one request
+    MAX_POST_IDS = 200
+
+    def post(self):
+        """
+        Looks up which of the given posts the current user has liked.
+
+        Expects a JSON body of the form `{"post_ids": [1, 2, 3]}`.
+
+        Returns:
+            JSON response with the liked post IDs and the like count of each post.
+        """
+        user_id = session.get ( 'User_id' )
+        if not user_id:
+            return make_response ( jsonify ( {"success": False, "message": "User not logged in"} ), 403 )
+
+        post_ids = self.parse_post_ids ( request.get_json ( silent=True ) )
+        if post_ids is None:
+            return make_response ( jsonify ( {"success": False, "message": "post_ids must be a list of post IDs"} ), 400 )
+        if len ( post_ids ) > self.MAX_POST_IDS:
+            return make_response ( jsonify ( {"success": False, "message": f"At most {self.MAX_POST_IDS} post IDs are allowed"} ), 400 )
+
+        liked = get_liked_post_ids ( user_id, post_ids )
+        counts = {
+            str ( post_id ): like_buffer.merge_count ( post_id, likes_count )
+            for post_id, likes_count in db.session.query ( Post.id, Post.likes_count ).filter ( Post.id.in_ ( post_ids ) )
+        } if post_ids else {}
+
+        return jsonify ( {"success": True, "liked": sorted ( liked ), "counts": counts} )
+
+    def parse_post_ids(self, data):
+        """
+        Extracts a de-duplicated list of integer post IDs from the request body.
+        Returns None if the body is malformed.
+        """
+        if not isinstance ( data, dict ) or not isinstance ( data.get ( 'post_ids' ), list ):
+            return None
+        try:
+            return list ( dict.fromkeys ( int ( post_id ) for post_id in data['post_ids'] ) )
+        except (TypeError, ValueError):
+            return None
 
 
 class Logout ( Resource ):
@@ -757,6 +1093,7 @@ class Logout ( Resource ):
         """
         # Remove the user ID from the session to log out the user
         session.pop ( 'User_id', None )
+        session_manager.rotate ( session )
 
         # Flash a success message
         flash ( 'You have been logged out.', 'success' )
@@ -765,15 +1102,78 @@ class Logout ( Resource ):
         return redirect ( url_for ( 'login' ) )
 
 
-class CommentBox(Resource):
+class LogoutAll ( Resource ):
+    """
+    Logs the current user out of every device by revoking all of their sessions.
+    """
+
     def post(self):
+        """
+        Deletes every stored session of the current user, including this one,
+        and redirects to the login page.
+        """
+        user_id = session.get ( 'User_id' )
+        if user_id is None:
+            return redirect ( url_for ( 'login' ) )
+
+        removed = session_manager.revoke_user ( user_id )
+        session.clear ()
+        session_manager.rotate ( session )
+
+        flash ( f'You have been logged out of {removed} session(s).' if removed else 'You have been logged out.', 'success' )
+        return redirect ( url_for ( 'login' ) )
+
+
+class CommentBox(Resource):
+    """
+    Handles adding comments to a post and listing a post's older comments.
+    """
+
+    method_decorators = {'get': [replica_reads]}  # Listing comments may be served by the read replica
+
+    def get(self, post_id=None):
+        """
+        Returns one page of a post's comments as JSON, newest first.
+        Only comments older than the `before` cursor are returned.
+        """
+        if post_id is None:
+            return make_response ( jsonify ( {"success": False, "message": "Post ID is required"} ), 400 )
+
+        before = parse_cursor ( request.args.get ( 'before' ) )
+        comments, next_cursor = get_comments_page ( post_id, before=before )
+
+        return jsonify ( {
+            "success": True,
+            "comments": [self.serialize_comment ( comment ) for comment in comments],
+            "next_cursor": next_cursor
+        } )
+
+    def serialize_comment(self, comment):
+        """
+        Converts a comment into a JSON-serializable dictionary.
+        """
+        profile = comment.user.profile
+        return {
+            "id": comment.id,
+            "text": comment.text,
+            "timestamp": comment.timestamp.strftime ( '%Y-%m-%d %H:%M:%S' ),
+            "user_id": comment.user_id,
+            "username": comment.user.username,
+            "avatar_url": image_src ( profile, 'thumb' ) if profile and profile.image_path else None
+        }
+
+    def post(self, post_id=None):
         # Get the data from the form
-        user_id = request.form.get('user_id')
+        user_id = session.get('User_id')
         post_id = request.form.get('post_id')
         comment_text = request.form.get('comment_text')
 
+        if not user_id:
+            flash ( "Please log in to comment.", 'warning' )
+            return redirect ( url_for ( 'login' ) )
+
         if not comment_text:
-            return redirect(url_for('dashboard', post_id=post_id))  # Redirect back if comment is empty
+            return redirect(url_for('dashboard'))  # Redirect back if comment is empty
 
         # Create a new comment instance
         new_comment = Comment(user_id=user_id, post_id=post_id, text=comment_text)
@@ -781,7 +1181,149 @@ class CommentBox(Resource):
         # Add the comment to the database
         db.session.add(new_comment)
         db.session.commit()
-        comments = Comment.query.filter_by ().all ()
+        fragment_cache.invalidate_post ( post_id )
 
-        # Redirect back to the post page (this will display the newly added comment)
-        return redirect(url_for('dashboard', post_id=post_id,comments=comments))
\ No newline at end of file
+        # Redirect back to the dashboard (this will display the newly added comment)
+        return redirect(url_for('dashboard'))
+
+
+class Metrics ( Resource ):
+    """
+    Serves the app's metrics in the Prometheus text format for scraping.
+    """
+
+    def get(self):
+        """
+        Renders every metric, combined across worker processes when
+        METRICS_MULTIPROC_DIR is set. Answers 404 when METRICS_ENABLED is off.
+        """
+        if not current_app.config.get ( 'METRICS_ENABLED', True ):
+            return make_response ( jsonify ( {"success": False, "message": "Not found"} ), 404 )
+
+        response = make_response ( metrics.registry.render () )
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+
+class Search ( Resource ):
+    """
+    Finds users by username or nickname, for the nav "Search" page and its typeahead.
+    """
+
+    # Results returned per query
+    MAX_RESULTS = 20
+
+    def get(self):
+        """
+        Renders the search page for `q`, or returns the matches as JSON when
+        `format=json` is given (used by the typeahead).
+        Served from the in-memory search index; no query reaches the database.
+        """
+        if not session.get ( 'User_id' ):
+            flash ( "Please log in to search.", 'warning' )
+            return redirect ( url_for ( 'login' ) )
+
+        query = request.args.get ( 'q', '' ).strip ()[:100]
+        try:
+            limit = max ( 1, min ( int ( request.args.get ( 'limit', 10 ) ), self.MAX_RESULTS ) )
+        except ValueError:
+            limit = 10
+        results = [
+            {"id": user_id, "username": username, "nickname": nickname, "post_count": post_count}
+            for user_id, username, nickname, post_count in user_search.search ( query, limit )
+        ]
+
+        if request.args.get ( 'format' ) == 'json':
+            return jsonify ( {"success": True, "query": query, "results": results} )
+        return make_response ( render_template ( 'search.html', query=query, results=results ) )
+
+
+class Availability ( Resource ):
+    """
+    Tells the sign-up form whether a username, email or phone number is still free.
+    """
+
+    method_decorators = {'get': [replica_reads]}  # Read-only: may be served by the read replica
+
+    def get(self):
+        """
+        Checks each of `username`, `email` and `number` given in the query string.
+        Values the availability filters rule out are answered without a query.
+        """
+        values = {column: request.args.get ( column ) for column in ('username', 'email', 'number')}
+        values = {column: value.strip () for column, value in values.items () if value and value.strip ()}
+        if not values:
+            return make_response ( jsonify ( {"success": False, "message": "Nothing to check"} ), 400 )
+
+        return jsonify ( {
+            "success": True,
+            "available": {column: not availability.is_taken ( column, value ) for column, value in values.items ()},
+        } )
+
+
+class FollowUser ( Resource ):
+    """
+    Follows another user. Answers JSON requests with JSON, form posts with a redirect to the profile.
+    """
+
+    def post(self, user_id):
+        """
+        Follows the user and copies their latest posts into the current user's home timeline.
+        """
+        return self.change_follow ( user_id, True )
+
+    def change_follow(self, user_id, follow):
+        """
+        Follows (`follow` True) or unfollows the user and updates the home timeline in the same transaction.
+        """
+        current_user_id = session.get ( 'User_id' )
+        if not current_user_id:
+            return self.create_error_response ( "User not logged in", 401, user_id )
+        if user_id == current_user_id:
+            return self.create_error_response ( "You cannot follow yourself.", 400, user_id )
+        if user_cache.get_user ( user_id ) is None:
+            return self.create_error_response ( "User not found", 404, user_id )
+
+        try:
+            if follow and follows.follow ( current_user_id, user_id ):
+                timelines.follow ( current_user_id, user_id )
+            elif not follow and follows.unfollow ( current_user_id, user_id ):
+                timelines.unfollow ( current_user_id, user_id )
+            db.session.commit ()
+        except Exception:
+            db.session.rollback ()
+            logging.exception ( "Changing follow %s -> %s failed", current_user_id, user_id )
+            return self.create_error_response ( "Could not update the follow, please try again.", 500, user_id )
+
+        # follower_count / following_count changed
+        user_cache.invalidate ( current_user_id )
+        user_cache.invalidate ( user_id )
+
+        if request.is_json:
+            return jsonify ( {
+                "success": True,
+                "following": follow,
+                "follower_count": user_cache.get_user ( user_id ).follower_count,
+            } )
+        return redirect ( url_for ( 'profile', User_id=user_id ) )
+
+    def create_error_response(self, message, status_code, user_id):
+        if request.is_json:
+            return make_response ( jsonify ( {"success": False, "message": message} ), status_code )
+        flash ( message, 'danger' )
+        if status_code == 401:
+            return redirect ( url_for ( 'login' ) )
+        return redirect ( url_for ( 'profile', User_id=user_id ) )
+
+
+class UnfollowUser ( FollowUser ):
+    """
+    Unfollows a user. Answers like FollowUser.
+    """
+
+    def post(self, user_id):
+        """
+        Unfollows the user and removes their posts from the current user's home timeline.
+        """
+        return self.change_follow ( user_id, False )
@@ -0,0 +1,358 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from array import array
+
+from sqlalchemy import select
+
+from model import db, User, Profile
+
+# Prefix ranges with more terms than this are not scanned per query; their
+# best matches are precomputed instead
+SCAN_LIMIT = 1000
+# Matches precomputed per large prefix range
+TOP_MATCHES = 50
+# Sorts after every character, to bound a prefix range
+LAST_CHARACTER = '\U0010ffff'
+
+
+def normalize(text):
+    return ' '.join ( (text or '').lower ().split () )
+
+
+def name_terms(username, nickname):
+    """
+    Returns the terms a user is found by: the username, the nickname and each
+    word of the nickname (all normalized).
+    """
+    terms = {username}
+    if nickname:
+        terms.add ( nickname )
+        terms.update ( nickname.split () )
+    terms.discard ( '' )
+    return terms
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range ( len ( text ) - 2 )}
+
+
+class SearchData:
+    """
+    One generation of the search index, replaced as a whole on rebuild.
+    Between rebuilds it only grows (new users, new nicknames).
+    """
+
+    def __init__(self):
+        # user_id -> [username, nickname, post_count]
+        self.users = {}
+        # user_id -> "\nusername\nnickname", normalized, for checking candidates
+        self.texts = {}
+        # Sorted terms and the user each belongs to, for prefix range scans
+        self.terms = []
+        self.term_ids = array ( 'q' )
+        # prefix -> best TOP_MATCHES user IDs, for prefixes of more than SCAN_LIMIT terms
+        self.top = {}
+        # trigram -> IDs of the users whose names contain it, most posts first
+        self.postings = {}
+        self.max_user_id = 0
+
+    @classmethod
+    def build(cls, rows):
+        """
+        Builds an index from (user_id, username, nickname, post_count) rows.
+        """
+        data = cls ()
+        pairs = []
+        for user_id, username, nickname, post_count in sorted ( rows, key=lambda row: (-(row[3] or 0), row[0]) ):
+            username, nickname = data._set_user ( user_id, username, nickname, post_count or 0 )
+            for term in name_terms ( username, nickname ):
+                pairs.append ( (term, user_id) )
+            data._index_trigrams ( user_id, username, nickname )
+
+        pairs.sort ()
+        data.terms = [term for term, _ in pairs]
+        data.term_ids = array ( 'q', (user_id for _, user_id in pairs) )
+        del pairs
+        data._index_prefix ( '', 0, len ( data.terms ) )
+        return data
+
+    def add(self, user_id, username, nickname, post_count):
+        """
+        Adds a user, or adds the terms of their new nickname. Terms of an old
+        nickname are left in place and filtered out at query time.
+        """
+        entry = self.users.get ( user_id )
+        old_terms = name_terms ( normalize ( entry[0] ), normalize ( entry[1] ) ) if entry else set ()
+        username, nickname = self._set_user ( user_id, username, nickname,
+                                              post_count if post_count is not None else (entry[2] if entry else 0) )
+
+        for term in name_terms ( username, nickname ) - old_terms:
+            position = bisect.bisect_left ( self.terms, term )
+            self.terms.insert ( position, term )
+            self.term_ids.insert ( position, user_id )
+            for length in range ( 1, len ( term ) + 1 ):
+                top = self.top.get ( term[:length] )
+                if top is not None and user_id not in top:
+                    top.append ( user_id )
+                    top.sort ( key=lambda other: -self.users[other][2] )
+                    del top[TOP_MATCHES:]
+        self._index_trigrams ( user_id, username, nickname )
+
+    def search(self, query, limit):
+        """
+        Returns up to `limit` user IDs: names starting with `query` first,
+        then names containing it, each group ranked by post count.
+        """
+        results = []
+        candidates = self.top.get ( query )
+        if candidates is None:
+            candidates = self._best ( self._range_ids ( query ), limit * 2 )
+        # Candidates may come from a stale term (an old nickname), so each is checked
+        prefixes = ('\n' + query, ' ' + query)
+        for user_id in candidates:
+            text = self.texts[user_id]
+            if prefixes[0] in text or prefixes[1] in text:
+                results.append ( user_id )
+                if len ( results ) == limit:
+                    return results
+
+        if len ( query ) >= 3:
+            # Infix matches: only the users behind the query's rarest trigram can
+            # contain it, and that posting is already ordered by post count
+            rarest = min ( (self.postings.get ( trigram, () ) for trigram in trigrams ( query )), key=len )
+            seen = set ( results )
+            contained = []
+            for user_id in rarest:
+                if user_id not in seen and query in self.texts[user_id]:
+                    seen.add ( user_id )
+                    contained.append ( user_id )
+                    if len ( results ) + len ( contained ) == limit:
+                        break
+            contained.sort ( key=lambda user_id: -self.users[user_id][2] )
+            results.extend ( contained )
+        return results
+
+    def _set_user(self, user_id, username, nickname, post_count):
+        """
+        Stores a user's names and returns them normalized.
+        """
+        self.users[user_id] = [username, nickname, post_count]
+        username, nickname = normalize ( username ), normalize ( nickname )
+        self.texts[user_id] = '\n' + username + '\n' + nickname
+        if user_id > self.max_user_id:
+            self.max_user_id = user_id
+        return username, nickname
+
+    def _range_ids(self, prefix):
+        low = bisect.bisect_left ( self.terms, prefix )
+        high = bisect.bisect_left ( self.terms, prefix + LAST_CHARACTER, low )
+        return dict.fromkeys ( self.term_ids[low:high] )
+
+    def _index_prefix(self, prefix, low, high):
+        """
+        Returns the best users among the terms[low:high] starting with `prefix`,
+        and stores them in `top` when the range is too large to scan per query.
+        Child ranges are solved first, so each term is ranked about once.
+        """
+        if high - low <= SCAN_LIMIT:
+            return self._best ( dict.fromkeys ( self.term_ids[low:high] ), TOP_MATCHES )
+
+        depth = len ( prefix )
+        candidates = []
+        start = low
+        # Terms equal to the prefix sort before its longer terms
+        while start < high and len ( self.terms[start] ) == depth:
+            candidates.append ( self.term_ids[start] )
+            start += 1
+        while start < high:
+            child = self.terms[start][:depth + 1]
+            end = bisect.bisect_left ( self.terms, child + LAST_CHARACTER, start, high )
+            candidates.extend ( self._index_prefix ( child, start, end ) )
+            start = end
+
+        best = self._best ( dict.fromkeys ( candidates ), TOP_MATCHES )
+        if prefix:
+            self.top[prefix] = best
+        return best
+
+    def _best(self, user_ids, limit):
+        return heapq.nlargest ( limit, user_ids, key=lambda user_id: (self.users[user_id][2], -user_id) )
+
+    def _index_trigrams(self, user_id, username, nickname):
+        postings = self.postings
+        for trigram in trigrams ( username ) | trigrams ( nickname ):
+            posting = postings.get ( trigram )
+            if posting is None:
+                postings[trigram] = array ( 'q', (user_id,) )
+            elif posting[-1] != user_id:
+                posting.append ( user_id )
+
+
+class UserSearchIndex:
+    """
+    In-memory search over `User.username` and `Profile.nickname` for /search.
+
+    Names are found by prefix (a binary search in a sorted term list, with
+    the best matches of prefixes shared by many names precomputed) and by
+    substring (candidates from the query's rarest trigram, then checked), and
+    ranked by post count. No query touches the database.
+
+    The index is built in a background thread at startup from a streaming
+    scan of `user` joined to `profile`, and updated in place when this
+    process registers a user or changes a nickname. Users registered by
+    other worker processes are picked up every SEARCH_REFRESH_INTERVAL
+    seconds with a primary-key range scan, and the whole index is rebuilt in
+    the background every SEARCH_REBUILD_INTERVAL seconds to refresh post
+    counts and other workers' nickname changes.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.refresh_interval = 30
+        self.rebuild_interval = 3600
+        self._data = None
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._rebuilding = False
+        self._replay = []
+        self._lock = threading.RLock ()
+        self._build_lock = threading.Lock ()
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get ( 'SEARCH_ENABLED', True )
+        self.refresh_interval = app.config.get ( 'SEARCH_REFRESH_INTERVAL', 30 )
+        self.rebuild_interval = app.config.get ( 'SEARCH_REBUILD_INTERVAL', 3600 )
+        app.extensions['user_search'] = self
+
+        if self.enabled and app.config.get ( 'SEARCH_BUILD_ON_STARTUP', True ):
+            threading.Thread ( target=self.rebuild, name='user-search-build', daemon=True ).start ()
+
+    def search(self, query, limit=10):
+        """
+        Returns up to `limit` (user_id, username, nickname, post_count) matches for `query`.
+        """
+        query = normalize ( query )
+        if not query or not self.enabled:
+            return []
+        data = self._current ()
+        with self._lock:
+            return [(user_id, *data.users[user_id]) for user_id in data.search ( query, limit )]
+
+    def add_user(self, user_id, username, nickname=None, post_count=0):
+        """
+        Indexes a newly registered user.
+        """
+        self._apply ( user_id, username, nickname, post_count )
+
+    def update_nickname(self, user_id, username, nickname):
+        """
+        Indexes a user's new nickname.
+        """
+        self._apply ( user_id, username, nickname, None )
+
+    def rebuild(self):
+        """
+        Builds a fresh index from the database and swaps it in. Searches keep
+        using the previous one meanwhile; updates made during the build are replayed on the new one.
+        """
+        if not self._build_lock.acquire ( blocking=False ):
+            return
+        try:
+            with self._lock:
+                self._rebuilding = True
+                self._replay = []
+            started = time.monotonic ()
+            with self.app.app_context ():
+                try:
+                    data = SearchData.build ( self._scan () )
+                finally:
+                    db.session.remove ()
+            with self._lock:
+                for update in self._replay:
+                    data.add ( *update )
+                self._data = data
+                self._built_at = self._refreshed_at = time.monotonic ()
+            logging.info ( "User search index built: %d users in %.1f s", len ( data.users ), time.monotonic () - started )
+        except Exception:
+            logging.exception ( "Building the user search index failed" )
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._replay = []
+            self._build_lock.release ()
+
+    def _current(self):
+        """
+        Returns the current index, building it on first use and refreshing it when due.
+        """
+        if self._data is None:
+            if self._build_lock.locked ():
+                self._wait_for_build ()  # The startup build is still running
+            else:
+                self.rebuild ()
+        data = self._data or SearchData ()
+
+        now = time.monotonic ()
+        if self._data is not None and now - self._built_at >= self.rebuild_interval and not self._build_lock.locked ():
+            threading.Thread ( target=self.rebuild, name='user-search-rebuild', daemon=True ).start ()
+        elif self._data is not None and now - self._refreshed_at >= self.refresh_interval:
+            self._refresh ( data )
+        return data
+
+    def _wait_for_build(self):
+        with self._build_lock:
+            pass
+
+    def _refresh(self, data):
+        """
+        Adds users registered by other processes since the last refresh.
+        """
+        with self._lock:
+            self._refreshed_at = time.monotonic ()
+            after = data.max_user_id
+        with self.app.app_context ():
+            try:
+                rows = list ( self._scan ( after=after ) )
+            finally:
+                db.session.remove ()
+        with self._lock:
+            for row in rows:
+                data.add ( *row )
+
+    def _apply(self, user_id, username, nickname, post_count):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._rebuilding:
+                self._replay.append ( (user_id, username, nickname, post_count) )
+            if self._data is not None:
+                self._data.add ( user_id, username, nickname, post_count )
+
+    def _scan(self, after=0, batch_size=10000):
+        """
+        Streams (user_id, username, nickname, post_count) for users with an ID above `after`.
+        """
+        statement = (
+            select ( User.id, User.username, Profile.nickname, User.post_count )
+            .outerjoin ( Profile, Profile.user_id == User.id )
+            .where ( User.id > after )
+            .order_by ( User.id )
+            .execution_options ( yield_per=batch_size )
+        )
+        seen = None
+        for row in db.session.execute ( statement ):
+            # A user with several profiles is indexed by the first one
+            if row[0] != seen:
+                seen = row[0]
+                yield tuple ( row )
+
+
+user_search = UserSearchIndex ()
@@ -0,0 +1,428 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import delete, insert, select, update
+from werkzeug.datastructures import CallbackDict
+
+from cache import MemoryCache
+from model import db, UserSession
+
+try:
+    import redis
+except ImportError:  # redis is only needed for the redis session backend
+    redis = None
+
+
+def new_session_id():
+    """
+    Returns a random, unguessable session ID for the cookie.
+    """
+    return secrets.token_urlsafe ( 32 )
+
+
+def encode_session(data):
+    return json.dumps ( data, separators=(',', ':') )
+
+
+class ServerSession ( CallbackDict, SessionMixin ):
+    """
+    Session whose contents live in a session store; the cookie only holds `sid`.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False, last_seen=0.0):
+        def on_update(session):
+            session.modified = True
+            session.accessed = True
+
+        super ().__init__ ( initial, on_update )
+        self.sid = sid
+        self.new = new
+        self.last_seen = last_seen
+        self.previous_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        """
+        Moves the session to a fresh ID, e.g. after logging in, and drops the old one.
+        """
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = self.sid
+        self.sid = new_session_id ()
+        self.modified = True
+
+
+class MemorySessionStore:
+    """
+    Keeps sessions in this process, evicting the least recently used beyond
+    `max_entries`. Only suitable for a single web process.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict ()
+        self._by_user = {}
+        self._lock = threading.Lock ()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get ( sid )
+            if entry is None:
+                return None
+            if entry['expires_at'] <= time.time ():
+                self._remove ( sid )
+                return None
+            self._sessions.move_to_end ( sid )
+            return entry
+
+    def save(self, sid, data, user_id, last_seen, expires_at):
+        with self._lock:
+            self._put ( sid, data, user_id, last_seen, expires_at )
+
+    def update(self, sid, data, user_id, last_seen, expires_at):
+        with self._lock:
+            entry = self._sessions.get ( sid )
+            if entry is None or entry['expires_at'] <= time.time ():
+                return False
+            self._put ( sid, data, user_id, last_seen, expires_at )
+            return True
+
+    def delete(self, sid):
+        with self._lock:
+            self._remove ( sid )
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = list ( self._by_user.get ( user_id, () ) )
+            for sid in sids:
+                self._remove ( sid )
+            return sids
+
+    def purge_expired(self, now):
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items () if entry['expires_at'] <= now]
+            for sid in expired:
+                self._remove ( sid )
+            return len ( expired )
+
+    def _put(self, sid, data, user_id, last_seen, expires_at):
+        self._remove ( sid )
+        self._sessions[sid] = {'data': data, 'user_id': user_id, 'last_seen': last_seen, 'expires_at': expires_at}
+        if user_id is not None:
+            self._by_user.setdefault ( user_id, set () ).add ( sid )
+        while len ( self._sessions ) > self.max_entries:
+            self._remove ( next ( iter ( self._sessions ) ) )
+
+    def _remove(self, sid):
+        entry = self._sessions.pop ( sid, None )
+        if entry is not None and entry['user_id'] is not None:
+            sids = self._by_user.get ( entry['user_id'] )
+            if sids is not None:
+                sids.discard ( sid )
+                if not sids:
+                    del self._by_user[entry['user_id']]
+
+
+class SqlSessionStore:
+    """
+    Keeps sessions in the `user_sessions` table, shared by every web process.
+
+    Uses its own connections rather than `db.session`, so saving a session
+    never commits (or rolls back) the request's own unit of work.
+    """
+
+    def load(self, sid):
+        with db.engine.connect () as connection:
+            row = connection.execute (
+                select ( UserSession.data, UserSession.user_id, UserSession.last_seen, UserSession.expires_at )
+                .where ( UserSession.sid == sid, UserSession.expires_at > time.time () )
+            ).first ()
+        if row is None:
+            return None
+        return {'data': json.loads ( row.data ), 'user_id': row.user_id,
+                'last_seen': row.last_seen, 'expires_at': row.expires_at}
+
+    def save(self, sid, data, user_id, last_seen, expires_at):
+        with db.engine.begin () as connection:
+            connection.execute ( insert ( UserSession ).values (
+                sid=sid, data=encode_session ( data ), user_id=user_id, last_seen=last_seen, expires_at=expires_at
+            ) )
+
+    def update(self, sid, data, user_id, last_seen, expires_at):
+        # Never inserts: a session deleted meanwhile (revoked, expired) stays deleted
+        with db.engine.begin () as connection:
+            return connection.execute (
+                update ( UserSession )
+                .where ( UserSession.sid == sid, UserSession.expires_at > time.time () )
+                .values ( data=encode_session ( data ), user_id=user_id, last_seen=last_seen, expires_at=expires_at )
+            ).rowcount > 0
+
+    def delete(self, sid):
+        with db.engine.begin () as connection:
+            connection.execute ( delete ( UserSession ).where ( UserSession.sid == sid ) )
+
+    def delete_user(self, user_id):
+        with db.engine.begin () as connection:
+            sids = connection.execute (
+                select ( UserSession.sid ).where ( UserSession.user_id == user_id )
+            ).scalars ().all ()
+            connection.execute ( delete ( UserSession ).where ( UserSession.user_id == user_id ) )
+        return sids
+
+    def purge_expired(self, now):
+        # One indexed range delete per run instead of a check on every request
+        with db.engine.begin () as connection:
+            return connection.execute ( delete ( UserSession ).where ( UserSession.expires_at <= now ) ).rowcount
+
+
+class RedisSessionStore:
+    """
+    Keeps sessions in Redis (or any server speaking its protocol), shared by
+    every web process. Redis expires idle sessions itself.
+    """
+
+    def __init__(self, url, prefix='instaclone:session:'):
+        if redis is None:
+            raise RuntimeError ( "SESSION_BACKEND = 'redis' requires the redis package to be installed." )
+        self.client = redis.Redis.from_url ( url )
+        self.prefix = prefix
+
+    def load(self, sid):
+        value = self.client.get ( self.prefix + sid )
+        return json.loads ( value ) if value is not None else None
+
+    def save(self, sid, data, user_id, last_seen, expires_at):
+        self._set ( sid, data, user_id, last_seen, expires_at )
+
+    def update(self, sid, data, user_id, last_seen, expires_at):
+        # SET ... XX: a session deleted meanwhile (revoked, expired) stays deleted
+        return self._set ( sid, data, user_id, last_seen, expires_at, existing_only=True )
+
+    def _set(self, sid, data, user_id, last_seen, expires_at, existing_only=False):
+        entry = {'data': data, 'user_id': user_id, 'last_seen': last_seen, 'expires_at': expires_at}
+        ttl = max ( 1, int ( expires_at - time.time () ) )
+        if not self.client.set ( self.prefix + sid, encode_session ( entry ), ex=ttl, xx=existing_only ):
+            return False
+        if user_id is not None:
+            self.client.sadd ( f"{self.prefix}user:{user_id}", sid )
+        return True
+
+    def delete(self, sid):
+        self.client.delete ( self.prefix + sid )
+
+    def delete_user(self, user_id):
+        user_key = f"{self.prefix}user:{user_id}"
+        sids = [sid.decode ( 'utf-8' ) for sid in self.client.smembers ( user_key )]
+        self.client.delete ( user_key, *[self.prefix + sid for sid in sids] )
+        return sids
+
+    def purge_expired(self, now):
+        return 0
+
+
+def create_session_store(config):
+    """
+    Builds the session store selected by SESSION_BACKEND ('memory', 'sql' or 'redis').
+    """
+    backend = config.get ( 'SESSION_BACKEND', 'sql' )
+    if backend == 'memory':
+        return MemorySessionStore ( config.get ( 'SESSION_MAX_ENTRIES', 100000 ) )
+    if backend == 'sql':
+        return SqlSessionStore ()
+    if backend == 'redis':
+        return RedisSessionStore ( config.get ( 'SESSION_REDIS_URL' ) )
+    raise ValueError ( f"Unknown SESSION_BACKEND: {backend}" )
+
+
+class ServerSessionInterface ( SessionInterface ):
+    """
+    Flask session interface backed by a server-side session store.
+
+    The cookie carries only a random session ID, so there is no signature to
+    verify and nothing to decode per request, and a session can be revoked by
+    deleting it from the store. Sessions expire after SESSION_IDLE_TIMEOUT
+    seconds without a request; the store is only written when the session
+    changes or once every SESSION_REFRESH_INTERVAL to extend it.
+
+    For shared stores (sql, redis) loaded sessions are kept in a small
+    in-process cache for SESSION_CACHE_TTL seconds, so a revocation made on
+    another web process takes effect there within that time. Only new or
+    regenerated sessions are inserted; an existing one is only ever updated,
+    so a process still holding a revoked session in its cache can not write
+    it back. When the update finds nothing, the cookie is dropped and the
+    next request starts logged out.
+    """
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+        self.idle_timeout = app.config.get ( 'SESSION_IDLE_TIMEOUT', 14 * 24 * 3600 )
+        self.refresh_interval = app.config.get ( 'SESSION_REFRESH_INTERVAL', 300 )
+        self.purge_interval = app.config.get ( 'SESSION_PURGE_INTERVAL', 600 )
+
+        cache_ttl = app.config.get ( 'SESSION_CACHE_TTL', 10 )
+        self.cache = None
+        if cache_ttl and not isinstance ( store, MemorySessionStore ):
+            self.cache = MemoryCache (
+                max_entries=app.config.get ( 'SESSION_CACHE_MAX_ENTRIES', 10000 ), default_ttl=cache_ttl
+            )
+
+        self._purger = None
+        self._pid = None
+        self._lock = threading.Lock ()
+
+    def open_session(self, app, request):
+        self._ensure_purger ()
+        sid = request.cookies.get ( self.get_cookie_name ( app ) )
+        if sid:
+            entry = self._load ( sid )
+            if entry is not None:
+                return ServerSession ( entry['data'], sid=sid, last_seen=entry['last_seen'] )
+        return ServerSession ( sid=new_session_id (), new=True )
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name ( app )
+        domain = self.get_cookie_domain ( app )
+        path = self.get_cookie_path ( app )
+
+        if session.accessed:
+            response.vary.add ( 'Cookie' )
+
+        if session.previous_sid is not None:
+            self._delete ( session.previous_sid )
+
+        if not session:
+            # Emptied (e.g. by logout): forget it and drop the cookie
+            if not session.new:
+                self._delete ( session.sid )
+                response.delete_cookie ( cookie_name, domain=domain, path=path )
+            return
+
+        now = time.time ()
+        if session.modified or session.new or now - session.last_seen >= self.refresh_interval:
+            entry = {'data': dict ( session ), 'user_id': session.get ( 'User_id' ),
+                     'last_seen': now, 'expires_at': now + self.idle_timeout}
+            if session.new or session.previous_sid is not None:
+                self.store.save ( session.sid, entry['data'], entry['user_id'], now, entry['expires_at'] )
+            elif not self.store.update ( session.sid, entry['data'], entry['user_id'], now, entry['expires_at'] ):
+                # Revoked or expired since it was loaded: do not bring it back
+                if self.cache is not None:
+                    self.cache.delete ( session.sid )
+                response.delete_cookie ( cookie_name, domain=domain, path=path )
+                return
+            if self.cache is not None:
+                self.cache.set ( session.sid, entry )
+
+        if session.modified or session.new:
+            response.set_cookie (
+                cookie_name,
+                session.sid,
+                expires=self.get_expiration_time ( app, session ),
+                httponly=self.get_cookie_httponly ( app ),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure ( app ),
+                samesite=self.get_cookie_samesite ( app ),
+            )
+
+    def revoke_user(self, user_id):
+        """
+        Deletes every session of a user ("log out all devices").
+
+        Returns:
+            int: The number of sessions removed.
+        """
+        sids = self.store.delete_user ( user_id )
+        if self.cache is not None:
+            for sid in sids:
+                self.cache.delete ( sid )
+        return len ( sids )
+
+    def purge_expired(self):
+        """
+        Deletes every session that has been idle longer than SESSION_IDLE_TIMEOUT.
+        """
+        return self.store.purge_expired ( time.time () )
+
+    def _load(self, sid):
+        entry = self.cache.get ( sid ) if self.cache is not None else None
+        if entry is None:
+            entry = self.store.load ( sid )
+            if entry is not None and self.cache is not None:
+                self.cache.set ( sid, entry )
+        if entry is not None and entry['expires_at'] <= time.time ():
+            return None
+        return entry
+
+    def _delete(self, sid):
+        self.store.delete ( sid )
+        if self.cache is not None:
+            self.cache.delete ( sid )
+
+    def _ensure_purger(self):
+        """
+        Starts the expiry thread in this process if it is not running yet.
+        Started lazily so every forked worker gets its own thread.
+        """
+        if not self.purge_interval or (self._purger is not None and self._pid == os.getpid ()):
+            return
+        with self._lock:
+            if self._purger is not None and self._pid == os.getpid ():
+                return
+            self._pid = os.getpid ()
+            self._purger = threading.Thread ( target=self._run_purger, name='session-purge', daemon=True )
+            self._purger.start ()
+
+    def _run_purger(self):
+        while True:
+            time.sleep ( self.purge_interval )
+            try:
+                with self.app.app_context ():
+                    removed = self.purge_expired ()
+                if removed:
+                    logging.info ( "Purged %d expired sessions", removed )
+            except Exception:
+                logging.exception ( "Purging expired sessions failed" )
+
+
+class SessionManager:
+    """
+    Replaces Flask's signed-cookie sessions with server-side sessions, unless
+    SESSION_BACKEND is 'cookie', and offers session rotation and revocation.
+    """
+
+    def __init__(self, app=None):
+        self.interface = None
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        app.extensions['session_manager'] = self
+        if app.config.get ( 'SESSION_BACKEND', 'sql' ) == 'cookie':
+            self.interface = None
+            return
+        self.interface = ServerSessionInterface ( app, create_session_store ( app.config ) )
+        app.session_interface = self.interface
+
+    def rotate(self, session):
+        """
+        Gives the session a new ID, keeping its contents. No-op for cookie sessions.
+        """
+        if isinstance ( session, ServerSession ):
+            session.regenerate ()
+
+    def revoke_user(self, user_id):
+        """
+        Logs a user out everywhere. Returns the number of sessions removed (0 for cookie sessions).
+        """
+        if self.interface is None:
+            return 0
+        return self.interface.revoke_user ( user_id )
+
+
+session_manager = SessionManager ()
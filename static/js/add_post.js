@@ -7,14 +7,18 @@ document.addEventListener('DOMContentLoaded', function() {
     const filterButtons = document.querySelectorAll('.filter-button');
     const postButton = document.getElementById('postButton');
     const filteredImageInput = document.getElementById('filteredImage');
+    const filteredImageFileInput = document.getElementById('filteredImageFile');
+    const filterNameInput = document.getElementById('filterName');
 
     let selectedImage = null;
+    let selectedFile = null;
     let currentFilter = 'none';
 
     // Handle file upload
     uploadInput.addEventListener('change', function(event) {
         const file = event.target.files[0];
         const reader = new FileReader();
+        selectedFile = file || null;
 
         reader.onload = function(e) {
             imagePreview.innerHTML = `<img src="${e.target.result}" alt="Uploaded Image">`;
@@ -40,6 +44,7 @@ document.addEventListener('DOMContentLoaded', function() {
     filterButtons.forEach(button => {
         button.addEventListener('click', function() {
             currentFilter = this.getAttribute('data-filter');
+            filterNameInput.value = this.getAttribute('data-filter-name');
             const imgElement = editedPreview.querySelector('img');
             if (imgElement) {
                 imgElement.style.filter = currentFilter;
@@ -51,6 +56,22 @@ document.addEventListener('DOMContentLoaded', function() {
     postButton.addEventListener('click', function(event) {
         event.preventDefault(); // Prevent default form submission
 
+        // When the server applies filters, upload the original file and the
+        // filter name; a canvas would re-encode it as a much larger PNG
+        const form = document.querySelector('form');
+        if (form && form.dataset.serverFilters === '1' && selectedFile && typeof DataTransfer === 'function') {
+            try {
+                const transfer = new DataTransfer();
+                transfer.items.add(selectedFile);
+                filteredImageFileInput.files = transfer.files;
+                form.submit();
+                return;
+            } catch (error) {
+                console.warn("Could not attach the original file, filtering in the browser instead:", error);
+            }
+        }
+        filterNameInput.value = 'none'; // The canvas below already applies the filter
+
         try {
             const canvas = document.createElement('canvas');
             const ctx = canvas.getContext('2d');
@@ -74,17 +95,28 @@ document.addEventListener('DOMContentLoaded', function() {
             ctx.filter = currentFilter;
             ctx.drawImage(imgElement, 0, 0);
 
-            // Convert canvas to data URL
-            const filteredImageData = canvas.toDataURL();
-            console.log("Filtered Image Data:", filteredImageData);
-            filteredImageInput.value = filteredImageData; // Store the filtered image data
+            if (!form) {
+                console.error("Form not found.");
+                return;
+            }
 
-            // Submit the form
-            const form = document.querySelector('form');
-            if (form) {
-                form.submit(); // Submit the form
+            // Attach the filtered image as a binary file part so the server can
+            // stream it to disk; fall back to a base64 data URL for old browsers
+            if (canvas.toBlob && typeof DataTransfer === 'function') {
+                canvas.toBlob(function(blob) {
+                    try {
+                        const transfer = new DataTransfer();
+                        transfer.items.add(new File([blob], 'post_image.png', { type: blob.type }));
+                        filteredImageFileInput.files = transfer.files;
+                    } catch (error) {
+                        console.warn("Binary upload not supported, sending a data URL instead:", error);
+                        filteredImageInput.value = canvas.toDataURL();
+                    }
+                    form.submit(); // Submit the form
+                });
             } else {
-                console.error("Form not found.");
+                filteredImageInput.value = canvas.toDataURL(); // Store the filtered image data
+                form.submit(); // Submit the form
             }
         } catch (error) {
             console.error("Image processing failed:", error);
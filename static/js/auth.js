@@ -1,20 +1,23 @@
 // Ensure that dropdown menus are hidden by default when the page loads
-document.querySelectorAll('.dropdown-content').forEach(dropdown => {
-  dropdown.style.display = 'none';  // Set all dropdowns to be hidden initially
+document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('.dropdown-content').forEach(dropdown => {
+    dropdown.style.display = 'none';  // Set all dropdowns to be hidden initially
+  });
 });
 
 // Toggle dropdown menu when a menu icon is clicked
-document.querySelectorAll('.menu-toggle').forEach(menuToggle => {
-  menuToggle.addEventListener('click', function(event) {
-    // Prevent the event from bubbling up
-    event.stopPropagation();
+// (delegated, so posts appended by "Load more" work too)
+document.addEventListener('click', function(event) {
+  const menuToggle = event.target.closest('.menu-toggle');
+  if (!menuToggle) {
+    return;
+  }
 
-    // Find the closest dropdown-content to this specific menu toggle
-    const dropdown = menuToggle.nextElementSibling;
+  // Find the closest dropdown-content to this specific menu toggle
+  const dropdown = menuToggle.nextElementSibling;
 
-    // Toggle the visibility of the dropdown menu
-    dropdown.style.display = dropdown.style.display === 'block' ? 'none' : 'block';
-  });
+  // Toggle the visibility of the dropdown menu
+  dropdown.style.display = dropdown.style.display === 'block' ? 'none' : 'block';
 });
 
 // Close all dropdowns if clicked outside
@@ -27,64 +30,64 @@ document.addEventListener('click', function(event) {
   });
 });
 
-document.addEventListener('DOMContentLoaded', function () {
-    const likeIcons = document.querySelectorAll('.like-button i');
-
-    likeIcons.forEach(function (icon) {
-        icon.addEventListener('click', function () {
-            const likeButton = this.closest('.like-button');
-            const postId = likeButton.getAttribute('data-post-id');
-            const isLiked = this.classList.contains('fa-solid');
-
-            // Send the AJAX request to like/unlike the post
-            fetch(`/like/${postId}`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ post_id: postId })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Update the like count
-                    const likeCountElement = likeButton.querySelector('.like-count');
-                    likeCountElement.textContent = data.new_like_count;
-
-                    // Toggle the heart icon color
-                    if (isLiked) {
-                        this.classList.remove('fa-solid');
-                        this.classList.add('fa-regular');
-                        this.style.color = ''; // Reset color (white)
-                    } else {
-                        this.classList.remove('fa-regular');
-                        this.classList.add('fa-solid');
-                        this.style.color = 'red'; // Fill with red when liked
-                    }
-                } else {
-                    alert('Error: ' + data.message);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-            });
-        });
+// Like / unlike a post (delegated, so posts appended by "Load more" work too)
+document.addEventListener('click', function (event) {
+    const icon = event.target.closest('.like-button i');
+    if (!icon) {
+        return;
+    }
+
+    const likeButton = icon.closest('.like-button');
+    const postId = likeButton.getAttribute('data-post-id');
+    const isLiked = icon.classList.contains('fa-solid');
+
+    // Send the AJAX request to like/unlike the post
+    fetch(`/like/${postId}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ post_id: postId })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Update the like count
+            const likeCountElement = likeButton.querySelector('.like-count');
+            likeCountElement.textContent = data.new_like_count;
+
+            // Toggle the heart icon color
+            if (isLiked) {
+                icon.classList.remove('fa-solid');
+                icon.classList.add('fa-regular');
+                icon.style.color = ''; // Reset color (white)
+            } else {
+                icon.classList.remove('fa-regular');
+                icon.classList.add('fa-solid');
+                icon.style.color = 'red'; // Fill with red when liked
+            }
+        } else {
+            alert('Error: ' + data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
     });
 });
 
 // comment box //
  // Toggle visibility of the comment box when the comment icon is clicked
-document.querySelectorAll('.commentIcon').forEach(menuToggle => {
-  menuToggle.addEventListener('click', function(event) {
-    // Prevent the event from bubbling up (we don't want this to close other dropdowns)
-    event.stopPropagation();
+document.addEventListener('click', function(event) {
+  const menuToggle = event.target.closest('.commentIcon');
+  if (!menuToggle) {
+    return;
+  }
 
-    // Find the closest comment box to this specific menu toggle
-    const commentBox = menuToggle.nextElementSibling;
+  // Find the closest comment box to this specific menu toggle
+  const commentBox = menuToggle.nextElementSibling;
 
-    // Toggle the visibility of the comment box
-    commentBox.style.display = commentBox.style.display === 'block' ? 'none' : 'block';
-  });
+  // Toggle the visibility of the comment box
+  commentBox.style.display = commentBox.style.display === 'block' ? 'none' : 'block';
 });
 
 // Close all comment boxes if clicked outside
@@ -97,3 +100,114 @@ document.addEventListener('click', function(event) {
   });
 });
 
+
+// Load older comments for a post from the paginated /comments/<post_id> endpoint
+document.addEventListener('click', function(event) {
+  const button = event.target.closest('.load-older-comments');
+  if (!button) {
+    return;
+  }
+
+  const commentList = button.nextElementSibling;
+  button.disabled = true;
+
+  fetch(`${button.getAttribute('data-url')}?before=${encodeURIComponent(button.getAttribute('data-before'))}`, {
+    credentials: 'same-origin'
+  })
+  .then(response => response.json())
+  .then(data => {
+    if (!data.success) {
+      alert('Error: ' + data.message);
+      return;
+    }
+
+    // Comments arrive newest first; prepend each so the list stays oldest first
+    data.comments.forEach(comment => {
+      const item = document.createElement('li');
+      const commenter = document.createElement('div');
+      commenter.className = 'commenterImage';
+      if (comment.avatar_url) {
+        const avatar = document.createElement('img');
+        avatar.src = comment.avatar_url;
+        avatar.className = 'profiles-img';
+        avatar.alt = 'Profile Image';
+        commenter.appendChild(avatar);
+      }
+      const username = document.createElement('span');
+      username.textContent = comment.username;
+      commenter.appendChild(username);
+
+      const body = document.createElement('div');
+      body.className = 'commentText';
+      const text = document.createElement('p');
+      text.textContent = comment.text;
+      const date = document.createElement('span');
+      date.className = 'date sub-text';
+      date.textContent = comment.timestamp;
+      body.appendChild(text);
+      body.appendChild(date);
+
+      item.appendChild(commenter);
+      item.appendChild(body);
+      commentList.insertBefore(item, commentList.firstChild);
+    });
+
+    // Hide the button once the oldest comment has been loaded
+    if (data.next_cursor) {
+      button.setAttribute('data-before', data.next_cursor);
+      button.disabled = false;
+    } else {
+      button.remove();
+    }
+  })
+  .catch(error => {
+    console.error('Error:', error);
+    button.disabled = false;
+  });
+});
+
+// Refresh like state and counts for every post on the page in one request,
+// e.g. when the page is restored from the browser's back/forward cache
+function refreshLikeState() {
+  const likeButtons = document.querySelectorAll('.like-button');
+  const postIds = Array.from(likeButtons, button => button.getAttribute('data-post-id'));
+  if (postIds.length === 0) {
+    return;
+  }
+
+  fetch('/likes/state', {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ post_ids: postIds })
+  })
+  .then(response => response.json())
+  .then(data => {
+    if (!data.success) {
+      return;
+    }
+    const liked = new Set(data.liked.map(String));
+    likeButtons.forEach(button => {
+      const postId = button.getAttribute('data-post-id');
+      const icon = button.querySelector('i');
+      const isLiked = liked.has(postId);
+      icon.classList.toggle('fa-solid', isLiked);
+      icon.classList.toggle('fa-regular', !isLiked);
+      icon.style.color = isLiked ? 'red' : '';
+      if (postId in data.counts) {
+        button.querySelector('.like-count').textContent = data.counts[postId];
+      }
+    });
+  })
+  .catch(error => {
+    console.error('Error:', error);
+  });
+}
+
+window.addEventListener('pageshow', function(event) {
+  if (event.persisted) {
+    refreshLikeState();
+  }
+});
@@ -0,0 +1,45 @@
+// "Load more" button for the dashboard feed and the profile grid.
+// Fetches the next page as an HTML fragment and appends it to the page.
+document.addEventListener('DOMContentLoaded', function() {
+    const loadMoreButton = document.getElementById('loadMore');
+    const container = document.getElementById('feedPosts') || document.getElementById('profileGrid');
+
+    if (!loadMoreButton || !container) {
+        return;
+    }
+
+    loadMoreButton.addEventListener('click', function() {
+        const before = loadMoreButton.getAttribute('data-before');
+        loadMoreButton.disabled = true;
+
+        fetch(`${loadMoreButton.getAttribute('data-url')}?before=${encodeURIComponent(before)}`, {
+            credentials: 'same-origin'
+        })
+        .then(response => {
+            const nextCursor = response.headers.get('X-Next-Cursor');
+            return response.text().then(html => ({ html, nextCursor }));
+        })
+        .then(({ html, nextCursor }) => {
+            const fragment = document.createElement('template');
+            fragment.innerHTML = html;
+
+            // Dropdowns in the new posts start hidden, like the ones already on the page
+            fragment.content.querySelectorAll('.dropdown-content').forEach(dropdown => {
+                dropdown.style.display = 'none';
+            });
+            container.appendChild(fragment.content);
+
+            // Remove the button once the last page has been loaded
+            if (nextCursor) {
+                loadMoreButton.setAttribute('data-before', nextCursor);
+                loadMoreButton.disabled = false;
+            } else {
+                loadMoreButton.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            loadMoreButton.disabled = false;
+        });
+    });
+});
@@ -0,0 +1,53 @@
+// Tells the user while they type whether the username, email or phone number
+// they picked is already taken. Advisory only: the server checks again on submit.
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.querySelector('form[data-availability-url]');
+    if (!form) {
+        return;
+    }
+
+    const messages = {
+        username: 'This username is taken.',
+        email: 'An account with this email already exists.',
+        number: 'An account with this phone number already exists.'
+    };
+
+    ['username', 'email', 'number'].forEach(name => {
+        const input = form.querySelector(`input[name="${name}"]`);
+        if (!input) {
+            return;
+        }
+        const hint = document.createElement('small');
+        hint.className = 'availability';
+        input.insertAdjacentElement('afterend', hint);
+
+        let timer = null;
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            hint.textContent = '';
+            hint.classList.remove('taken');
+
+            const value = input.value.trim();
+            if (!value) {
+                return;
+            }
+            timer = setTimeout(function() {
+                fetch(`${form.getAttribute('data-availability-url')}?${name}=${encodeURIComponent(value)}`, {
+                    credentials: 'same-origin'
+                })
+                .then(response => response.json())
+                .then(data => {
+                    // Ignore answers for a value the user has since changed
+                    if (!data.success || input.value.trim() !== value) {
+                        return;
+                    }
+                    if (data.available[name] === false) {
+                        hint.textContent = messages[name];
+                        hint.classList.add('taken');
+                    }
+                })
+                .catch(error => console.error('Availability check failed:', error));
+            }, 300);
+        });
+    });
+});
@@ -0,0 +1,64 @@
+// Typeahead for the search page: fetches matches as JSON while the user types
+// and redraws the result list. Each request aborts the previous one.
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.getElementById('searchInput');
+    const list = document.getElementById('searchResults');
+
+    if (!input || !list) {
+        return;
+    }
+
+    let timer = null;
+    let pending = null;
+
+    function render(results) {
+        list.innerHTML = '';
+        results.forEach(user => {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = `${input.getAttribute('data-profile-url')}/${user.id}`;
+
+            const username = document.createElement('strong');
+            username.textContent = user.username;
+            link.appendChild(username);
+
+            if (user.nickname) {
+                const nickname = document.createElement('span');
+                nickname.textContent = ` ${user.nickname}`;
+                link.appendChild(nickname);
+            }
+            const posts = document.createElement('small');
+            posts.textContent = ` ${user.post_count} posts`;
+            link.appendChild(posts);
+
+            item.appendChild(link);
+            list.appendChild(item);
+        });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            const query = input.value.trim();
+            if (pending) {
+                pending.abort();
+            }
+            if (!query) {
+                list.innerHTML = '';
+                return;
+            }
+            pending = new AbortController();
+            fetch(`${input.getAttribute('data-url')}?format=json&q=${encodeURIComponent(query)}`, {
+                credentials: 'same-origin',
+                signal: pending.signal
+            })
+            .then(response => response.json())
+            .then(data => render(data.results || []))
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    console.error('Search failed:', error);
+                }
+            });
+        }, 150);
+    });
+});
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+
+from model import db, Blob
+from storage_backends import media_storage
+import metrics
+from uploads import save_stream
+
+# Uploads are stored as uploads/<aa>/<bb>/<sha256>.<ext>
+SHARD_DEPTH = 2
+
+
+def blob_hash(image_path):
+    """
+    Returns the content hash encoded in a content-addressed image path,
+    or None for legacy uploads that were stored under their own name.
+    """
+    if not image_path:
+        return None
+    parts = image_path.split ( '/' )
+    if len ( parts ) != SHARD_DEPTH + 2 or parts[0] != 'uploads':
+        return None
+    return os.path.splitext ( parts[-1] )[0]
+
+
+def store_upload(source, extension, kind='post'):
+    """
+    Stores an uploaded image once per distinct content and takes a reference to it.
+
+    The upload is streamed to a temporary file while its SHA-256 is computed.
+    If a blob with the same hash is already stored the temporary file is not
+    written to the storage backend, so reposted images cost no extra space or
+    write I/O.
+    The reference is taken inside the caller's transaction and is undone if
+    the caller rolls back. Size and duration are recorded in the upload
+    metrics under `kind` ('post' or 'profile').
+
+    Returns:
+        str: The image path relative to `static`, to save on Post / Profile.
+    """
+    # Stage next to the upload folder so local storage can move the file into place
+    temp_dir = None
+    if media_storage.is_local:
+        temp_dir = os.path.join ( current_app.config['UPLOAD_FOLDER'], '.tmp' )
+        os.makedirs ( temp_dir, exist_ok=True )
+
+    started = time.perf_counter ()
+    hasher = hashlib.sha256 ()
+    handle, temp_path = tempfile.mkstemp ( dir=temp_dir )
+    os.close ( handle )
+
+    try:
+        size = save_stream ( source, temp_path, hasher=hasher )
+        digest = hasher.hexdigest ()
+        shards = [digest[i * 2:i * 2 + 2] for i in range ( SHARD_DEPTH )]
+        candidate_path = '/'.join ( ['uploads'] + shards + [f"{digest}.{extension}"] )
+
+        image_path = acquire ( digest, candidate_path, size )
+
+        if media_storage.exists ( image_path ):
+            media_storage.keep_local_copy ( image_path, temp_path )
+        else:
+            media_storage.save ( image_path, temp_path )
+
+        metrics.upload_bytes.observe ( kind, value=size )
+        metrics.upload_duration.observe ( kind, value=time.perf_counter () - started )
+        return image_path
+    except Exception:
+        if os.path.exists ( temp_path ):
+            os.remove ( temp_path )
+        raise
+
+
+def acquire(digest, image_path, size):
+    """
+    Adds a reference to the blob with this hash, creating its row if needed.
+
+    Returns:
+        str: The stored path of the blob (an earlier upload of the same
+        content may have used a different extension).
+    """
+    db.session.execute (
+        insert ( Blob ).values ( hash=digest, path=image_path, size=size, ref_count=0 )
+        .prefix_with ( 'OR IGNORE', dialect='sqlite' )
+        .prefix_with ( 'IGNORE', dialect='mysql' )
+    )
+    db.session.execute (
+        update ( Blob ).where ( Blob.hash == digest )
+        .values ( ref_count=Blob.ref_count + 1 )
+        .execution_options ( synchronize_session=False )
+    )
+    return db.session.execute ( select ( Blob.path ).where ( Blob.hash == digest ) ).scalar ()
+
+
+def release(image_path):
+    """
+    Drops one reference to the blob behind `image_path` inside the caller's transaction.
+    Legacy paths that are not content-addressed are ignored.
+    Call `collect_garbage` after committing to remove blobs nobody references any more.
+    """
+    digest = blob_hash ( image_path )
+    if digest is None:
+        return
+    db.session.execute (
+        update ( Blob ).where ( Blob.hash == digest, Blob.ref_count > 0 )
+        .values ( ref_count=Blob.ref_count - 1 )
+        .execution_options ( synchronize_session=False )
+    )
+
+
+def stored_variants(image_path):
+    """
+    Returns the resized variants already generated for the blob behind
+    `image_path`, or None if there are none yet (or it is a legacy upload).
+    """
+    digest = blob_hash ( image_path )
+    if digest is None:
+        return None
+    return db.session.execute ( select ( Blob.variants ).where ( Blob.hash == digest ) ).scalar ()
+
+
+def discard_upload(image_path):
+    """
+    Undoes `store_upload` after the caller rolled back its transaction: the
+    stored file and its variants are deleted unless a committed post or
+    profile still references the blob.
+
+    Inserts an unreferenced row first, as `acquire` would, so a concurrent
+    upload of the same content waits on it just as it does for `collect_garbage`.
+
+    Returns:
+        bool: True if the file was deleted.
+    """
+    digest = blob_hash ( image_path )
+    if digest is None:
+        return False
+
+    try:
+        db.session.execute (
+            insert ( Blob ).values ( hash=digest, path=image_path, size=0, ref_count=0 )
+            .prefix_with ( 'OR IGNORE', dialect='sqlite' )
+            .prefix_with ( 'IGNORE', dialect='mysql' )
+        )
+    except Exception:
+        db.session.rollback ()
+        logging.exception ( "Discarding upload %s failed", digest )
+        return False
+    return collect_garbage ( image_path )
+
+
+def collect_garbage(image_path):
+    """
+    Deletes the blob behind `image_path`, and its resized variants, if no
+    post or profile references it any more.
+
+    The files are removed before the row deletion commits, so a concurrent
+    upload of the same content waits on the row and then writes the file again.
+
+    Returns:
+        bool: True if the blob was deleted.
+    """
+    digest = blob_hash ( image_path )
+    if digest is None:
+        return False
+
+    try:
+        removed = db.session.execute (
+            delete ( Blob ).where ( Blob.hash == digest, Blob.ref_count <= 0 )
+        ).rowcount
+        if removed:
+            media_storage.delete ( image_path )
+            media_storage.delete_prefix ( f"uploads/variants/{digest}_" )
+        db.session.commit ()
+        return bool ( removed )
+    except Exception:
+        db.session.rollback ()
+        logging.exception ( "Garbage-collecting blob %s failed", digest )
+        return False
@@ -0,0 +1,312 @@
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+
+from flask import g, has_request_context, url_for
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+except ImportError:  # boto3 is only needed for the S3 backend
+    boto3 = None
+
+
+class LocalStorage:
+    """
+    Stores uploads on the local filesystem under UPLOAD_FOLDER and serves them
+    through Flask's `static` route. Keys look like 'uploads/ab/cd/<hash>.png'.
+    """
+
+    is_local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        """
+        Returns the filesystem path for a key.
+        """
+        return os.path.join ( self.root, os.path.relpath ( key, 'uploads' ) )
+
+    def save(self, key, file_path):
+        """
+        Moves a local file into storage under `key`.
+        """
+        destination = self.path ( key )
+        if os.path.abspath ( file_path ) != os.path.abspath ( destination ):
+            os.makedirs ( os.path.dirname ( destination ), exist_ok=True )
+            os.replace ( file_path, destination )
+
+    def exists(self, key):
+        return os.path.exists ( self.path ( key ) )
+
+    def delete(self, key):
+        if os.path.exists ( self.path ( key ) ):
+            os.remove ( self.path ( key ) )
+
+    def delete_prefix(self, prefix):
+        """
+        Deletes every stored file whose key starts with `prefix`.
+        """
+        directory, name_prefix = os.path.split ( self.path ( prefix ) )
+        if os.path.isdir ( directory ):
+            for name in os.listdir ( directory ):
+                if name.startswith ( name_prefix ):
+                    os.remove ( os.path.join ( directory, name ) )
+
+    def download(self, key, file_path):
+        shutil.copyfile ( self.path ( key ), file_path )
+
+    def url(self, key):
+        return url_for ( 'static', filename=key )
+
+
+class ObjectStorage:
+    """
+    Stores uploads in an S3-compatible object store (AWS S3, MinIO, ...).
+
+    The client keeps a pool of STORAGE_POOL_SIZE HTTP connections, and files
+    larger than STORAGE_MULTIPART_THRESHOLD are uploaded as multipart uploads
+    with up to STORAGE_MAX_CONCURRENCY parts in flight.
+    """
+
+    is_local = False
+
+    def __init__(self, bucket, client_factory, public_url=None, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunk_size=8 * 1024 * 1024, max_concurrency=4, url_expiry=3600):
+        self.bucket = bucket
+        self.public_url = public_url.rstrip ( '/' ) if public_url else None
+        self.url_expiry = url_expiry
+        self.transfer_config = TransferConfig (
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunk_size,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        ) if boto3 is not None else None
+        self._client_factory = client_factory
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock ()
+
+    @property
+    def client(self):
+        """
+        Returns this process's client; clients (and their connection pools)
+        are not shared with forked workers.
+        """
+        if self._client is None or self._pid != os.getpid ():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid ():
+                    self._client = self._client_factory ()
+                    self._pid = os.getpid ()
+        return self._client
+
+    def save(self, key, file_path):
+        """
+        Uploads a local file under `key`. The local file is left in place.
+        """
+        content_type = mimetypes.guess_type ( key )[0] or 'application/octet-stream'
+        self.client.upload_file (
+            file_path, self.bucket, key,
+            ExtraArgs={'ContentType': content_type},
+            Config=self.transfer_config,
+        )
+
+    def exists(self, key):
+        response = self.client.list_objects_v2 ( Bucket=self.bucket, Prefix=key, MaxKeys=1 )
+        return any ( item['Key'] == key for item in response.get ( 'Contents', [] ) )
+
+    def delete(self, key):
+        self.client.delete_object ( Bucket=self.bucket, Key=key )
+
+    def delete_prefix(self, prefix):
+        response = self.client.list_objects_v2 ( Bucket=self.bucket, Prefix=prefix )
+        for item in response.get ( 'Contents', [] ):
+            self.client.delete_object ( Bucket=self.bucket, Key=item['Key'] )
+
+    def download(self, key, file_path):
+        self.client.download_file ( self.bucket, key, file_path, Config=self.transfer_config )
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return self.client.generate_presigned_url (
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.url_expiry
+        )
+
+
+class MemoryObjectClient:
+    """
+    In-memory stand-in for an S3 client, for tests and local development.
+    Implements only the calls ObjectStorage makes.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock ()
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        with open ( Filename, 'rb' ) as f:
+            data = f.read ()
+        with self._lock:
+            self.objects[(Bucket, Key)] = data
+
+    def download_file(self, Bucket, Key, Filename, Config=None):
+        with self._lock:
+            data = self.objects[(Bucket, Key)]
+        with open ( Filename, 'wb' ) as f:
+            f.write ( data )
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000):
+        with self._lock:
+            keys = sorted ( key for bucket, key in self.objects if bucket == Bucket and key.startswith ( Prefix ) )
+        return {'Contents': [{'Key': key} for key in keys[:MaxKeys]]}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop ( (Bucket, Key), None )
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        return f"memory://{Params['Bucket']}/{Params['Key']}"
+
+
+def create_backend(config):
+    """
+    Builds the storage backend selected by STORAGE_BACKEND ('local', 's3' or 'memory').
+    """
+    backend = config.get ( 'STORAGE_BACKEND', 'local' )
+    if backend == 'local':
+        return LocalStorage ( config['UPLOAD_FOLDER'] )
+
+    if backend == 'memory':
+        client = MemoryObjectClient ()
+        client_factory = lambda: client
+    elif backend == 's3':
+        if boto3 is None:
+            raise RuntimeError ( "STORAGE_BACKEND = 's3' requires boto3 to be installed." )
+        client_factory = lambda: boto3.client (
+            's3',
+            endpoint_url=config.get ( 'STORAGE_ENDPOINT_URL' ),
+            config=BotoConfig ( max_pool_connections=config.get ( 'STORAGE_POOL_SIZE', 10 ) ),
+        )
+    else:
+        raise ValueError ( f"Unknown STORAGE_BACKEND: {backend}" )
+
+    return ObjectStorage (
+        bucket=config.get ( 'STORAGE_BUCKET', 'uploads' ),
+        client_factory=client_factory,
+        public_url=config.get ( 'STORAGE_PUBLIC_URL' ),
+        multipart_threshold=config.get ( 'STORAGE_MULTIPART_THRESHOLD', 8 * 1024 * 1024 ),
+        multipart_chunk_size=config.get ( 'STORAGE_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024 ),
+        max_concurrency=config.get ( 'STORAGE_MAX_CONCURRENCY', 4 ),
+    )
+
+
+class MediaStorage:
+    """
+    Flask extension giving the rest of the app one interface to the configured
+    upload backend, plus the `media_url` template helper that replaces
+    `url_for('static', ...)` for uploaded images.
+
+    With an object-store backend, a freshly uploaded file is also kept on local
+    disk until the end of the request (or until the image pipeline claims it),
+    so variants can be generated without downloading it again.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.backend = create_backend ( app.config )
+        app.extensions['media_storage'] = self
+        app.add_template_global ( self.url, 'media_url' )
+        app.teardown_request ( self._discard_staged )
+
+    @property
+    def is_local(self):
+        return self.backend.is_local
+
+    def save(self, key, file_path):
+        """
+        Stores a local file under `key`. Local backends move the file; object
+        backends upload it and keep the local copy staged for this request.
+        """
+        self.backend.save ( key, file_path )
+        if not self.backend.is_local:
+            g.setdefault ( 'staged_uploads', {} )[key] = file_path
+
+    def keep_local_copy(self, key, file_path):
+        """
+        Called when `key` is already stored and `file_path` holds the same content.
+        Object backends stage the copy for this request; local backends drop it.
+        """
+        if self.backend.is_local:
+            os.remove ( file_path )
+        else:
+            g.setdefault ( 'staged_uploads', {} )[key] = file_path
+
+    def exists(self, key):
+        return self.backend.exists ( key )
+
+    def delete(self, key):
+        self.backend.delete ( key )
+
+    def delete_prefix(self, prefix):
+        self.backend.delete_prefix ( prefix )
+
+    def url(self, key):
+        return self.backend.url ( key ) if key else ''
+
+    def claim_local_copy(self, key):
+        """
+        Returns a local file holding the content stored under `key`, and whether
+        the caller now owns it (and must delete it when done).
+        """
+        if self.backend.is_local:
+            return self.backend.path ( key ), False
+
+        staged = g.get ( 'staged_uploads', {} ).pop ( key, None ) if has_request_context () else None
+        if staged is not None:
+            return staged, True
+
+        handle, file_path = tempfile.mkstemp ( suffix=os.path.splitext ( key )[1] )
+        os.close ( handle )
+        self.backend.download ( key, file_path )
+        return file_path, True
+
+    def staged_path(self, key):
+        """
+        Returns a local file holding the content stored under `key` if one is at
+        hand without downloading (the local file, or this request's staged
+        upload), otherwise None. The caller must not delete it.
+        """
+        if self.backend.is_local:
+            return self.backend.path ( key )
+        return g.get ( 'staged_uploads', {} ).get ( key ) if has_request_context () else None
+
+    def output_dir(self, prefix):
+        """
+        Returns a local directory to write files that will be stored under `prefix`:
+        the final folder for local storage, a fresh temporary folder otherwise.
+        """
+        if self.backend.is_local:
+            directory = self.backend.path ( prefix )
+            os.makedirs ( directory, exist_ok=True )
+            return directory
+        return tempfile.mkdtemp ()
+
+    def _discard_staged(self, exception=None):
+        """
+        Removes staged local copies nobody claimed during the request.
+        """
+        for file_path in g.pop ( 'staged_uploads', {} ).values ():
+            if os.path.exists ( file_path ):
+                os.remove ( file_path )
+
+
+media_storage = MediaStorage ()
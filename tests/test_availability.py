@@ -0,0 +1,54 @@
+"""
+The availability filters must never answer "definitely free" for a value the
+database's case-insensitive collation would consider taken.
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert ( 0, os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+
+from availability import AvailabilityFilter, collation_key
+from model import db, User
+
+
+@pytest.fixture
+def checker():
+    app = Flask ( __name__ )
+    app.config.update ( SQLALCHEMY_DATABASE_URI='sqlite://', AVAILABILITY_BUILD_ON_STARTUP=False )
+    db.init_app ( app )
+    with app.app_context ():
+        db.create_all ()
+        db.session.add ( User ( username='alice', email='alice@example.com', password='-', number='555' ) )
+        db.session.commit ()
+        availability = AvailabilityFilter ( app )
+        availability.rebuild ()
+        yield availability
+
+
+def test_collation_key_ignores_case_accents_and_trailing_spaces():
+    assert collation_key ( 'Alice  ' ) == collation_key ( 'alicé' ) == 'alice'
+    assert collation_key ( ' alice' ) != 'alice'  # Leading spaces count in every collation
+
+
+@pytest.mark.parametrize ( 'column, value', [
+    ('username', 'alice'),
+    ('username', 'Alice'),
+    ('username', 'alice '),
+    ('username', 'ALICÉ'),
+    ('email', 'Alice@Example.com'),
+] )
+def test_collating_values_are_not_ruled_out(checker, column, value):
+    assert checker.might_exist ( column, value )
+
+
+def test_values_added_after_the_build_are_folded_too(checker):
+    checker.add_user ( 2, 'Bob', 'bob@example.com', None )
+    assert checker.might_exist ( 'username', 'bob ' )
+
+
+def test_unrelated_values_are_ruled_out(checker):
+    assert not checker.might_exist ( 'username', 'carol' )
+    assert not checker.is_taken ( 'email', 'carol@example.com' )
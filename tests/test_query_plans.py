@@ -0,0 +1,23 @@
+"""
+Runs benchmarks/check_query_plans.py as part of the test suite, so a query
+that starts scanning a whole table fails the build.
+
+The script changes directory and sets up the app's global extensions, so
+it runs in its own interpreter.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) )
+
+
+def run_benchmark(name, *args):
+    return subprocess.run ( [sys.executable, os.path.join ( ROOT, 'benchmarks', name ), *args],
+                            capture_output=True, text=True, timeout=600 )
+
+
+def test_no_full_table_scans():
+    result = run_benchmark ( 'check_query_plans.py' )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "No full table scans." in result.stdout
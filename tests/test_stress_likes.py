@@ -0,0 +1,24 @@
+"""
+Runs benchmarks/stress_likes.py as part of the test suite: concurrent like
+toggles must leave every count exact, with and without the like buffer.
+
+The script changes directory and sets up the app's global extensions, so
+it runs in its own interpreter.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) )
+
+
+@pytest.mark.parametrize ( 'mode', [[], ['--buffered']], ids=['direct', 'buffered'] )
+def test_concurrent_toggles_keep_counts_exact(mode):
+    result = subprocess.run ( [sys.executable, os.path.join ( ROOT, 'benchmarks', 'stress_likes.py' ),
+                               '--clients', '16', '--toggles', '100', *mode],
+                              capture_output=True, text=True, timeout=600 )
+    assert result.returncode == 0, result.stdout + result.stderr
+    summary = next ( line for line in result.stdout.splitlines () if 'toggles succeeded' in line )
+    assert int ( summary.split ()[0] ) > 0, summary
@@ -0,0 +1,415 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert, literal, or_, select, union_all
+
+from model import db, Follow, Post, TimelineEntry, User
+
+
+class HomeTimelines:
+    """
+    Materialized home timelines: each user's feed is a bounded list of post
+    IDs in the `timeline` table, so a dashboard page is one range read on its
+    primary key (user_id, post_id) instead of a sort over `post`.
+
+    New posts are fanned out on write: the author's own timeline gets the
+    post right away, and a background thread copies it into every
+    follower's timeline, TIMELINE_FANOUT_BATCH followers per transaction.
+    Accounts with TIMELINE_FANOUT_LIMIT or more followers are not fanned out;
+    their latest posts are merged in when a follower reads (fan-out on read),
+    with one bounded index range per such account.
+
+    Timelines keep about TIMELINE_LENGTH posts: each insert trims its
+    timeline with probability 1 / TIMELINE_TRIM_EVERY. Following someone
+    copies their last TIMELINE_BACKFILL posts in; unfollowing removes their
+    entries, and deleting a post removes it from every timeline. When an
+    account drops back under TIMELINE_FANOUT_LIMIT, its latest posts are
+    copied into its followers' timelines, as they are no longer merged in.
+
+    Queued jobs are drained when the process exits cleanly; after a crash,
+    `flask timeline rebuild` recreates timelines from the follow graph.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.length = 800
+        self.fanout_limit = 10000
+        self.batch_size = 1000
+        self.asynchronous = True
+        self.trim_every = 50
+        self.backfill = 50
+        self.large_accounts_ttl = 60
+
+        self._queue = queue.Queue ()
+        self._lock = threading.Lock ()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        self._large_accounts = frozenset ()
+        self._large_accounts_at = None
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        """
+        Reads the timeline settings and registers the `flask timeline` commands.
+        """
+        self.app = app
+        self.enabled = app.config.get ( 'TIMELINE_ENABLED', True )
+        self.length = app.config.get ( 'TIMELINE_LENGTH', 800 )
+        self.fanout_limit = app.config.get ( 'TIMELINE_FANOUT_LIMIT', 10000 )
+        self.batch_size = app.config.get ( 'TIMELINE_FANOUT_BATCH', 1000 )
+        self.asynchronous = app.config.get ( 'TIMELINE_FANOUT_ASYNC', True )
+        self.trim_every = app.config.get ( 'TIMELINE_TRIM_EVERY', 50 )
+        self.backfill = app.config.get ( 'TIMELINE_BACKFILL', 50 )
+        self.large_accounts_ttl = app.config.get ( 'TIMELINE_LARGE_ACCOUNTS_TTL', 60 )
+        self._large_accounts_at = None
+
+        app.extensions['timelines'] = self
+        app.cli.add_command ( timeline_cli )
+        if self.enabled and self.asynchronous:
+            atexit.register ( self.shutdown )
+
+    # Read side
+
+    def page(self, user_id, before=None, page_size=20):
+        """
+        Returns one page of a user's home timeline.
+
+        Returns:
+            - post_ids: Post IDs older than `before`, newest first.
+            - next_cursor: The `before` value for the following page, or None on the last page.
+        """
+        statement = select ( TimelineEntry.post_id ).where ( TimelineEntry.user_id == user_id )
+        if before is not None:
+            statement = statement.where ( TimelineEntry.post_id < before )
+        # Fetch one extra entry to find out whether another page exists
+        post_ids = db.session.execute (
+            statement.order_by ( TimelineEntry.post_id.desc () ).limit ( page_size + 1 )
+        ).scalars ().all ()
+
+        pulled = self._pull ( user_id, before, page_size + 1 )
+        if pulled:
+            post_ids = sorted ( set ( post_ids ).union ( pulled ), reverse=True )[:page_size + 1]
+
+        next_cursor = None
+        if len ( post_ids ) > page_size:
+            post_ids = post_ids[:page_size]
+            next_cursor = post_ids[-1]
+        return post_ids, next_cursor
+
+    def _pull(self, user_id, before, limit):
+        """
+        Fan-out on read: returns the latest post IDs of the large accounts the user follows.
+        """
+        large = self.large_accounts ()
+        if not large:
+            return []
+        followed = db.session.execute (
+            select ( Follow.followed_id ).where ( Follow.follower_id == user_id, Follow.followed_id.in_ ( large ) )
+        ).scalars ().all ()
+        if not followed:
+            return []
+
+        # One bounded range on ix_post_user_id_id per account
+        selects = []
+        for author_id in followed:
+            recent = select ( Post.id ).where ( Post.user_id == author_id )
+            if before is not None:
+                recent = recent.where ( Post.id < before )
+            recent = recent.order_by ( Post.id.desc () ).limit ( limit ).subquery ()
+            selects.append ( select ( recent.c.id ) )
+        statement = union_all ( *selects ) if len ( selects ) > 1 else selects[0]
+        return db.session.execute ( statement ).scalars ().all ()
+
+    def large_accounts(self):
+        """
+        Returns the IDs of accounts with at least TIMELINE_FANOUT_LIMIT followers,
+        cached for TIMELINE_LARGE_ACCOUNTS_TTL seconds: the accounts merged in at
+        read time. Fan-outs check the current count instead, so an account that
+        just became large may take up to the TTL to show up in feeds.
+        """
+        now = time.monotonic ()
+        if self._large_accounts_at is None or now - self._large_accounts_at >= self.large_accounts_ttl:
+            self._large_accounts = frozenset ( db.session.execute (
+                select ( User.id ).where ( User.follower_count >= self.fanout_limit )
+            ).scalars () )
+            self._large_accounts_at = now
+        return self._large_accounts
+
+    # Write side
+
+    def post_created(self, post_id, author_id):
+        """
+        Adds a committed post to its author's timeline and fans it out to their
+        followers, in the background unless TIMELINE_FANOUT_ASYNC is off.
+        """
+        if not self.enabled:
+            return
+        self._insert ( [(author_id, post_id, author_id)] )
+        db.session.commit ()
+
+        self._submit ( self.fan_out, post_id, author_id )
+
+    def follow(self, follower_id, followed_id):
+        """
+        Copies the followed account's latest posts into the follower's
+        timeline, within the current transaction.
+        """
+        if not self.enabled or followed_id in self.large_accounts ():
+            return  # A large account's posts are merged in at read time
+        recent = select ( literal ( follower_id ), Post.id, Post.user_id ) \
+            .where ( Post.user_id == followed_id ).order_by ( Post.id.desc () ).limit ( self.backfill )
+        db.session.execute (
+            insert ( TimelineEntry ).from_select ( ['user_id', 'post_id', 'author_id'], recent )
+            .prefix_with ( 'OR IGNORE', dialect='sqlite' ).prefix_with ( 'IGNORE', dialect='mysql' )
+        )
+
+    def unfollow(self, follower_id, followed_id):
+        """
+        Removes the unfollowed account's posts from the follower's timeline,
+        within the current transaction (after its follower_count was lowered).
+        """
+        if not self.enabled:
+            return
+        db.session.execute (
+            delete ( TimelineEntry ).where ( TimelineEntry.user_id == follower_id, TimelineEntry.author_id == followed_id )
+        )
+        # Counts move one at a time, so exactly one unfollow sees the account drop under the limit
+        if self._follower_count ( followed_id ) == self.fanout_limit - 1:
+            self._submit ( self.backfill_followers, followed_id )
+
+    def post_deleted(self, post_id, author_id):
+        """
+        Removes a post from its author's and followers' timelines, within the
+        current transaction. Those are the only timelines holding it, so every
+        delete is a primary-key lookup.
+        """
+        followers = select ( Follow.follower_id ).where ( Follow.followed_id == author_id )
+        db.session.execute (
+            delete ( TimelineEntry ).where ( TimelineEntry.user_id == author_id, TimelineEntry.post_id == post_id )
+        )
+        db.session.execute (
+            delete ( TimelineEntry ).where ( TimelineEntry.user_id.in_ ( followers ), TimelineEntry.post_id == post_id )
+            .execution_options ( synchronize_session=False )
+        )
+
+    def fan_out(self, post_id, author_id):
+        """
+        Writes a post into the timelines of its author's followers, committing
+        after every TIMELINE_FANOUT_BATCH followers.
+
+        Returns:
+            int: The number of follower timelines written (0 for a large account or a deleted post).
+        """
+        # The current count rather than the cached set, so a fan-out is never
+        # skipped for an account that has just dropped under the limit
+        if self._follower_count ( author_id ) >= self.fanout_limit:
+            return 0
+        if db.session.get ( Post, post_id ) is None:
+            return 0  # Deleted before its fan-out ran
+
+        written = 0
+        after = 0
+        while True:
+            followers = db.session.execute (
+                select ( Follow.follower_id )
+                .where ( Follow.followed_id == author_id, Follow.follower_id > after )
+                .order_by ( Follow.follower_id ).limit ( self.batch_size )
+            ).scalars ().all ()
+            if not followers:
+                return written
+            self._insert ( [(follower_id, post_id, author_id) for follower_id in followers] )
+            db.session.commit ()
+            written += len ( followers )
+            after = followers[-1]
+
+    def backfill_followers(self, author_id):
+        """
+        Copies an account's latest TIMELINE_BACKFILL posts into all its
+        followers' timelines, committing after every TIMELINE_FANOUT_BATCH
+        followers. Used when the account stops being merged in at read time.
+
+        Returns:
+            int: The number of follower timelines written.
+        """
+        recent = select ( Post.id, Post.user_id ).where ( Post.user_id == author_id ) \
+            .order_by ( Post.id.desc () ).limit ( self.backfill ).subquery ()
+        written = 0
+        after = 0
+        while True:
+            last = db.session.execute (
+                select ( Follow.follower_id )
+                .where ( Follow.followed_id == author_id, Follow.follower_id > after )
+                .order_by ( Follow.follower_id ).offset ( self.batch_size - 1 ).limit ( 1 )
+            ).scalar ()
+            batch = select ( Follow.follower_id, recent.c.id, recent.c.user_id ) \
+                .join ( recent, recent.c.user_id == Follow.followed_id ) \
+                .where ( Follow.followed_id == author_id, Follow.follower_id > after )
+            if last is not None:
+                batch = batch.where ( Follow.follower_id <= last )
+            result = db.session.execute (
+                insert ( TimelineEntry ).from_select ( ['user_id', 'post_id', 'author_id'], batch )
+                .prefix_with ( 'OR IGNORE', dialect='sqlite' ).prefix_with ( 'IGNORE', dialect='mysql' )
+            )
+            db.session.commit ()
+            written += result.rowcount
+            if last is None:
+                return written
+            after = last
+
+    def trim(self, user_id):
+        """
+        Drops a timeline's entries beyond its newest TIMELINE_LENGTH.
+        """
+        cutoff = db.session.execute (
+            select ( TimelineEntry.post_id ).where ( TimelineEntry.user_id == user_id )
+            .order_by ( TimelineEntry.post_id.desc () ).offset ( self.length ).limit ( 1 )
+        ).scalar ()
+        if cutoff is not None:
+            db.session.execute (
+                delete ( TimelineEntry ).where ( TimelineEntry.user_id == user_id, TimelineEntry.post_id <= cutoff )
+            )
+
+    def rebuild(self, user_id):
+        """
+        Recreates a user's timeline from the follow graph, within the current
+        transaction: the newest TIMELINE_LENGTH posts by them and by the
+        accounts they follow (other than large accounts).
+        """
+        db.session.execute ( delete ( TimelineEntry ).where ( TimelineEntry.user_id == user_id ) )
+        followed = select ( Follow.followed_id ).where ( Follow.follower_id == user_id )
+        large = self.large_accounts () - {user_id}
+        authors = or_ ( Post.user_id == user_id, Post.user_id.in_ ( followed ) )
+        if large:
+            authors = authors & Post.user_id.not_in ( large )
+        recent = select ( literal ( user_id ), Post.id, Post.user_id ) \
+            .where ( authors ).order_by ( Post.id.desc () ).limit ( self.length )
+        db.session.execute ( insert ( TimelineEntry ).from_select ( ['user_id', 'post_id', 'author_id'], recent ) )
+
+    def _follower_count(self, user_id):
+        return db.session.execute ( select ( User.follower_count ).where ( User.id == user_id ) ).scalar () or 0
+
+    def _insert(self, rows):
+        """
+        Inserts (user_id, post_id, author_id) entries, ignoring ones already there,
+        and trims about one timeline in TIMELINE_TRIM_EVERY.
+        """
+        db.session.execute (
+            insert ( TimelineEntry ).prefix_with ( 'OR IGNORE', dialect='sqlite' ).prefix_with ( 'IGNORE', dialect='mysql' ),
+            [{'user_id': user_id, 'post_id': post_id, 'author_id': author_id} for user_id, post_id, author_id in rows]
+        )
+        for user_id, post_id, _ in rows:
+            # Spreads the trims over timelines and posts without keeping any state
+            if (user_id + post_id) % self.trim_every == 0:
+                self.trim ( user_id )
+
+    # Background worker
+
+    def _submit(self, function, *args):
+        """
+        Runs a timeline job in the background, or right away with TIMELINE_FANOUT_ASYNC off.
+        """
+        if self.asynchronous:
+            self._queue.put ( (function, args) )
+            self._ensure_worker ()
+        else:
+            function ( *args )
+
+    def flush(self):
+        """
+        Runs every queued job on the calling thread.
+
+        Returns:
+            int: The number of jobs run.
+        """
+        processed = 0
+        while True:
+            try:
+                job = self._queue.get_nowait ()
+            except queue.Empty:
+                return processed
+            self._process ( job )
+            processed += 1
+
+    def _process(self, job):
+        function, args = job
+        try:
+            with self.app.app_context ():
+                try:
+                    function ( *args )
+                except Exception:
+                    db.session.rollback ()
+                    logging.exception ( "Timeline job %s%r failed; `flask timeline rebuild` restores the timelines",
+                                        function.__name__, args )
+                finally:
+                    db.session.remove ()
+        finally:
+            self._queue.task_done ()
+
+    def _ensure_worker(self):
+        """
+        Starts the worker thread in this process if it is not running yet.
+        Started lazily so every forked worker gets its own thread.
+        """
+        if self._thread is not None and self._pid == os.getpid ():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid ():
+                return
+            self._pid = os.getpid ()
+            self._thread = threading.Thread ( target=self._run, name='timeline-fanout', daemon=True )
+            self._thread.start ()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                job = self._queue.get ( timeout=1.0 )
+            except queue.Empty:
+                continue
+            self._process ( job )
+
+    def shutdown(self):
+        """
+        Stops the worker thread and runs the jobs still queued.
+        """
+        self._stopped = True
+        if self._thread is not None and self._thread.is_alive ():
+            self._thread.join ( timeout=5 )
+        if self.app is not None:
+            self.flush ()
+
+
+# An AppGroup runs its commands inside an application context
+timeline_cli = AppGroup ( 'timeline', help="Home timeline commands." )
+
+
+@timeline_cli.command ( 'rebuild' )
+@click.option ( '--batch-size', default=200, show_default=True, help="Users rebuilt per transaction." )
+def rebuild_command(batch_size):
+    """Recreates every user's home timeline from the follow graph."""
+    rebuilt = 0
+    last_id = 0
+    while True:
+        user_ids = db.session.execute (
+            select ( User.id ).where ( User.id > last_id ).order_by ( User.id ).limit ( batch_size )
+        ).scalars ().all ()
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            timelines.rebuild ( user_id )
+        db.session.commit ()
+        rebuilt += len ( user_ids )
+        last_id = user_ids[-1]
+    click.echo ( f"Rebuilt {rebuilt} home timeline(s)." )
+
+
+timelines = HomeTimelines ()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
+
+# Upload limits used when the config does not set them
+DEFAULT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge ( Exception ):
+    """
+    Raised when an uploaded file exceeds MAX_UPLOAD_SIZE.
+    """
+
+
+class SizeLimitedFile:
+    """
+    Wraps the temporary file a multipart file part is written to and aborts
+    the request as soon as more than `max_size` bytes have been written, so
+    oversized uploads are rejected while they are still streaming in.
+    """
+
+    def __init__(self, file, max_size):
+        self._file = file
+        self._max_size = max_size
+        self._written = 0
+
+    def write(self, data):
+        self._written += len ( data )
+        if self._written > self._max_size:
+            raise RequestEntityTooLarge ( "Uploaded file is too large." )
+        return self._file.write ( data )
+
+    def __getattr__(self, name):
+        return getattr ( self._file, name )
+
+    def __iter__(self):
+        return iter ( self._file )
+
+
+class StreamedRequest ( Request ):
+    """
+    Request class that streams every multipart file part straight to a
+    temporary file on disk in the parser's fixed-size chunks, instead of
+    buffering small uploads in memory, and enforces MAX_UPLOAD_SIZE per file.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_size = current_app.config.get ( 'MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE )
+        if content_length is not None and content_length > max_size:
+            raise RequestEntityTooLarge ( "Uploaded file is too large." )
+        return SizeLimitedFile ( tempfile.TemporaryFile ( 'wb+' ), max_size )
+
+
+def get_image_extension(image):
+    """
+    Returns the lower-case file extension for an uploaded image, taken from
+    its MIME type or, failing that, its filename. Returns None if unknown.
+    """
+    if image.mimetype and image.mimetype.startswith ( 'image/' ):
+        return image.mimetype.split ( '/', 1 )[1].lower ()
+    if image.filename and '.' in image.filename:
+        return image.filename.rsplit ( '.', 1 )[1].lower ()
+    return None
+
+
+def save_stream(source, destination, max_size=None, chunk_size=None, hasher=None):
+    """
+    Copies a file-like object to `destination` in fixed-size chunks.
+
+    At most one chunk is held in memory at a time. If more than `max_size`
+    bytes arrive, the partial file is removed and UploadTooLarge is raised.
+    If a `hashlib` object is given, every chunk is fed to it on the way through.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    max_size = max_size or current_app.config.get ( 'MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE )
+    chunk_size = chunk_size or current_app.config.get ( 'UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE )
+
+    os.makedirs ( os.path.dirname ( destination ), exist_ok=True )
+
+    written = 0
+    try:
+        with open ( destination, 'wb' ) as f:
+            while True:
+                chunk = source.read ( chunk_size )
+                if not chunk:
+                    break
+                written += len ( chunk )
+                if written > max_size:
+                    raise UploadTooLarge ( f"Image is larger than {max_size // (1024 * 1024)} MB." )
+                if hasher is not None:
+                    hasher.update ( chunk )
+                f.write ( chunk )
+    except Exception:
+        if os.path.exists ( destination ):
+            os.remove ( destination )
+        raise
+
+    return written
+
@@ -0,0 +1,155 @@
+import threading
+
+from flask import g, has_app_context
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from cache import MemoryCache
+from model import db, User
+
+
+class ProfileRecord:
+    """
+    Read-only snapshot of a Profile row, safe to share between requests and threads.
+    """
+
+    __slots__ = ('id', 'user_id', 'username', 'nickname', 'bio', 'image_path', 'image_variants')
+
+    def __init__(self, profile):
+        self.id = profile.id
+        self.user_id = profile.user_id
+        self.username = profile.username
+        self.nickname = profile.nickname
+        self.bio = profile.bio
+        self.image_path = profile.image_path
+        self.image_variants = profile.image_variants
+
+
+class UserRecord:
+    """
+    Read-only snapshot of a User and their profile, with the attributes the
+    templates read (username, post_count, follower counts, avatar_path, profile).
+    Not attached to a session: load the model itself to change anything.
+    """
+
+    __slots__ = ('id', 'username', 'email', 'post_count', 'follower_count', 'following_count', 'profile')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.post_count = user.post_count
+        self.follower_count = user.follower_count
+        self.following_count = user.following_count
+        self.profile = ProfileRecord ( user.profile ) if user.profile is not None else None
+
+    @property
+    def avatar_path(self):
+        return self.profile.image_path if self.profile is not None and self.profile.image_path else None
+
+    @property
+    def profiles(self):
+        return [self.profile] if self.profile is not None else []
+
+
+class UserCache:
+    """
+    Read-through cache of user and profile records.
+
+    Lookups are answered from the current request first (so the same user is
+    loaded at most once per request), then from a process-wide LRU / TTL cache,
+    and only then from the database. Write paths that change a user, their
+    profile or their post count call `invalidate` after committing.
+
+    Every process has its own cache; another process may serve a record up to
+    USER_CACHE_TTL seconds old after a write it did not handle.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.cache = None
+        self._lock = threading.Lock ()
+        self.request_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app ( app )
+
+    def init_app(self, app):
+        self.enabled = app.config.get ( 'USER_CACHE_ENABLED', True )
+        self.cache = MemoryCache (
+            max_entries=app.config.get ( 'USER_CACHE_MAX_ENTRIES', 10000 ),
+            default_ttl=app.config.get ( 'USER_CACHE_TTL', 60 ),
+        )
+        app.extensions['user_cache'] = self
+
+    def get_user(self, user_id):
+        """
+        Returns the UserRecord for `user_id`, or None if there is no such user.
+        """
+        if user_id is None:
+            return None
+        user_id = int ( user_id )
+
+        request_records = self._request_records ()
+        if user_id in request_records:
+            self._count ( 'request_hits' )
+            return request_records[user_id]
+
+        record = self.cache.get ( user_id ) if self.enabled else None
+        if record is not None:
+            self._count ( 'hits' )
+        else:
+            self._count ( 'misses' )
+            record = self.load_user ( user_id )
+            if record is not None and self.enabled:
+                self.cache.set ( user_id, record )
+
+        request_records[user_id] = record
+        return record
+
+    def get_profile(self, user_id):
+        """
+        Returns the ProfileRecord of a user, or None if they have not created a profile.
+        """
+        record = self.get_user ( user_id )
+        return record.profile if record is not None else None
+
+    def load_user(self, user_id):
+        """
+        Loads a user with their profile from the database.
+        """
+        user = db.session.execute (
+            select ( User ).options ( selectinload ( User.profiles ) ).where ( User.id == user_id )
+        ).scalar ()
+        return UserRecord ( user ) if user is not None else None
+
+    def invalidate(self, user_id):
+        """
+        Drops the cached record of a user from this request and from the process cache.
+        """
+        if user_id is None:
+            return
+        user_id = int ( user_id )
+        if self.cache is not None:
+            self.cache.delete ( user_id )
+        self._request_records ().pop ( user_id, None )
+
+    def stats(self):
+        """
+        Returns the hit / miss counters since the process started.
+        """
+        return {'request_hits': self.request_hits, 'hits': self.hits, 'misses': self.misses}
+
+    def _request_records(self):
+        if not has_app_context ():
+            return {}
+        return g.setdefault ( 'user_records', {} )
+
+    def _count(self, counter):
+        with self._lock:
+            setattr ( self, counter, getattr ( self, counter ) + 1 )
+
+
+user_cache = UserCache ()